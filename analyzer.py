@@ -0,0 +1,77 @@
+# analyzer.py
+import re
+import sys
+from functools import lru_cache
+from nltk.stem import PorterStemmer
+from config import Config
+
+# Text -> index terms, shared by indexing and search so both sides agree:
+# lower-case \w+ tokens, English stop words dropped, Porter stems.
+
+TOKEN_RE = re.compile(r'\w+')
+BOUNDARY_RE = re.compile(r'\W')
+
+
+def english_stop_words():
+    from nltk.corpus import stopwords
+    return stopwords.words("english")
+
+
+class Analyzer:
+    """
+    Term frequencies are heavily skewed, so the same few thousand tokens
+    make up most of any text. Each distinct token is resolved once, into
+    its interned stem or None for a stop word, and remembered in a bounded
+    LRU cache (Config.ANALYZER_STEM_CACHE entries); after that a token costs
+    one cache lookup. Terms are interned, so term lists of many documents
+    share their strings.
+    """
+
+    def __init__(self, stop_words=None, cache_size=None):
+        if stop_words is None:
+            stop_words = english_stop_words()
+        self.stop_words = frozenset(sys.intern(word) for word in stop_words)
+        self.stemmer = PorterStemmer()
+        self.term = lru_cache(maxsize=cache_size or Config.ANALYZER_STEM_CACHE)(self._term)
+
+    def _term(self, token):
+        if token in self.stop_words:
+            return None
+        return sys.intern(self.stemmer.stem(token))
+
+    @staticmethod
+    def chunks(text, size=None):
+        """`text` in pieces of about `size` characters, cut only between tokens."""
+        size = size or Config.ANALYZER_CHUNK_CHARS
+        start = 0
+        while start < len(text):
+            boundary = BOUNDARY_RE.search(text, start + size) if start + size < len(text) else None
+            end = boundary.start() if boundary else len(text)
+            yield text[start:end]
+            start = end
+
+    def iter_terms(self, text):
+        """Terms of `text`, lazily: large texts are lower-cased and tokenized one chunk at a time."""
+        term = self.term
+        for chunk in self.chunks(text):
+            for token in TOKEN_RE.findall(chunk.lower()):
+                stem = term(token)
+                if stem is not None:
+                    yield stem
+
+    def analyze(self, text):
+        return list(self.iter_terms(text))
+
+    def cache_info(self):
+        return self.term.cache_info()
+
+
+_analyzer = None
+
+
+def get_analyzer():
+    """The analyzer shared by everything in this process (indexer, search)."""
+    global _analyzer
+    if _analyzer is None:
+        _analyzer = Analyzer()
+    return _analyzer
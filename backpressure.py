@@ -0,0 +1,87 @@
+# backpressure.py
+import threading
+import time
+from collections import deque
+from config import Config
+from redis_clinet import r
+
+# Key layout (shared by every master):
+#   dispatch:inflight   ZSET  "<job>|<url>" -> dispatch time of crawls published but not finished
+#   dispatch:completed  STR   running count of finished crawls (throughput meter)
+
+
+class DispatchBudget:
+    """
+    Caps how many URLs are out with the crawler cluster at once.
+
+    The cap follows measured throughput: enough work for
+    Config.DISPATCH_TARGET_SECONDS at the rate crawls have been finishing over
+    the last Config.DISPATCH_RATE_WINDOW seconds, clamped to
+    [Config.DISPATCH_MIN_IN_FLIGHT, Config.DISPATCH_MAX_IN_FLIGHT]. URLs whose
+    result never arrives stop counting after Config.DISPATCH_TIMEOUT seconds.
+    The dispatch loop takes throughput samples (limit(), available());
+    stats() only reads them, from any thread.
+    """
+
+    def __init__(self, prefix='dispatch:'):
+        self.inflight_key = f"{prefix}inflight"
+        self.completed_key = f"{prefix}completed"
+        self._samples = deque()  # (monotonic time, completed counter)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _member(job_id, url):
+        return f"{job_id}|{url}"
+
+    def dispatched(self, job_id, urls):
+        now = time.time()
+        r.zadd(self.inflight_key, {self._member(job_id, url): now for url in urls})
+
+    def completed(self, crawls, pipe=None):
+        """Record finished (job id, url) crawls; pass a pipeline to bundle it with other writes."""
+        members = [self._member(job_id, url) for job_id, url in crawls]
+        if not members:
+            return
+        target = pipe if pipe is not None else r.pipeline(transaction=False)
+        target.zrem(self.inflight_key, *members)
+        target.incrby(self.completed_key, len(members))
+        if pipe is None:
+            target.execute()
+
+    def in_flight(self):
+        pipe = r.pipeline(transaction=False)
+        pipe.zremrangebyscore(self.inflight_key, '-inf', time.time() - Config.DISPATCH_TIMEOUT)
+        pipe.zcard(self.inflight_key)
+        return pipe.execute()[1]
+
+    def throughput(self, sample=True):
+        """
+        Crawls finished per second across the cluster over the recent window.
+        `sample` first records the current counter (the dispatch loop does).
+        """
+        with self._lock:
+            if sample:
+                now = time.monotonic()
+                self._samples.append((now, int(r.get(self.completed_key) or 0)))
+                while len(self._samples) > 2 and now - self._samples[1][0] >= Config.DISPATCH_RATE_WINDOW:
+                    self._samples.popleft()
+            if not self._samples:
+                return 0.0
+            (t0, c0), (t1, c1) = self._samples[0], self._samples[-1]
+        return (c1 - c0) / (t1 - t0) if t1 > t0 else 0.0
+
+    def limit(self, sample=True):
+        target = self.throughput(sample) * Config.DISPATCH_TARGET_SECONDS
+        return int(min(Config.DISPATCH_MAX_IN_FLIGHT, max(Config.DISPATCH_MIN_IN_FLIGHT, target)))
+
+    def available(self):
+        """How many more URLs may be dispatched right now."""
+        return max(0, self.limit() - self.in_flight())
+
+    def stats(self):
+        """Current figures without touching the samples or the in-flight set."""
+        return {
+            "in_flight": r.zcount(self.inflight_key, time.time() - Config.DISPATCH_TIMEOUT, '+inf'),
+            "limit": self.limit(sample=False),
+            "throughput_per_sec": round(self.throughput(sample=False), 2),
+        }
@@ -0,0 +1,90 @@
+# bench_analyzer.py
+"""
+Compare the cached analyzer with the previous per-token tokenizer.
+
+    python bench_analyzer.py saved_pages/ [more.txt ...] [--rounds 5]
+
+Reads .txt files as they are and .html pages through the configured
+extractor, then reports tokens/sec per core for the old path (findall +
+uncached PorterStemmer.stem on every token) and for analyzer.Analyzer,
+cold (first round) and warm, and checks both produce the same terms.
+"""
+import argparse
+import os
+import re
+import time
+from nltk.stem import PorterStemmer
+from analyzer import Analyzer, english_stop_words
+from extractor import get_extractor
+
+
+def load_texts(paths):
+    extract = get_extractor()
+    texts = []
+    for path in paths:
+        files = [path]
+        if os.path.isdir(path):
+            files = [os.path.join(root, name)
+                     for root, _dirs, names in os.walk(path)
+                     for name in names if name.endswith(('.txt', '.html', '.htm'))]
+        for name in files:
+            with open(name, encoding='utf-8', errors='replace') as f:
+                data = f.read()
+            texts.append(extract(data, 'https://example.com/')[0] if name.endswith(('.html', '.htm')) else data)
+    return texts
+
+
+def baseline(stop_words):
+    """IndexerNode.tokenize_and_normalize before analyzer.py."""
+    stemmer = PorterStemmer()
+    stop_words = set(stop_words)
+
+    def tokenize_and_normalize(text):
+        tokens = re.findall(r'\w+', text.lower())
+        normalized_tokens = []
+        for token in tokens:
+            if token not in stop_words:
+                normalized_tokens.append(stemmer.stem(token))
+        return normalized_tokens
+    return tokenize_and_normalize
+
+
+def bench(analyze, texts, tokens, rounds):
+    """(tokens/sec of the first round, of the remaining rounds, terms per round)"""
+    rates, terms = [], 0
+    for _ in range(rounds):
+        start = time.process_time()
+        terms = sum(len(analyze(text)) for text in texts)
+        rates.append(tokens / max(time.process_time() - start, 1e-9))
+    warm = rates[1:] or rates
+    return rates[0], sum(warm) / len(warm), terms
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument('paths', nargs='+', help='text/HTML files or directories of them')
+    ap.add_argument('--rounds', type=int, default=5)
+    args = ap.parse_args()
+
+    texts = load_texts(args.paths)
+    if not texts:
+        raise SystemExit('no .txt or .html files found')
+    stop_words = english_stop_words()
+    old, new = baseline(stop_words), Analyzer(stop_words)
+    mismatched = sum(old(text) != new.analyze(text) for text in texts)
+    new = Analyzer(stop_words)  # start the timed runs with an empty cache
+    tokens = sum(len(re.findall(r'\w+', text)) for text in texts)
+    print(f"{len(texts)} texts, {sum(map(len, texts)) / 1e6:.1f} MB, {tokens} tokens, "
+          f"{args.rounds} rounds, {mismatched} texts with different terms")
+    print(f"{'analyzer':<12} {'cold tokens/s':>14} {'warm tokens/s':>14} {'terms':>10}")
+    old_cold, old_warm, terms = bench(old, texts, tokens, args.rounds)
+    print(f"{'baseline':<12} {old_cold:>14.0f} {old_warm:>14.0f} {terms:>10}")
+    new_cold, new_warm, terms = bench(new.analyze, texts, tokens, args.rounds)
+    print(f"{'cached':<12} {new_cold:>14.0f} {new_warm:>14.0f} {terms:>10}")
+    info = new.cache_info()
+    print(f"cached vs baseline: {new_cold / old_cold:.1f}x cold, {new_warm / old_warm:.1f}x warm; "
+          f"stem cache {info.currsize} entries, hit rate {info.hits / max(1, info.hits + info.misses):.1%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+# bench_extract.py
+"""
+Compare HTML extraction backends on saved pages.
+
+    python bench_extract.py saved_pages/ [more.html ...] [--rounds 5]
+
+Runs every available backend over the same pages in this single process and
+reports pages/sec per core, plus how much text and how many links each found.
+"""
+import argparse
+import os
+import time
+from extractor import EXTRACTORS
+
+
+def load_pages(paths):
+    pages = []
+    for path in paths:
+        files = [path]
+        if os.path.isdir(path):
+            files = [os.path.join(root, name)
+                     for root, _dirs, names in os.walk(path)
+                     for name in names if name.endswith(('.html', '.htm'))]
+        for name in files:
+            with open(name, encoding='utf-8', errors='replace') as f:
+                pages.append(f.read())
+    return pages
+
+
+def bench(extract, pages, rounds):
+    chars = links = 0
+    start = time.process_time()
+    for _ in range(rounds):
+        for html in pages:
+            text, found = extract(html, 'https://example.com/')
+            chars += len(text)
+            links += len(found)
+    elapsed = time.process_time() - start
+    n = len(pages) * rounds
+    return n / elapsed if elapsed else float('inf'), chars // rounds, links // rounds
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument('paths', nargs='+', help='HTML files or directories of saved pages')
+    ap.add_argument('--rounds', type=int, default=5)
+    args = ap.parse_args()
+
+    pages = load_pages(args.paths)
+    if not pages:
+        raise SystemExit('no .html pages found')
+    mb = sum(len(p) for p in pages) / 1e6
+    print(f"{len(pages)} pages, {mb:.1f} MB, {args.rounds} rounds")
+    print(f"{'backend':<12} {'pages/s/core':>12} {'text chars':>12} {'links':>8}")
+    rates = {}
+    for name, extract in EXTRACTORS.items():
+        rates[name], chars, links = bench(extract, pages, args.rounds)
+        print(f"{name:<12} {rates[name]:>12.1f} {chars:>12} {links:>8}")
+    for name, rate in rates.items():
+        if name != 'bs4':
+            print(f"{name} vs bs4 (current path): {rate / rates['bs4']:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,310 @@
+# checkpoint.py
+import gzip
+import io
+import json
+import logging
+import os
+import struct
+import time
+from config import Config
+from redis_clinet import r, r_bin
+from jobs import JobRegistry
+
+logger = logging.getLogger(__name__)
+
+# A checkpoint file is gzip of MAGIC followed by sections:
+#   >H name length, >Q data length, name (utf-8), data
+# Section names:
+#   master            JSON: kind, creation time and this master's counters
+#   redis:<key>       DUMP payload of a Redis key (crawl jobs, job counters,
+#                     every job's frontier and Redis seen-set keys)
+#   seen:<job>:<part> in-process seen-set state (bloom / fingerprint backends)
+#   journal:<job>     "<depth> <url>" lines admitted since the previous checkpoint
+# "full" checkpoints carry redis: and seen: sections; "delta" checkpoints only
+# the journals. MANIFEST names the latest full checkpoint and the deltas
+# written after it; it is replaced only after the data file is stored, so a
+# crash mid-write leaves the previous checkpoint in place.
+
+MAGIC = b"CRAWLCKPT1\n"
+MANIFEST = "MANIFEST.json"
+
+
+def encode_sections(sections):
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode="wb", compresslevel=Config.CHECKPOINT_COMPRESSION) as gz:
+        gz.write(MAGIC)
+        for name, data in sections.items():
+            name = name.encode()
+            gz.write(struct.pack(">HQ", len(name), len(data)))
+            gz.write(name)
+            gz.write(data)
+    return buf.getvalue()
+
+
+def decode_sections(blob):
+    data = gzip.decompress(blob)
+    if not data.startswith(MAGIC):
+        raise ValueError("not a crawl checkpoint")
+    sections, pos = {}, len(MAGIC)
+    while pos < len(data):
+        name_len, data_len = struct.unpack_from(">HQ", data, pos)
+        pos += 10
+        name = data[pos:pos + name_len].decode()
+        pos += name_len
+        sections[name] = data[pos:pos + data_len]
+        pos += data_len
+    return sections
+
+
+class LocalStore:
+    """Checkpoint files in a local directory; every write is tmp file + rename."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def put(self, name, data):
+        path = os.path.join(self.directory, name)
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def get(self, name):
+        try:
+            with open(os.path.join(self.directory, name), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def delete(self, name):
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            pass
+
+
+class S3Store:
+    """Checkpoint objects under an S3 prefix (a PUT replaces an object atomically)."""
+
+    def __init__(self, bucket, prefix):
+        import boto3
+        self.s3 = boto3.client("s3", region_name=os.getenv("AWS_REGION", "eu-north-1"))
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def put(self, name, data):
+        self.s3.put_object(Bucket=self.bucket, Key=f"{self.prefix}{name}", Body=data)
+
+    def get(self, name):
+        try:
+            return self.s3.get_object(Bucket=self.bucket, Key=f"{self.prefix}{name}")["Body"].read()
+        except self.s3.exceptions.NoSuchKey:
+            return None
+
+    def delete(self, name):
+        self.s3.delete_object(Bucket=self.bucket, Key=f"{self.prefix}{name}")
+
+
+def make_store():
+    """S3 when Config.CHECKPOINT_S3_PREFIX is set, else Config.CHECKPOINT_DIR."""
+    if Config.CHECKPOINT_S3_PREFIX:
+        return S3Store(os.environ["S3_BUCKET"], Config.CHECKPOINT_S3_PREFIX)
+    return LocalStore(Config.CHECKPOINT_DIR)
+
+
+class Checkpointer:
+    """
+    Periodic checkpoints of a MasterNode's crawl state and restore on start.
+
+    A full checkpoint DUMPs every Redis key of every job (frontier, Redis
+    seen-set, settings, counters) and snapshots in-process seen-sets; the
+    deltas in between only carry the URLs journaled by Frontier.push_many,
+    so their cost follows the crawl rate, not the crawl size. Only one
+    master writes at a time (Redis lock).
+    """
+
+    lock_key = "checkpoint:lock"
+
+    def __init__(self, master, store=None):
+        self.master = master
+        self.store = store or make_store()
+        self._last = time.monotonic()
+        self._loaded = (None, [])
+
+    def manifest(self):
+        raw = self.store.get(MANIFEST)
+        return json.loads(raw) if raw else None
+
+    # -- writing -----------------------------------------------------------
+
+    def maybe_checkpoint(self):
+        """Write a checkpoint if Config.CHECKPOINT_INTERVAL has passed."""
+        if time.monotonic() - self._last < Config.CHECKPOINT_INTERVAL:
+            return None
+        self._last = time.monotonic()
+        return self.checkpoint()
+
+    def checkpoint(self, full=None):
+        """Write a full or delta checkpoint. Returns its name, or None if another master holds the lock."""
+        if not r.set(self.lock_key, os.getpid(), nx=True, ex=max(60, Config.CHECKPOINT_INTERVAL)):
+            return None
+        try:
+            manifest = self.manifest()
+            if full is None:
+                full = manifest is None or len(manifest["deltas"]) + 1 >= Config.CHECKPOINT_FULL_EVERY
+            kind = "full" if full else "delta"
+            started = time.time()
+            sections = {"master": json.dumps({
+                "kind": kind,
+                "created": started,
+                "crawled_count": self.master.crawled_count,
+                "canonicalization_saved": self.master.canonicalization_saved,
+                "recently_crawled": list(self.master.recently_crawled),
+            }).encode()}
+            drained = {}
+            for job in self.master.jobs:
+                # Drain first: anything journaled from here on is also in the snapshot
+                # or the next delta, and replaying a URL twice is harmless.
+                drained[job] = job.frontier.read_journal(drain=True)
+                if not full:
+                    sections[f"journal:{job.id}"] = "\n".join(drained[job]).encode()
+            try:
+                if full:
+                    sections.update(self._snapshot())
+                name = f"ckpt-{int(started * 1000)}-{kind}.bin"
+                blob = encode_sections(sections)
+                self.store.put(name, blob)
+            except Exception:
+                # Nothing was committed: put the drained journal back for the next attempt.
+                for job, lines in drained.items():
+                    if lines:
+                        r.lpush(f"{job.frontier.prefix}journal", *reversed(lines))
+                raise
+            self._commit(manifest, name, full)
+            logger.info(f"Wrote {kind} checkpoint {name}: {len(blob)} bytes, "
+                        f"{len(sections)} sections in {time.time() - started:.2f}s")
+            return name
+        finally:
+            r.delete(self.lock_key)
+
+    def _snapshot(self):
+        keys = [JobRegistry.key, JobRegistry.completed_key, "crawl_stats"]
+        sections = {}
+        for job in self.master.jobs:
+            keys.append(job.stats_key)
+            keys += job.frontier.redis_keys()
+            for part, data in job.frontier.seen.snapshot().items():
+                sections[f"seen:{job.id}:{part}"] = data
+        for start in range(0, len(keys), Config.CHECKPOINT_DUMP_BATCH):
+            chunk = keys[start:start + Config.CHECKPOINT_DUMP_BATCH]
+            pipe = r_bin.pipeline(transaction=False)
+            for key in chunk:
+                pipe.dump(key)
+            for key, payload in zip(chunk, pipe.execute()):
+                if payload is not None:
+                    sections[f"redis:{key}"] = payload
+        return sections
+
+    def _commit(self, manifest, name, full):
+        if full or manifest is None:
+            history = ([{"base": manifest["base"], "deltas": manifest["deltas"]}] if manifest else [])
+            history += manifest.get("history", []) if manifest else []
+            for old in history[Config.CHECKPOINT_KEEP - 1:]:
+                for old_name in [old["base"]] + old["deltas"]:
+                    self.store.delete(old_name)
+            manifest = {"base": name, "deltas": [], "history": history[:Config.CHECKPOINT_KEEP - 1]}
+        else:
+            manifest["deltas"].append(name)
+        manifest["updated"] = time.time()
+        self.store.put(MANIFEST, json.dumps(manifest).encode())
+
+    # -- restoring ---------------------------------------------------------
+
+    def load(self):
+        """Sections of the latest full checkpoint and of its deltas, oldest first."""
+        manifest = self.manifest()
+        if manifest is None:
+            return None, []
+        base = decode_sections(self.store.get(manifest["base"]))
+        deltas = []
+        for name in manifest["deltas"]:
+            blob = self.store.get(name)
+            if blob is None:
+                logger.warning(f"Checkpoint delta {name} missing, stopping replay there")
+                break
+            deltas.append(decode_sections(blob))
+        return base, deltas
+
+    @staticmethod
+    def redis_is_empty():
+        return not r.exists(JobRegistry.key)
+
+    def restore_redis(self, base):
+        """RESTORE every Redis key from a full checkpoint (only into an empty Redis)."""
+        items = [(name[len("redis:"):], data) for name, data in base.items() if name.startswith("redis:")]
+        for start in range(0, len(items), Config.CHECKPOINT_DUMP_BATCH):
+            pipe = r_bin.pipeline(transaction=False)
+            for key, payload in items[start:start + Config.CHECKPOINT_DUMP_BATCH]:
+                pipe.restore(key, 0, payload, replace=True)
+            pipe.execute()
+        return len(items)
+
+    def restore(self, redis_empty):
+        """
+        Bring this master back to its latest checkpoint: Redis keys (only if
+        Redis lost its crawl state), in-process seen-sets, counters, then the
+        journals of the deltas and the journal not yet checkpointed. Journaled
+        URLs are re-queued when Redis was restored, since the frontier is
+        only as new as the full checkpoint.
+        Called by MasterNode after restore_redis() and loading the job registry.
+        """
+        started = time.time()
+        base, deltas = self._loaded
+        if base is None:
+            return False
+        master = json.loads(base["master"])
+        for delta in deltas:
+            master.update({k: v for k, v in json.loads(delta["master"]).items() if k != "kind"})
+        self.master.crawled_count = master.get("crawled_count", 0)
+        self.master.canonicalization_saved = master.get("canonicalization_saved", 0)
+        self.master.recently_crawled.extend(master.get("recently_crawled", []))
+        replayed = 0
+        for job in self.master.jobs:
+            parts = {name.split(":", 2)[2]: data for name, data in base.items()
+                     if name.startswith(f"seen:{job.id}:")}
+            if parts:
+                job.frontier.seen.restore(parts)
+            lines = []
+            for delta in deltas:
+                journal = delta.get(f"journal:{job.id}", b"").decode()
+                lines.extend(journal.split("\n") if journal else [])
+            lines.extend(job.frontier.read_journal())
+            entries = [(url, int(depth)) for depth, url in (line.split(" ", 1) for line in lines)]
+            if redis_empty:
+                replayed += job.frontier.push_many(entries)
+            elif entries and not job.frontier.seen.redis_keys():
+                # Redis kept its state; only in-process seen-sets need the replay.
+                job.frontier.seen.add_many(url for url, _depth in entries)
+        logger.info(f"Restored checkpoint from {time.ctime(master['created'])} "
+                    f"({len(deltas)} deltas, {replayed} URLs re-queued) in {time.time() - started:.2f}s")
+        return True
+
+    def restore_before_jobs(self):
+        """
+        First restore step, run before the job registry is loaded: reads the
+        checkpoint and RESTOREs Redis keys if Redis has no crawl state.
+        Returns whether Redis was empty.
+        """
+        redis_empty = self.redis_is_empty()
+        try:
+            self._loaded = self.load()
+        except Exception as e:
+            logger.error(f"Could not read checkpoint: {e}")
+            return redis_empty
+        base = self._loaded[0]
+        if base is not None and redis_empty:
+            logger.warning(f"Redis has no crawl state; restored {self.restore_redis(base)} keys from checkpoint")
+        return redis_empty
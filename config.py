@@ -1,4 +1,5 @@
 # config.py
+import json
 import os
 
 class Config:
@@ -14,12 +15,134 @@ class Config:
     CRAWL_DELAY = 1  # seconds
     MAX_RETRIES = 3
     HEARTBEAT_INTERVAL = 30  # seconds
+    HEARTBEAT_TIMEOUT = 2 * HEARTBEAT_INTERVAL  # no beat for this long = worker is dead
+    FAILOVER_BATCH_SIZE = 1000  # dead tasks handled per monitor pass
+    STATE_LIST_LIMIT = 100  # ids/URLs listed by /state
+    STATE_PAGE_LIMIT = 1000  # max page size of /queue and /crawled
+    STATE_REFRESH = 1  # seconds between /state counter refreshes
+    STATE_STREAM_KEEPALIVE = 15  # seconds; comment line sent to idle /state/stream clients
     MAX_CRAWLERS = 7
+    FETCH_TIMEOUT = 5  # seconds
+    MAX_BODY_BYTES = int(os.environ.get('MAX_BODY_BYTES', 2 * 1024 * 1024))  # larger bodies are truncated
+    DOWNLOAD_CHUNK_BYTES = 64 * 1024
+    ENCODING_SNIFF_BYTES = 16 * 1024  # charset detection never looks further than this
+    ALLOWED_CONTENT_TYPES = ('text/html', 'application/xhtml+xml', 'text/plain')
+
+    # Per-worker-process connection reuse
+    HTTP_POOL_HOSTS = 100  # hosts with a kept-alive connection pool
+    HTTP_POOL_PER_HOST = 10  # connections kept per host
+    HTTP_KEEPALIVE = 30  # seconds an idle aiohttp connection is kept
+    DNS_CACHE_TTL = 300  # seconds
+    DNS_CACHE_SIZE = 10000
+
+    # Async crawl engine (crawl_batch task)
+    CRAWL_BATCH_SIZE = int(os.environ.get('CRAWL_BATCH_SIZE', 50))  # URLs per task; 1 = one crawl_page per URL
+    ASYNC_MAX_IN_FLIGHT = int(os.environ.get('ASYNC_MAX_IN_FLIGHT', 200))  # concurrent fetches per worker process
+    ASYNC_PER_HOST_IN_FLIGHT = int(os.environ.get('ASYNC_PER_HOST_IN_FLIGHT', 2))  # concurrent fetches per host
     
-    # Index file location
+    # Per-domain URL canonicalization rules, keyed by domain suffix, e.g.
+    # '{"example.com": {"strip_trailing_slash": false, "drop_params": ["sessionid"]}}'
+    URL_CANON_RULES = json.loads(os.environ.get('URL_CANON_RULES', '{}'))
+
+    # Shared URL frontier (Redis)
+    FRONTIER_PREFIX = os.environ.get('FRONTIER_PREFIX', 'frontier:')
+    FRONTIER_LEASE = 60  # seconds a claimed URL may stay unacknowledged
+    FRONTIER_BATCH_SIZE = 500  # URLs per push round trip
+    JOB_RETENTION = int(os.environ.get('JOB_RETENTION', 86400))  # seconds a completed crawl job is kept
+    # Priority within a host queue: bfs (depth) | backlinks | opic (see scoring.py)
+    FRONTIER_SCORER = os.environ.get('FRONTIER_SCORER', 'bfs')
+    BACKLINK_WEIGHT = float(os.environ.get('BACKLINK_WEIGHT', 0.25))  # depth levels gained per extra in-link
+    OPIC_DEPTH_WEIGHT = 0.01  # opic: tie-break on depth
+    # Seen-URL set: redis-set (exact, shared) | redis-bloom (shared bitmap) |
+    # bloom (local) | fingerprint (local, exact 64-bit hashes)
+    SEEN_SET_BACKEND = os.environ.get('SEEN_SET_BACKEND', 'redis-set')
+    SEEN_SET_CAPACITY = int(os.environ.get('SEEN_SET_CAPACITY', 1_000_000))  # first Bloom filter size
+    SEEN_SET_FP_RATE = float(os.environ.get('SEEN_SET_FP_RATE', 0.001))
+    SEEN_SET_MERGE_SIZE = 65536  # fingerprint backend: recent additions before merging
+    RECENT_CRAWLED = 100  # dispatched URLs kept for /state
+
+    # Master checkpoints: full DUMP of the crawl state every CHECKPOINT_FULL_EVERY
+    # checkpoints, journal deltas in between (see checkpoint.py)
+    CHECKPOINT_ENABLED = os.environ.get('CHECKPOINT_ENABLED', '1') == '1'
+    CHECKPOINT_INTERVAL = int(os.environ.get('CHECKPOINT_INTERVAL', 300))  # seconds
+    CHECKPOINT_FULL_EVERY = 12
+    CHECKPOINT_KEEP = 2  # full checkpoints (with their deltas) kept
+    CHECKPOINT_DIR = os.environ.get('CHECKPOINT_DIR', os.path.join(BASE_DIR, 'data', 'checkpoints'))
+    CHECKPOINT_S3_PREFIX = os.environ.get('CHECKPOINT_S3_PREFIX', '')  # e.g. 'checkpoints/'; empty = local disk
+    CHECKPOINT_COMPRESSION = 1  # gzip level
+    CHECKPOINT_DUMP_BATCH = 500  # Redis keys per DUMP/RESTORE pipeline
+
+    # Dispatch backpressure: URLs handed to crawlers but not yet finished
+    DISPATCH_TARGET_SECONDS = int(os.environ.get('DISPATCH_TARGET_SECONDS', 30))  # work queued ahead, in seconds of throughput
+    DISPATCH_MIN_IN_FLIGHT = int(os.environ.get('DISPATCH_MIN_IN_FLIGHT', 200))
+    DISPATCH_MAX_IN_FLIGHT = int(os.environ.get('DISPATCH_MAX_IN_FLIGHT', 5000))
+    DISPATCH_RATE_WINDOW = 60  # seconds of completions used to measure throughput
+    DISPATCH_TIMEOUT = 900  # seconds before an unfinished dispatch stops counting
+
+    # Crawl results stream (worker -> master)
+    RESULT_STREAM = 'crawl_results'
+    RESULT_GROUP = 'masters'
+    RESULT_STREAM_MAXLEN = 100000  # approximate cap on retained entries
+    RESULT_BATCH_SIZE = 500  # results read per XREADGROUP
+    RESULT_BLOCK_MS = 1000  # how long a master blocks waiting for results
+    RESULT_CLAIM_IDLE = 60  # seconds before another master takes over pending results
+
+    # Prometheus-style metrics (served by the master at /metrics)
+    METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # histogram bounds, seconds
+    METRICS_FLUSH_INTERVAL = int(os.environ.get('METRICS_FLUSH_INTERVAL', 10))  # seconds between worker flushes
+    METRICS_MAX_HOSTS = int(os.environ.get('METRICS_MAX_HOSTS', 200))  # host labels, cluster-wide, before "other"
+
+    # HTML extraction backend: auto | lxml | html.parser | bs4
+    HTML_EXTRACTOR = os.environ.get('HTML_EXTRACTOR', 'auto')
+    VALIDATORS_EXPIRE = 30 * 24 * 3600  # keep ETag/Last-Modified/text hash per URL for 30 days
+
+    # Near-duplicate detection (SimHash)
+    DEDUP_ENABLED = os.environ.get('DEDUP_ENABLED', '1') == '1'
+    SIMHASH_MAX_DISTANCE = int(os.environ.get('SIMHASH_MAX_DISTANCE', 3))  # max differing bits of 64
+    SIMHASH_MIN_WORDS = 50  # shorter pages are not fingerprinted
+
+    # Crawl storage: rolling gzip WARC-style segments instead of one S3 object per page
+    SEGMENT_WRITER_ENABLED = os.environ.get('SEGMENT_WRITER_ENABLED', '1') == '1'
+    SEGMENT_MAX_BYTES = int(os.environ.get('SEGMENT_MAX_BYTES', 16 * 1024 * 1024))  # compressed bytes
+    SEGMENT_MAX_AGE = int(os.environ.get('SEGMENT_MAX_AGE', 30))  # seconds
+    SEGMENT_MAX_BUFFER = int(os.environ.get('SEGMENT_MAX_BUFFER', 4 * SEGMENT_MAX_BYTES))  # bytes held while uploads fail
+
+    # Bulk indexing: each indexer process buffers documents for one _bulk request
+    INDEX_BULK_DOCS = int(os.environ.get('INDEX_BULK_DOCS', 500))
+    INDEX_BULK_BYTES = int(os.environ.get('INDEX_BULK_BYTES', 5 * 1024 * 1024))  # JSON bytes per request
+    INDEX_BULK_MAX_AGE = float(os.environ.get('INDEX_BULK_MAX_AGE', 2))  # seconds a document may wait
+    INDEX_BULK_RETRIES = 3  # re-sends of a document rejected with 429/5xx
+    INDEX_BULK_RETRY_BACKOFF = float(os.environ.get('INDEX_BULK_RETRY_BACKOFF', 1))  # seconds before the first re-send, doubled per attempt
+
+    # Web tier search cache (search_service.py)
+    SEARCH_CACHE_SIZE = int(os.environ.get('SEARCH_CACHE_SIZE', 1024))  # cached queries (LRU)
+    SEARCH_CACHE_TTL = int(os.environ.get('SEARCH_CACHE_TTL', 300))  # seconds
+    SEARCH_GENERATION_POLL = 1  # seconds between reads of the index generation counter
+    SEARCH_GENERATION_INTERVAL = int(os.environ.get('SEARCH_GENERATION_INTERVAL', 10))  # min seconds between generation bumps
+    SEARCH_LATENCY_WINDOW = 1000  # recent searches behind the p50/p99 figures
+
+    # Text analysis (analyzer.py)
+    ANALYZER_STEM_CACHE = int(os.environ.get('ANALYZER_STEM_CACHE', 100000))  # distinct tokens remembered
+    ANALYZER_CHUNK_CHARS = 1 << 20  # texts are tokenized in pieces of about this many characters
+
+    # Search index: opensearch | local (embedded BM25 segments, no cluster needed)
+    INDEX_BACKEND = os.environ.get('INDEX_BACKEND', 'opensearch')
+    INDEX_NAME = os.environ.get('INDEX_NAME', 'web-crawl-v2')  # compact model, see index_schema.py
+    LEGACY_INDEX_NAME = 'web-crawl'  # full content + tokens; searched until migrated
+    INDEX_SNIPPET_CHARS = 300  # text stored per document for result snippets
     INDEX_DIR = os.path.join(BASE_DIR, 'data')
-    INDEX_FILE = os.path.join(INDEX_DIR, 'index_store.json')
+    LOCAL_INDEX_DIR = os.environ.get('LOCAL_INDEX_DIR', os.path.join(INDEX_DIR, 'local_index'))
+    LOCAL_INDEX_MERGE_FACTOR = 8  # merge this many neighbouring segments once there are more
+    LOCAL_INDEX_MERGE_INTERVAL = 30  # seconds between merge checks in an indexer process
+    BM25_K1 = 1.2
+    BM25_B = 0.75
     
     # Politeness settings
     USER_AGENT = 'MyCustomBot/1.0'
-    ROBOTS_CACHE_EXPIRE = 3600  # 1 hour
\ No newline at end of file
+    ROBOTS_CACHE_EXPIRE = 3600  # 1 hour
+    ROBOTS_ERROR_CACHE_EXPIRE = 300  # negative entries (robots.txt unreachable)
+    ROBOTS_LRU_SIZE = 1024  # parsed robots.txt kept per worker process
+    MAX_CRAWL_DELAY = 30  # seconds; upper bound for robots.txt Crawl-delay
+    # Per-host crawl delay overrides in seconds, e.g. '{"en.wikipedia.org": 0.5}'
+    HOST_CRAWL_DELAYS = {host.lower(): float(delay) for host, delay in
+                         json.loads(os.environ.get('HOST_CRAWL_DELAYS', '{}')).items()}
\ No newline at end of file
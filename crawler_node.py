@@ -1,48 +1,224 @@
 # crawler_node.py
-import requests
-from bs4 import BeautifulSoup
+import asyncio
+import codecs
+import re
 import logging
+import threading
 import hashlib
-import time
+import json
 from datetime import datetime
 import os
-from urllib.parse import urljoin, urlparse
-import urllib.robotparser
+from collections import defaultdict
+from urllib.parse import urlparse
 from config import Config
 from redis_clinet import r
+from politeness import PolitenessScheduler
+from robots_cache import robots_cache
+from extractor import get_extractor
+from dedup import NearDuplicateIndex
+from segments import get_segment_writer
+from http_resources import build_session, build_client_session
+from url_canon import canonical_links
+import metrics
 import boto3
 
+try:
+    import charset_normalizer
+except ImportError:  # installed alongside requests; only used as a last resort
+    charset_normalizer = None
+
 s3 = boto3.client("s3", region_name=os.getenv("AWS_REGION", "eu-north-1"))
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+CHARSET_RE = re.compile(r'charset=["\']?([\w.:-]+)', re.I)
+META_CHARSET_RE = re.compile(rb'<meta[^>]+charset=["\']?([\w.:-]+)', re.I)
+BOMS = [(codecs.BOM_UTF8, 'utf-8-sig'), (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16')]
+
+
+def content_type_rejection(headers):
+    """Reason to skip a response because of its Content-Type, or None to keep it."""
+    mime = headers.get('Content-Type', '').split(';', 1)[0].strip().lower()
+    if mime and mime not in Config.ALLOWED_CONTENT_TYPES:
+        return f"unsupported content type: {mime}"
+    return None
+
+
+def detect_encoding(body, content_type=None):
+    """
+    Choose a charset for `body` from the Content-Type header, a BOM or a
+    <meta charset>, falling back to detection. Only the first
+    Config.ENCODING_SNIFF_BYTES bytes are ever inspected.
+    """
+    prefix = body[:Config.ENCODING_SNIFF_BYTES]
+    for bom, name in BOMS:
+        if prefix.startswith(bom):
+            return name
+    header = CHARSET_RE.search(content_type or '')
+    meta = META_CHARSET_RE.search(prefix)
+    for name in (header and header.group(1), meta and meta.group(1).decode('ascii', 'ignore')):
+        if name:
+            try:
+                return codecs.lookup(name).name
+            except LookupError:
+                pass
+    try:
+        prefix.decode('utf-8')
+        return 'utf-8'
+    except UnicodeDecodeError as e:
+        # The sniffed prefix may cut through a multi-byte character; the whole body cannot.
+        if len(body) > len(prefix) and e.start >= len(prefix) - 3:
+            return 'utf-8'
+    if charset_normalizer is not None:
+        best = charset_normalizer.from_bytes(prefix).best()
+        if best is not None and best.coherence > 0:
+            return best.encoding
+    # Not UTF-8 and no language evidence (e.g. a short page): the web's
+    # default for undeclared legacy pages.
+    return 'cp1252'
+
+
+def decode_body(body, content_type=None):
+    return body.decode(detect_encoding(body, content_type), errors='replace')
+
+
+def count_result(url, result):
+    """Count a finished crawl by status and (capped) host."""
+    metrics.inc("crawl_pages_total", status=result.get('status', 'unknown'),
+                host=metrics.host_label(urlparse(url).netloc))
+
+
 class CrawlerNode:
     def __init__(self):
-        self.session = requests.Session()
-        self.session.headers.update({'User-Agent': Config.USER_AGENT})
-        self.robots_cache = {}
+        # Created once per worker process (see tasks.init_worker_process) so
+        # pooled connections stay alive between tasks.
+        self.session = build_session()
+        self.loop = None
+        self.client_session = None
+        self._loop_lock = threading.Lock()
+        self.robots_cache = robots_cache
+        self.politeness = PolitenessScheduler()
+        self.extract = get_extractor()
+        self.near_duplicates = NearDuplicateIndex()
         
     def check_robots_txt(self, url):
         """Check if URL is allowed by robots.txt"""
-        parsed_url = urlparse(url)
-        robots_url = f"{parsed_url.scheme}://{parsed_url.netloc}/robots.txt"
-        
-        if robots_url not in self.robots_cache:
-            rp = urllib.robotparser.RobotFileParser()
-            rp.set_url(robots_url)
-            try:
-                rp.read()
-                self.robots_cache[robots_url] = rp
-            except Exception as e:
-                logger.error(f"Error reading robots.txt: {e}")
-                return True
-                
-        return self.robots_cache[robots_url].can_fetch(Config.USER_AGENT, url)
+        try:
+            rp = self.robots_cache.get(url, self.session)
+        except Exception as e:
+            logger.error(f"Error reading robots.txt: {e}")
+            return True
+        return rp.can_fetch(Config.USER_AGENT, url)
+
+    def robots_crawl_delay(self, url):
+        """Crawl-delay declared for our user agent in the host's robots.txt, if any."""
+        try:
+            return self.robots_cache.get(url, self.session).crawl_delay(Config.USER_AGENT)
+        except Exception:
+            return None
+
+    def reserve_fetch_slot(self, url):
+        """Seconds to wait before `url`'s host may be fetched again (0 = fetch now)."""
+        return self.politeness.reserve(url, self.robots_crawl_delay(url))
+
+    @staticmethod
+    def _validators_key(url):
+        return f"validators:{hashlib.sha1(url.encode()).hexdigest()}"
+
+    def load_validators(self, url):
+        """ETag, Last-Modified and text hash stored by the previous crawl of `url`."""
+        try:
+            return r.hgetall(self._validators_key(url))
+        except Exception as e:
+            logger.error(f"Could not load validators for {url}: {e}")
+            return {}
+
+    def save_validators(self, url, validators):
+        try:
+            key = self._validators_key(url)
+            pipe = r.pipeline()
+            pipe.delete(key)
+            pipe.hset(key, mapping={k: v for k, v in validators.items() if v is not None})
+            pipe.expire(key, Config.VALIDATORS_EXPIRE)
+            pipe.execute()
+        except Exception as e:
+            logger.error(f"Could not save validators for {url}: {e}")
+
+    @staticmethod
+    def conditional_headers(validators):
+        """If-None-Match / If-Modified-Since headers for a re-crawl."""
+        headers = {}
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+        return headers
+
+    def not_modified(self, url, depth, validators):
+        """Result for a page that has not changed since the last crawl."""
+        logger.info(f"{url} unchanged since last crawl, skipping storage and indexing")
+        return {
+            'url': url,
+            'status': 'not_modified',
+            'new_urls': json.loads(validators.get('new_urls', '[]')),
+            'content_length': int(validators.get('content_length', 0)),
+            'depth': depth
+        }
+
+    def skipped(self, url, depth, reason):
+        """Result for a response that was not downloaded or processed."""
+        logger.info(f"Skipping {url}: {reason}")
+        return {
+            'url': url,
+            'status': 'skipped',
+            'reason': reason,
+            'new_urls': [],
+            'content_length': 0,
+            'depth': depth
+        }
+
+    @staticmethod
+    def read_capped(chunks):
+        """Join body chunks, stopping at Config.MAX_BODY_BYTES. Returns (body, truncated)."""
+        body = bytearray()
+        for chunk in chunks:
+            body += chunk
+            if len(body) > Config.MAX_BODY_BYTES:
+                return bytes(body[:Config.MAX_BODY_BYTES]), True
+        return bytes(body), False
+
+    @staticmethod
+    async def read_capped_async(response):
+        body = bytearray()
+        async for chunk in response.content.iter_chunked(Config.DOWNLOAD_CHUNK_BYTES):
+            body += chunk
+            if len(body) > Config.MAX_BODY_BYTES:
+                return bytes(body[:Config.MAX_BODY_BYTES]), True
+        return bytes(body), False
+
+    def finish_page(self, url, depth, body, truncated, headers, validators):
+        """Decode a downloaded body, process it and note any truncation in the result."""
+        with metrics.timed("crawl_stage_seconds", stage="decode"):
+            html = decode_body(body, headers.get('Content-Type'))
+        result = self.process_page(url, depth, html, headers, validators)
+        if truncated:
+            logger.warning(f"{url} exceeded {Config.MAX_BODY_BYTES} bytes, truncated")
+            result['truncated'] = True
+            result['reason'] = f"body truncated at {Config.MAX_BODY_BYTES} bytes"
+        return result
 
     def crawl(self, url, depth=0):
         """Crawl a single URL and return content, new URLs and the current crawl depth."""
+        with metrics.timed("crawl_seconds"):
+            result = self._crawl(url, depth)
+        count_result(url, result)
+        return result
+
+    def _crawl(self, url, depth):
         logger.info(f"Starting to crawl: {url} at depth {depth}")
-        if not self.check_robots_txt(url):
+        with metrics.timed("crawl_stage_seconds", stage="robots"):
+            allowed = self.check_robots_txt(url)
+        if not allowed:
             logger.info(f"URL not allowed by robots.txt: {url}")
             return {
                 'url': url,
@@ -52,59 +228,247 @@ class CrawlerNode:
                 'content_length': 0,
                 'depth': depth
             }
-            
-        time.sleep(Config.CRAWL_DELAY)
-        
+
+        with metrics.timed("crawl_stage_seconds", stage="politeness"):
+            wait = self.reserve_fetch_slot(url)
+        if wait > 0:
+            logger.info(f"Host busy, deferring {url} for {wait:.2f}s")
+            return {
+                'url': url,
+                'status': 'deferred',
+                'retry_after': wait,
+                'new_urls': [],
+                'content_length': 0,
+                'depth': depth
+            }
+
         try:
             logger.info(f"Fetching {url}")
-            response = self.session.get(url, timeout=5)
-            response.raise_for_status()
-            parsed = urlparse(url)
-            netloc = parsed.netloc
-            soup = BeautifulSoup(response.text, 'html.parser')
-            s3.put_object(
-            Bucket=os.environ['S3_BUCKET'],
-            Key=f"crawled/{netloc}/{hashlib.sha1(url.encode()).hexdigest()}.html",
-            Body=response.text,
-            Metadata={
-                'source-url': url,
-                'crawl-time': datetime.utcnow().isoformat()
+            validators = self.load_validators(url)
+            with metrics.timed("crawl_stage_seconds", stage="fetch"), \
+                    self.session.get(url, timeout=Config.FETCH_TIMEOUT, stream=True,
+                                     headers=self.conditional_headers(validators)) as response:
+                if response.status_code == 304 and validators:
+                    return self.not_modified(url, depth, validators)
+                response.raise_for_status()
+                reason = content_type_rejection(response.headers)
+                if reason:
+                    return self.skipped(url, depth, reason)
+                body, truncated = self.read_capped(
+                    response.iter_content(chunk_size=Config.DOWNLOAD_CHUNK_BYTES))
+            return self.finish_page(url, depth, body, truncated, response.headers, validators)
+        except Exception as e:
+            logger.error(f"Failed to crawl {url}: {e}")
+            return {
+                'url': url,
+                'status': 'error',
+                'error': str(e),
+                'depth': depth
             }
-        )
-            # Extract text content
-            texts = []
-            for tag in ['p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6','span']:
-                texts.extend([elem.get_text().strip() for elem in soup.find_all(tag)])
-            text = ' '.join(texts)
-            
-            # Extract links
-            links = []
-            for a in soup.find_all('a', href=True):
-                link = urljoin(url, a['href'])
-                if link.startswith(('http://', 'https://')):
-                    if urlparse(link).netloc == urlparse(url).netloc:
-                        links.append(link)
-            
-            logger.info(f"Successfully crawled {url}. Found {len(links)} links and {len(text)} characters of text")
-            # Send to indexer
-            s3_key= f"crawled/{netloc}/{hashlib.sha1(url.encode()).hexdigest()}.txt"
-            s3.put_object(
-                Bucket=os.environ['S3_BUCKET'],
-                Key=s3_key,
-                Body=text.encode(),        
-                ContentType="text/plain"
-            )
-            from tasks import index_content
-            index_content.delay(url, depth ,s3_key)
-            
+
+    def process_page(self, url, depth, html, headers=None, validators=None):
+        """
+        Store the fetched HTML, extract text and same-host links, queue the
+        page for indexing and build the result dict read by the master.
+        If the extracted text hashes the same as on the previous crawl, or its
+        SimHash is within SIMHASH_MAX_DISTANCE of another stored page,
+        storage and indexing are skipped. Shared by the blocking and the
+        asyncio crawl paths.
+        """
+        parsed = urlparse(url)
+        netloc = parsed.netloc
+        headers = headers or {}
+        validators = validators or {}
+
+        # Extract text content and same-host links in one pass
+        with metrics.timed("crawl_stage_seconds", stage="extract"):
+            text, links = self.extract(html, url)
+            links, canonical_duplicates = canonical_links(links)
+        new_urls = links[:5]  # Limit new URLs for testing
+        current = {
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'text_hash': hashlib.sha1(text.encode()).hexdigest(),
+            'new_urls': json.dumps(new_urls),
+            'content_length': len(text),
+        }
+        if validators.get('text_hash') == current['text_hash']:
+            self.save_validators(url, current)
+            return self.not_modified(url, depth, current)
+
+        fp, duplicate_of, claimed = None, None, False
+        if Config.DEDUP_ENABLED:
+            try:
+                with metrics.timed("crawl_stage_seconds", stage="dedup"):
+                    fp, duplicate_of, claimed = self.near_duplicates.check(text, url)
+            except Exception as e:
+                logger.error(f"Near-duplicate check failed for {url}: {e}")
+        if fp is not None:
+            current['simhash'] = f"{fp:016x}"
+        if duplicate_of:
+            logger.info(f"{url} is a near-duplicate of {duplicate_of}, skipping storage and indexing")
+            self.save_validators(url, current)
             return {
                 'url': url,
-                'status': 'success',
-                'new_urls': links[:5],  # Limit new URLs for testing
+                'status': 'duplicate',
+                'duplicate_of': duplicate_of,
+                'new_urls': new_urls,
+                'canonical_duplicates': canonical_duplicates,
                 'content_length': len(text),
                 'depth': depth
             }
-            
+
+        logger.info(f"Successfully crawled {url}. Found {len(links)} links and {len(text)} characters of text")
+        result = {
+            'url': url,
+            'status': 'success',
+            'new_urls': new_urls,
+            'canonical_duplicates': canonical_duplicates,
+            'content_length': len(text),
+            'depth': depth
+        }
+        from tasks import index_content
+        try:
+            if Config.SEGMENT_WRITER_ENABLED:
+                # Batched into the worker's rolling segment; indexing is queued and
+                # validators saved once the segment holding the page has been
+                # uploaded (timed as s3_put there), so a failed upload is not
+                # mistaken for a stored page on the next crawl. Until then the
+                # crawl task stays registered for fail-over (tasks.hold_until_stored).
+                def on_stored(key, offset, length):
+                    from tasks import segment_stored
+                    try:
+                        index_content.delay(url, depth, key, offset, length)
+                        self.page_stored(url, current, validators, fp)
+                    finally:
+                        segment_stored(url)
+
+                with metrics.timed("crawl_stage_seconds", stage="store"):
+                    get_segment_writer().append(url, html, text, on_stored=on_stored)
+                result['stored'] = False
+            else:
+                with metrics.timed("crawl_stage_seconds", stage="s3_put"):
+                    s3.put_object(
+                        Bucket=os.environ['S3_BUCKET'],
+                        Key=f"crawled/{netloc}/{hashlib.sha1(url.encode()).hexdigest()}.html",
+                        Body=html,
+                        Metadata={
+                            'source-url': url,
+                            'crawl-time': datetime.utcnow().isoformat()
+                        }
+                    )
+                    # Send to indexer
+                    s3_key= f"crawled/{netloc}/{hashlib.sha1(url.encode()).hexdigest()}.txt"
+                    s3.put_object(
+                        Bucket=os.environ['S3_BUCKET'],
+                        Key=s3_key,
+                        Body=text.encode(),
+                        ContentType="text/plain"
+                    )
+                index_content.delay(url, depth ,s3_key)
+                self.page_stored(url, current, validators, fp)
+        except Exception:
+            if claimed:
+                # Not stored: other pages must not be flagged as near-duplicates of it.
+                self.near_duplicates.release(fp, url)
+            raise
+        return result
+
+    def page_stored(self, url, current, validators, fp):
+        """Remember a stored page: its validators and its SimHash fingerprint."""
+        self.save_validators(url, current)
+        if fp is not None:
+            previous_fp = int(validators['simhash'], 16) if validators.get('simhash') else None
+            try:
+                self.near_duplicates.add(fp, url, previous_fp)
+            except Exception as e:
+                logger.error(f"Could not index fingerprint for {url}: {e}")
+
+    def crawl_many(self, items, on_result=None):
+        """
+        Crawl a batch of (url, depth) pairs concurrently from a single process.
+        Up to Config.ASYNC_MAX_IN_FLIGHT fetches run at once, at most
+        Config.ASYNC_PER_HOST_IN_FLIGHT of them against the same host.
+        `on_result` (if given) is called with each result dict as soon as that
+        URL finishes. Returns the result dicts in input order.
+        """
+        # The event loop and its ClientSession live as long as this node, so
+        # keep-alive connections are reused by the next batch.
+        with self._loop_lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+            return self.loop.run_until_complete(self._crawl_many(items, on_result))
+
+    async def _crawl_many(self, items, on_result):
+        if self.client_session is None or self.client_session.closed:
+            self.client_session = build_client_session()
+        in_flight = asyncio.Semaphore(Config.ASYNC_MAX_IN_FLIGHT)
+        per_host = defaultdict(lambda: asyncio.Semaphore(Config.ASYNC_PER_HOST_IN_FLIGHT))
+        return await asyncio.gather(*(
+            self._crawl_async(self.client_session, in_flight, per_host, url, depth, on_result)
+            for url, depth in items
+        ))
+
+    def close(self):
+        """Release pooled connections and the event loop."""
+        self.session.close()
+        if self.loop is not None:
+            if self.client_session is not None:
+                self.loop.run_until_complete(self.client_session.close())
+            self.loop.close()
+            self.loop = None
+
+    async def _crawl_async(self, session, in_flight, per_host, url, depth, on_result):
+        with metrics.timed("crawl_seconds"):
+            result = await self._fetch_and_process(session, in_flight, per_host, url, depth)
+        count_result(url, result)
+        if on_result is not None:
+            try:
+                await asyncio.to_thread(on_result, result)
+            except Exception as e:
+                logger.error(f"Result callback failed for {url}: {e}")
+        return result
+
+    async def _fetch_and_process(self, session, in_flight, per_host, url, depth):
+        """asyncio counterpart of crawl(); blocking steps run in worker threads."""
+        logger.info(f"Starting to crawl: {url} at depth {depth}")
+        try:
+            with metrics.timed("crawl_stage_seconds", stage="robots"):
+                allowed = await asyncio.to_thread(self.check_robots_txt, url)
+        except Exception as e:
+            logger.error(f"Error checking robots.txt for {url}: {e}")
+            allowed = True
+        if not allowed:
+            logger.info(f"URL not allowed by robots.txt: {url}")
+            return {
+                'url': url,
+                'status': 'disallowed',
+                'error': 'Disallowed by robots.txt',
+                'new_urls': [],
+                'content_length': 0,
+                'depth': depth
+            }
+
+        try:
+            async with per_host[urlparse(url).netloc]:
+                # Waiting only parks this coroutine; other hosts keep going.
+                while (wait := await asyncio.to_thread(self.reserve_fetch_slot, url)) > 0:
+                    await asyncio.sleep(wait)
+                validators = await asyncio.to_thread(self.load_validators, url)
+                async with in_flight:
+                    logger.info(f"Fetching {url}")
+                    with metrics.timed("crawl_stage_seconds", stage="fetch"):
+                        async with session.get(url, headers=self.conditional_headers(validators)) as response:
+                            if response.status == 304 and validators:
+                                return self.not_modified(url, depth, validators)
+                            response.raise_for_status()
+                            reason = content_type_rejection(response.headers)
+                            if reason:
+                                return self.skipped(url, depth, reason)
+                            body, truncated = await self.read_capped_async(response)
+                            headers = response.headers
+            return await asyncio.to_thread(self.finish_page, url, depth, body, truncated,
+                                           headers, validators)
         except Exception as e:
             logger.error(f"Failed to crawl {url}: {e}")
             return {
@@ -112,4 +476,4 @@ class CrawlerNode:
                 'status': 'error',
                 'error': str(e),
                 'depth': depth
-            }
\ No newline at end of file
+            }
@@ -0,0 +1,128 @@
+# dedup.py
+import hashlib
+import logging
+import re
+from collections import Counter
+from config import Config
+from redis_clinet import r
+
+logger = logging.getLogger(__name__)
+
+WORD_RE = re.compile(r'\w+')
+FP_BITS = 64
+
+
+def _feature_hash(feature):
+    return int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), 'big')
+
+
+def simhash(text, shingle=3):
+    """
+    64-bit SimHash over word shingles of `text`.
+    Returns None when the text is too short to fingerprint reliably.
+    """
+    words = WORD_RE.findall(text.lower())
+    if len(words) < Config.SIMHASH_MIN_WORDS:
+        return None
+    shingles = Counter(' '.join(words[i:i + shingle])
+                       for i in range(max(1, len(words) - shingle + 1)))
+    features = [(_feature_hash(s), w) for s, w in shingles.items()]
+    total = sum(w for _h, w in features)
+    fp = 0
+    for bit in range(FP_BITS):
+        mask = 1 << bit
+        # A bit is set when the features having it outweigh those that don't.
+        if 2 * sum(w for h, w in features if h & mask) > total:
+            fp |= mask
+    return fp
+
+
+class NearDuplicateIndex:
+    """
+    Banded SimHash index in Redis.
+
+    The 64-bit fingerprint is cut into SIMHASH_MAX_DISTANCE + 1 bands; two
+    fingerprints within that Hamming distance must agree exactly on at least
+    one band, so only pages sharing a band bucket are compared.
+    Buckets are Redis sets `simhash:<band>:<value>` with "<fp hex> <url>" members.
+    """
+
+    def __init__(self, max_distance=None):
+        self.max_distance = Config.SIMHASH_MAX_DISTANCE if max_distance is None else max_distance
+        self.bands = self.max_distance + 1
+        self.band_bits = FP_BITS // self.bands
+
+    def _bucket_keys(self, fp):
+        mask = (1 << self.band_bits) - 1
+        return [f"simhash:{b}:{(fp >> (b * self.band_bits)) & mask:x}"
+                for b in range(self.bands)]
+
+    def _match(self, fp, url, buckets):
+        """URL of a near-duplicate of `fp` (other than `url`) among bucket members, or None."""
+        for members in buckets:
+            for member in members:
+                other_fp, other_url = member.split(' ', 1)
+                if other_url != url and bin(fp ^ int(other_fp, 16)).count('1') <= self.max_distance:
+                    return other_url
+        return None
+
+    def add(self, fp, url, previous_fp=None):
+        """Index `fp` for `url`, dropping the URL's previous fingerprint if it changed."""
+        pipe = r.pipeline()
+        if previous_fp is not None and previous_fp != fp:
+            for key in self._bucket_keys(previous_fp):
+                pipe.srem(key, f"{previous_fp:016x} {url}")
+        for key in self._bucket_keys(fp):
+            pipe.sadd(key, f"{fp:016x} {url}")
+        pipe.execute()
+
+    def release(self, fp, url):
+        """Drop a fingerprint claimed by check() for a page that was not stored after all."""
+        pipe = r.pipeline()
+        for key in self._bucket_keys(fp):
+            pipe.srem(key, f"{fp:016x} {url}")
+        pipe.execute()
+
+    def check(self, text, url):
+        """
+        Fingerprint `text`, look it up and, unless it is a near-duplicate,
+        add it in the same transaction (WATCH on its buckets, retried if
+        another page changed them), so two near-duplicate pages crawled at
+        the same time cannot both pass.
+        Returns (fingerprint, duplicate_of_url, claimed): `claimed` is True
+        if this call added the fingerprint; call release() if the page then
+        is not stored, and add() once it is (to drop the previous one).
+        """
+        fp = simhash(text)
+        if fp is None:
+            return None, None, False
+        keys = self._bucket_keys(fp)
+        member = f"{fp:016x} {url}"
+
+        def claim(pipe):
+            buckets = [pipe.smembers(key) for key in keys]
+            duplicate_of = self._match(fp, url, buckets)
+            claimed = duplicate_of is None and member not in buckets[0]
+            pipe.multi()
+            if claimed:
+                for key in keys:
+                    pipe.sadd(key, member)
+            pipe.hincrby("dedup_stats", "checked", 1)
+            if duplicate_of:
+                pipe.hincrby("dedup_stats", "duplicates", 1)
+            return duplicate_of, claimed
+
+        duplicate_of, claimed = r.transaction(claim, *keys, value_from_callable=True)
+        return fp, duplicate_of, claimed
+
+
+def dedup_stats():
+    """Pages fingerprinted, near-duplicates found and the duplicate rate."""
+    stats = r.hgetall("dedup_stats")
+    checked = int(stats.get("checked", 0))
+    duplicates = int(stats.get("duplicates", 0))
+    return {
+        "checked": checked,
+        "duplicates": duplicates,
+        "duplicate_rate": duplicates / checked if checked else 0.0,
+    }
@@ -0,0 +1,155 @@
+# extractor.py
+import logging
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlparse
+from config import Config
+
+try:
+    from lxml import etree
+except ImportError:  # lxml is optional; fall back to the stdlib parser
+    etree = None
+
+logger = logging.getLogger(__name__)
+
+TEXT_TAGS = frozenset(['p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'span'])
+SKIP_TAGS = frozenset(['script', 'style', 'noscript', 'template'])
+# Opening one of these implicitly closes an open <p> (lxml does this itself).
+P_CLOSERS = frozenset(['p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'div', 'ul', 'ol',
+                       'table', 'pre', 'blockquote', 'section', 'article', 'header',
+                       'footer', 'form', 'hr', 'dl', 'nav', 'aside'])
+
+
+class _Collector:
+    """
+    Parser-agnostic event sink that gathers text and links in a single pass.
+    Text is collected per outermost p/h1-h6/span element, so text in nested
+    tags is only counted once. Links are same-host absolute http(s) URLs.
+    """
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.netloc = urlparse(base_url).netloc
+        self.texts = []
+        self.links = []
+        self._open = []      # stack of open text tags
+        self._buf = []
+        self._skip = 0
+
+    def start(self, tag, attrib):
+        tag = tag.lower()
+        if tag in SKIP_TAGS:
+            self._skip += 1
+            return
+        if tag == 'a':
+            href = attrib.get('href')
+            if href is not None:
+                self._add_link(href)
+        if tag in P_CLOSERS and 'p' in self._open:
+            self._close('p')
+        if tag in TEXT_TAGS:
+            self._open.append(tag)
+
+    def end(self, tag):
+        tag = tag.lower()
+        if tag in SKIP_TAGS:
+            self._skip = max(0, self._skip - 1)
+        elif tag in TEXT_TAGS and tag in self._open:
+            self._close(tag)
+
+    def data(self, data):
+        if self._open and not self._skip:
+            self._buf.append(data)
+
+    def close(self):
+        if self._open:
+            del self._open[:]
+            self._flush()
+        return ' '.join(self.texts), self.links
+
+    def _close(self, tag):
+        while self._open:
+            if self._open.pop() == tag:
+                break
+        if not self._open:
+            self._flush()
+
+    def _flush(self):
+        text = ''.join(self._buf).strip()
+        self._buf = []
+        if text:
+            self.texts.append(text)
+
+    def _add_link(self, href):
+        link = urljoin(self.base_url, href)
+        if link.startswith(('http://', 'https://')) and urlparse(link).netloc == self.netloc:
+            self.links.append(link)
+
+
+class _StdlibParser(HTMLParser):
+    def __init__(self, collector):
+        super().__init__(convert_charrefs=True)
+        self.collector = collector
+
+    def handle_starttag(self, tag, attrs):
+        self.collector.start(tag, dict(attrs))
+
+    def handle_endtag(self, tag):
+        self.collector.end(tag)
+
+    def handle_data(self, data):
+        self.collector.data(data)
+
+
+def extract_stdlib(html, base_url):
+    """Single pass over the document with the stdlib streaming HTMLParser."""
+    collector = _Collector(base_url)
+    parser = _StdlibParser(collector)
+    parser.feed(html)
+    parser.close()
+    return collector.close()
+
+
+def extract_lxml(html, base_url):
+    """Single pass with libxml2's HTML parser feeding events to the collector."""
+    collector = _Collector(base_url)
+    parser = etree.HTMLParser(target=collector, recover=True)
+    parser.feed(html)
+    return parser.close()
+
+
+def extract_bs4(html, base_url):
+    """The original BeautifulSoup find_all path, kept for comparison."""
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, 'html.parser')
+    texts = []
+    for tag in ['p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'span']:
+        texts.extend([elem.get_text().strip() for elem in soup.find_all(tag)])
+    netloc = urlparse(base_url).netloc
+    links = []
+    for a in soup.find_all('a', href=True):
+        link = urljoin(base_url, a['href'])
+        if link.startswith(('http://', 'https://')) and urlparse(link).netloc == netloc:
+            links.append(link)
+    return ' '.join(texts), links
+
+
+EXTRACTORS = {
+    'html.parser': extract_stdlib,
+    'bs4': extract_bs4,
+}
+if etree is not None:
+    EXTRACTORS['lxml'] = extract_lxml
+
+
+def get_extractor(name=None):
+    """
+    Return an extract(html, base_url) -> (text, links) function.
+    'auto' picks lxml when installed and the stdlib parser otherwise.
+    """
+    name = name or Config.HTML_EXTRACTOR
+    if name == 'auto':
+        name = 'lxml' if 'lxml' in EXTRACTORS else 'html.parser'
+    if name not in EXTRACTORS:
+        logger.warning(f"HTML extractor '{name}' unavailable, using html.parser")
+        name = 'html.parser'
+    return EXTRACTORS[name]
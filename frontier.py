@@ -0,0 +1,340 @@
+# frontier.py
+import logging
+import time
+from urllib.parse import urlparse
+from config import Config
+from redis_clinet import r
+from seen_set import make_seen_set
+from scoring import make_scorer
+
+logger = logging.getLogger(__name__)
+
+# Key layout (all under Config.FRONTIER_PREFIX, default "frontier:"):
+#   seen          SET   every URL ever admitted, with the default "redis-set"
+#                       seen-set backend (see seen_set.py for the others)
+#   q:<host>      ZSET  queued URLs of one host, scored by priority (lower first)
+#   meta          HASH  url -> "<depth> <score> <host> <credit>" for queued and
+#                       in-flight URLs (credit: see scoring.py)
+#   cash          HASH  url -> credit of dispatched URLs, for scorers that pay
+#                       it out to the page's links once its result arrives
+#                       (drained for every result, see OPICScorer)
+#   hosts         ZSET  hosts with queued URLs, scored by last-served time (ms)
+#   inflight      ZSET  claimed URLs, scored by lease deadline (ms)
+#   stats         HASH  queued / inflight counters
+#   journal       LIST  URLs admitted to the seen-set since the last checkpoint
+#                       (only with Config.CHECKPOINT_ENABLED; see checkpoint.py)
+#
+# Scripts touch keys derived from their arguments, so they assume a
+# non-clustered Redis (as used by the rest of the system).
+
+_PUSH_LUA = """
+local p = KEYS[1]
+local now = tonumber(ARGV[1])
+local added = 0
+for i = 2, #ARGV, 5 do
+    local url, host, depth, score, credit = ARGV[i], ARGV[i + 1], ARGV[i + 2], ARGV[i + 3], ARGV[i + 4]
+    if redis.call('ZSCORE', p .. 'inflight', url) == false then
+        if redis.call('ZADD', p .. 'q:' .. host, score, url) == 1 then
+            redis.call('HSET', p .. 'meta', url, depth .. ' ' .. score .. ' ' .. host .. ' ' .. credit)
+            redis.call('ZADD', p .. 'hosts', 'NX', now, host)
+            added = added + 1
+        end
+    end
+end
+if added > 0 then redis.call('HINCRBY', p .. 'stats', 'queued', added) end
+return added
+"""
+
+# Round-robin over ready hosts: one URL per host per pass, the host that was
+# served longest ago first, until `n` URLs are claimed or hosts run out.
+_CLAIM_LUA = """
+local p = KEYS[1]
+local now, n, lease = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local out = {}
+local claimed = 0
+local hosts = redis.call('ZRANGEBYSCORE', p .. 'hosts', '-inf', now, 'LIMIT', 0, n)
+while claimed < n and #hosts > 0 do
+    local remaining = {}
+    for _, host in ipairs(hosts) do
+        if claimed >= n then break end
+        local popped = redis.call('ZPOPMIN', p .. 'q:' .. host)
+        if #popped > 0 then
+            local url = popped[1]
+            redis.call('ZADD', p .. 'inflight', now + lease, url)
+            local meta = redis.call('HGET', p .. 'meta', url) or '1'
+            table.insert(out, url)
+            table.insert(out, meta)
+            claimed = claimed + 1
+        end
+        if redis.call('EXISTS', p .. 'q:' .. host) == 1 then
+            redis.call('ZADD', p .. 'hosts', now, host)
+            table.insert(remaining, host)
+        else
+            redis.call('ZREM', p .. 'hosts', host)
+        end
+    end
+    hosts = remaining
+end
+if claimed > 0 then
+    redis.call('HINCRBY', p .. 'stats', 'queued', -claimed)
+    redis.call('HINCRBY', p .. 'stats', 'inflight', claimed)
+end
+return out
+"""
+
+# Give queued URLs more credit and move them up their host queue by
+# ARGV[1] * credit. URLs that are not queued (in flight or done) are skipped.
+_CREDIT_LUA = """
+local p = KEYS[1]
+local weight = tonumber(ARGV[1])
+local raised = 0
+for i = 2, #ARGV, 2 do
+    local url, credit = ARGV[i], tonumber(ARGV[i + 1])
+    local meta = redis.call('HGET', p .. 'meta', url)
+    local depth, score, host, old = string.match(meta or '', '^(%S+) (%S+) (%S+) ?(%S*)$')
+    if host ~= nil and redis.call('ZSCORE', p .. 'q:' .. host, url) then
+        score = tonumber(score) - weight * credit
+        credit = (tonumber(old) or 0) + credit
+        redis.call('ZADD', p .. 'q:' .. host, score, url)
+        redis.call('HSET', p .. 'meta', url, depth .. ' ' .. score .. ' ' .. host .. ' ' .. credit)
+        raised = raised + 1
+    end
+end
+return raised
+"""
+
+# With ARGV[1] = '1' the credit of each acknowledged URL is parked in `cash`.
+_ACK_LUA = """
+local p = KEYS[1]
+local keep_cash = ARGV[1] == '1'
+local done = 0
+for i = 2, #ARGV do
+    if redis.call('ZREM', p .. 'inflight', ARGV[i]) == 1 then
+        if keep_cash then
+            local credit = string.match(redis.call('HGET', p .. 'meta', ARGV[i]) or '', '^%S+ %S+ %S+ (%S+)$')
+            if (tonumber(credit) or 0) > 0 then redis.call('HSET', p .. 'cash', ARGV[i], credit) end
+        end
+        redis.call('HDEL', p .. 'meta', ARGV[i])
+        done = done + 1
+    end
+end
+if done > 0 then redis.call('HINCRBY', p .. 'stats', 'inflight', -done) end
+return done
+"""
+
+# Put in-flight URLs back on their host queue. With ARGV[2] = '' the URLs
+# are ARGV[3..]; otherwise every lease that expired before ARGV[2] is released.
+_RELEASE_LUA = """
+local p = KEYS[1]
+local now = tonumber(ARGV[1])
+local urls = {}
+if ARGV[2] ~= '' then
+    urls = redis.call('ZRANGEBYSCORE', p .. 'inflight', '-inf', ARGV[2], 'LIMIT', 0, 1000)
+else
+    for i = 3, #ARGV do table.insert(urls, ARGV[i]) end
+end
+local released = {}
+for _, url in ipairs(urls) do
+    if redis.call('ZREM', p .. 'inflight', url) == 1 then
+        local meta = redis.call('HGET', p .. 'meta', url)
+        local depth, score, host = string.match(meta or '', '^(%S+) (%S+) (%S+)')
+        if host == nil then
+            -- metadata lost: fall back to the host's queue at depth 1
+            score, host = '1', string.lower(string.match(url, '^%a+://([^/?#]+)') or '')
+            redis.call('HSET', p .. 'meta', url, '1 1 ' .. host .. ' 0')
+        end
+        redis.call('ZADD', p .. 'q:' .. host, score, url)
+        redis.call('ZADD', p .. 'hosts', 'NX', now, host)
+        table.insert(released, url)
+    end
+end
+if #released > 0 then
+    redis.call('HINCRBY', p .. 'stats', 'inflight', -#released)
+    redis.call('HINCRBY', p .. 'stats', 'queued', #released)
+end
+return released
+"""
+
+
+def host_of(url):
+    return urlparse(url).netloc.lower().rsplit('@', 1)[-1]
+
+
+class Frontier:
+    """
+    Redis-backed URL frontier shared by any number of master instances.
+
+    URLs are queued per host in priority order (Config.FRONTIER_SCORER),
+    claimed atomically (round-robin across hosts) under a lease, and acknowledged once their crawl task has been
+    published. Leases that are never acknowledged (e.g. the master died
+    mid-dispatch) expire and the URLs go back on their host queue.
+    Admission is de-duplicated by a pluggable seen-set (Config.SEEN_SET_BACKEND).
+    """
+
+    def __init__(self, prefix=None, seen=None, scorer=None):
+        self.prefix = prefix or Config.FRONTIER_PREFIX
+        self.seen = seen or make_seen_set(self.prefix)
+        self.scorer = scorer or make_scorer()
+        self._push = r.register_script(_PUSH_LUA)
+        self._credit = r.register_script(_CREDIT_LUA)
+        self._claim = r.register_script(_CLAIM_LUA)
+        self._ack = r.register_script(_ACK_LUA)
+        self._release = r.register_script(_RELEASE_LUA)
+
+    @staticmethod
+    def _now_ms():
+        return int(time.time() * 1000)
+
+    def push_many(self, entries, force=False, credits=None):
+        """
+        Queue (url, depth) pairs in one round trip. URLs seen before are
+        skipped unless `force` (used to re-queue work from failed workers).
+        `credits` maps URLs to priority credit from the scorer: new URLs start
+        with it, URLs already queued are moved up by it.
+        Returns the number of URLs added.
+        """
+        added = 0
+        credits = credits or {}
+        unique = {}
+        for url, depth in entries:
+            unique.setdefault(url, depth)
+        entries = list(unique.items())
+        if not force:
+            fresh = self.seen.add_many(url for url, _depth in entries)
+            known = [url for (url, _depth), new in zip(entries, fresh) if not new and credits.get(url)]
+            entries = [entry for entry, new in zip(entries, fresh) if new]
+            self.raise_priority((url, credits[url]) for url in known)
+            if Config.CHECKPOINT_ENABLED and entries:
+                self.journal(entries)
+        for start in range(0, len(entries), Config.FRONTIER_BATCH_SIZE):
+            args = [self._now_ms()]
+            for url, depth in entries[start:start + Config.FRONTIER_BATCH_SIZE]:
+                credit = credits.get(url, 0)
+                args += [url, host_of(url), depth, self.score(url, depth, credit), credit]
+            added += self._push(keys=[self.prefix], args=args)
+        return added
+
+    def raise_priority(self, credits):
+        """Add (url, credit) pairs to URLs still waiting in the frontier."""
+        credits = list(credits)
+        if not credits or not self.scorer.credit_weight:
+            return 0
+        raised = 0
+        for start in range(0, len(credits), Config.FRONTIER_BATCH_SIZE):
+            args = [self.scorer.credit_weight]
+            for url, credit in credits[start:start + Config.FRONTIER_BATCH_SIZE]:
+                args += [url, credit]
+            raised += self._credit(keys=[self.prefix], args=args)
+        return raised
+
+    def journal(self, entries):
+        """Record (url, depth) seen-set additions for the next incremental checkpoint."""
+        lines = [f"{depth} {url}" for url, depth in entries]
+        pipe = r.pipeline(transaction=False)
+        for start in range(0, len(lines), Config.FRONTIER_BATCH_SIZE):
+            pipe.rpush(f"{self.prefix}journal", *lines[start:start + Config.FRONTIER_BATCH_SIZE])
+        pipe.execute()
+
+    def read_journal(self, drain=False):
+        """"<depth> <url>" lines journaled since the last checkpoint; `drain` also removes them."""
+        key = f"{self.prefix}journal"
+        n = r.llen(key)
+        if not n:
+            return []
+        pipe = r.pipeline(transaction=True)
+        pipe.lrange(key, 0, n - 1)
+        if drain:
+            pipe.ltrim(key, n, -1)
+        return pipe.execute()[0]
+
+    def redis_keys(self):
+        """Every Redis key holding this frontier's queue state (not the journal)."""
+        keys = [f"{self.prefix}{name}" for name in ("meta", "hosts", "inflight", "stats", "cash")]
+        keys += [f"{self.prefix}q:{host}" for host in r.zrange(f"{self.prefix}hosts", 0, -1)]
+        return keys + self.seen.redis_keys()
+
+    def take_cash(self, urls):
+        """Remove and return the parked credit of dispatched URLs (0 if none)."""
+        urls = list(urls)
+        if not urls:
+            return []
+        pipe = r.pipeline(transaction=False)
+        pipe.hmget(f"{self.prefix}cash", urls)
+        pipe.hdel(f"{self.prefix}cash", *urls)
+        return [float(c or 0) for c in pipe.execute()[0]]
+
+    def seen_many(self, urls):
+        """Whether each URL was ever admitted to the frontier (one batched check)."""
+        return self.seen.contains_many(urls)
+
+    def score(self, url, depth, credit=0):
+        """Priority of a URL within its host queue (lower is crawled first)."""
+        return self.scorer.score(depth, credit)
+
+    def claim(self, n, lease=None):
+        """Atomically take up to `n` URLs. Returns a list of (url, depth)."""
+        lease_ms = int((lease or Config.FRONTIER_LEASE) * 1000)
+        flat = self._claim(keys=[self.prefix], args=[self._now_ms(), n, lease_ms])
+        return [(url, int(meta.split(' ', 1)[0])) for url, meta in zip(flat[::2], flat[1::2])]
+
+    def ack(self, urls):
+        """Mark claimed URLs as handed off to a crawler."""
+        urls = list(urls)
+        if not urls:
+            return 0
+        return self._ack(keys=[self.prefix], args=['1' if self.scorer.keeps_cash else '0'] + urls)
+
+    def release(self, urls):
+        """Return claimed URLs to their host queues (e.g. publishing failed)."""
+        urls = list(urls)
+        if not urls:
+            return []
+        return self._release(keys=[self.prefix], args=[self._now_ms(), ''] + urls)
+
+    def reclaim_expired(self):
+        """Re-queue URLs whose lease ran out without an ack."""
+        now = self._now_ms()
+        released = self._release(keys=[self.prefix], args=[now, now])
+        if released:
+            logger.warning(f"Reclaimed {len(released)} URLs with expired frontier leases")
+        return released
+
+    def size(self):
+        """Number of URLs waiting to be claimed."""
+        return max(0, int(r.hget(f"{self.prefix}stats", "queued") or 0))
+
+    def in_flight(self):
+        return max(0, int(r.hget(f"{self.prefix}stats", "inflight") or 0))
+
+    def hosts(self):
+        return r.zcard(f"{self.prefix}hosts")
+
+    def scan_queued(self, cursor=0, count=100):
+        """
+        One page of queued URLs as (next_cursor, [(url, depth, score)]),
+        following Redis HSCAN cursor semantics (next_cursor 0 = done). Costs
+        O(count) whatever the frontier size; order is arbitrary.
+        """
+        cursor, page = r.hscan(f"{self.prefix}meta", cursor=cursor, count=count)
+        urls = list(page)
+        if not urls:
+            return cursor, []
+        leased = r.zmscore(f"{self.prefix}inflight", urls)
+        out = []
+        for url, lease in zip(urls, leased):
+            if lease is None:
+                depth, score = page[url].split(' ')[:2]
+                out.append((url, int(depth), float(score)))
+        return cursor, out
+
+    def queued_urls(self, limit=None):
+        """Queued URLs (up to `limit`), read page by page."""
+        urls, cursor = [], 0
+        while True:
+            cursor, page = self.scan_queued(cursor)
+            urls.extend(url for url, _depth, _score in page)
+            if not cursor or (limit is not None and len(urls) >= limit):
+                return urls[:limit] if limit is not None else urls
+
+    def __len__(self):
+        return self.size()
@@ -0,0 +1,163 @@
+# http_resources.py
+import logging
+import socket
+import threading
+import time
+from collections import Counter
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from config import Config
+from redis_clinet import r
+
+logger = logging.getLogger(__name__)
+
+# Per-process connection/DNS counters; flush_stats() adds them to Redis.
+stats = Counter()
+_stats_lock = threading.Lock()
+_flushed = Counter()
+
+
+def _count(name, n=1):
+    with _stats_lock:
+        stats[name] += n
+
+
+# --- DNS ---------------------------------------------------------------------
+
+_original_getaddrinfo = socket.getaddrinfo
+_dns_cache = {}
+_dns_lock = threading.Lock()
+
+
+def _cached_getaddrinfo(host, port, family=0, type=0, proto=0, flags=0):
+    key = (host, port, family, type, proto, flags)
+    now = time.monotonic()
+    with _dns_lock:
+        hit = _dns_cache.get(key)
+    if hit and hit[0] > now:
+        _count("dns_hits")
+        return hit[1]
+    _count("dns_misses")
+    result = _original_getaddrinfo(host, port, family, type, proto, flags)
+    with _dns_lock:
+        if len(_dns_cache) >= Config.DNS_CACHE_SIZE:
+            _dns_cache.clear()
+        _dns_cache[key] = (now + Config.DNS_CACHE_TTL, result)
+    return result
+
+
+def install_dns_cache():
+    """
+    Cache successful socket.getaddrinfo lookups in this process for
+    Config.DNS_CACHE_TTL seconds. Both requests (urllib3) and aiohttp's
+    default resolver go through getaddrinfo, so one cache serves both.
+    """
+    socket.getaddrinfo = _cached_getaddrinfo
+
+
+# --- requests ----------------------------------------------------------------
+
+class CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _new_conn(self):
+        _count("connections_new")
+        return super()._new_conn()
+
+
+class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _new_conn(self):
+        _count("connections_new")
+        return super()._new_conn()
+
+
+class PooledAdapter(HTTPAdapter):
+    """HTTPAdapter with sized pools that counts newly opened connections."""
+
+    def __init__(self):
+        super().__init__(pool_connections=Config.HTTP_POOL_HOSTS,
+                         pool_maxsize=Config.HTTP_POOL_PER_HOST,
+                         pool_block=False)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": CountingHTTPConnectionPool,
+            "https": CountingHTTPSConnectionPool,
+        }
+
+
+def _count_response(response, *args, **kwargs):
+    _count("requests")
+
+
+def build_session():
+    """Keep-alive requests.Session with tuned per-host connection pools."""
+    session = requests.Session()
+    session.headers.update({'User-Agent': Config.USER_AGENT})
+    adapter = PooledAdapter()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.hooks["response"].append(_count_response)
+    return session
+
+
+# --- aiohttp -----------------------------------------------------------------
+
+async def _on_request_end(session, ctx, params):
+    _count("requests")
+
+
+async def _on_connection_create_end(session, ctx, params):
+    _count("connections_new")
+
+
+def build_client_session():
+    """
+    aiohttp.ClientSession for the asyncio engine. Must be created inside the
+    event loop it will be used from; the caller keeps it for the process life.
+    """
+    connector = aiohttp.TCPConnector(
+        limit=Config.ASYNC_MAX_IN_FLIGHT,
+        limit_per_host=Config.ASYNC_PER_HOST_IN_FLIGHT,
+        ttl_dns_cache=Config.DNS_CACHE_TTL,
+        keepalive_timeout=Config.HTTP_KEEPALIVE,
+    )
+    trace = aiohttp.TraceConfig()
+    trace.on_request_end.append(_on_request_end)
+    trace.on_connection_create_end.append(_on_connection_create_end)
+    return aiohttp.ClientSession(
+        headers={'User-Agent': Config.USER_AGENT},
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(total=Config.FETCH_TIMEOUT),
+        trace_configs=[trace],
+    )
+
+
+# --- reporting ---------------------------------------------------------------
+
+def connection_stats():
+    """This process's counters, including requests served on reused connections."""
+    with _stats_lock:
+        snapshot = dict(stats)
+    snapshot["connections_reused"] = max(
+        0, snapshot.get("requests", 0) - snapshot.get("connections_new", 0))
+    return snapshot
+
+
+def flush_stats():
+    """Add counter deltas since the last flush to the cluster-wide `connection_stats` hash."""
+    with _stats_lock:
+        delta = stats - _flushed
+        _flushed.update(delta)
+    if not delta:
+        return
+    try:
+        pipe = r.pipeline()
+        for name, n in delta.items():
+            pipe.hincrby("connection_stats", name, n)
+        pipe.execute()
+    except Exception as e:
+        logger.error(f"Could not publish connection stats: {e}")
+        with _stats_lock:
+            _flushed.subtract(delta)
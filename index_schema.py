@@ -0,0 +1,160 @@
+# index_schema.py
+"""
+Mapping of the web-crawl search index, index creation and migration from
+the original index.
+
+    python index_schema.py create            # create Config.INDEX_NAME if missing
+    python index_schema.py migrate [--delete-legacy]
+    python index_schema.py stats             # store bytes per document, old vs new
+
+Each document keeps what search needs and nothing else:
+  url       keyword (also the document id)
+  terms     the analyzer's output joined by spaces; indexed with term
+            frequencies only (no positions) and left out of _source
+  snippet   first Config.INDEX_SNIPPET_CHARS characters of the text, stored only
+  timestamp date
+The original index stored the full text in `content` and every token again
+in `tokens`, both in _source and analyzed by OpenSearch.
+"""
+import argparse
+import logging
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+MAPPING = {
+    "settings": {
+        "index": {
+            "codec": "best_compression",
+            "number_of_shards": 1,
+        },
+    },
+    "mappings": {
+        "dynamic": "strict",
+        "_source": {"excludes": ["terms"]},
+        "properties": {
+            "url": {"type": "keyword"},
+            # Terms arrive stemmed and stop-word free (analyzer.py); OpenSearch only splits them.
+            "terms": {"type": "text", "analyzer": "whitespace", "index_options": "freqs"},
+            "snippet": {"type": "text", "index": False},
+            "timestamp": {"type": "date"},
+        },
+    },
+}
+
+# Rebuilds a legacy document in the new model during _reindex.
+REINDEX_SCRIPT = """
+String text = ctx._source.content == null ? '' : ctx._source.content;
+List tokens = ctx._source.tokens == null ? [] : ctx._source.tokens;
+ctx._source.terms = String.join(' ', tokens);
+ctx._source.snippet = text.length() > params.snippet ? text.substring(0, params.snippet) : text;
+ctx._source.remove('content');
+ctx._source.remove('tokens');
+"""
+
+
+def document(url, terms, text, timestamp):
+    """A document in the compact model."""
+    return {
+        "url": url,
+        "terms": " ".join(terms),
+        "snippet": text[:Config.INDEX_SNIPPET_CHARS],
+        "timestamp": timestamp,
+    }
+
+
+def search_body(terms, size=10):
+    """
+    BM25 query over the new `terms` field and, while it still exists, the
+    legacy index's `tokens` field.
+    """
+    return {
+        "size": size,
+        "query": {"multi_match": {"query": " ".join(terms), "fields": ["terms", "tokens"]}},
+        "_source": ["url", "snippet"],
+    }
+
+
+def search_indices():
+    return f"{Config.INDEX_NAME},{Config.LEGACY_INDEX_NAME}"
+
+
+def ensure_index(client):
+    """Create Config.INDEX_NAME with MAPPING unless it exists. Returns True if created."""
+    if client.indices.exists(index=Config.INDEX_NAME):
+        return False
+    try:
+        client.indices.create(index=Config.INDEX_NAME, body=MAPPING)
+    except Exception:
+        # Another indexer process may have created it first.
+        if client.indices.exists(index=Config.INDEX_NAME):
+            return False
+        raise
+    logger.info(f"Created index {Config.INDEX_NAME}")
+    return True
+
+
+def migrate(client, delete_legacy=False):
+    """
+    Copy every legacy document into the new index with REINDEX_SCRIPT. It
+    uses op_type=create, so documents already re-crawled into the new index
+    are kept. Search covers both indices until the legacy one is deleted.
+    """
+    ensure_index(client)
+    if not client.indices.exists(index=Config.LEGACY_INDEX_NAME):
+        logger.info(f"No legacy index {Config.LEGACY_INDEX_NAME}, nothing to migrate")
+        return None
+    result = client.reindex(body={
+        "conflicts": "proceed",
+        "source": {"index": Config.LEGACY_INDEX_NAME},
+        "dest": {"index": Config.INDEX_NAME, "op_type": "create"},
+        "script": {"lang": "painless", "source": REINDEX_SCRIPT,
+                   "params": {"snippet": Config.INDEX_SNIPPET_CHARS}},
+    }, wait_for_completion=True, refresh=True, request_timeout=3600)
+    logger.info(f"Reindexed {result.get('created', 0)} documents from {Config.LEGACY_INDEX_NAME} "
+                f"({result.get('version_conflicts', 0)} already present, "
+                f"{len(result.get('failures', []))} failures)")
+    if delete_legacy and not result.get("failures"):
+        client.indices.delete(index=Config.LEGACY_INDEX_NAME)
+        logger.info(f"Deleted legacy index {Config.LEGACY_INDEX_NAME}")
+    from search_service import bump_generation
+    bump_generation()
+    return result
+
+
+def footprint(client):
+    """{index: {"docs", "store_bytes", "bytes_per_doc"}} for the new and the legacy index."""
+    names = [name for name in (Config.INDEX_NAME, Config.LEGACY_INDEX_NAME)
+             if client.indices.exists(index=name)]
+    if not names:
+        return {}
+    stats = client.indices.stats(index=",".join(names), metric="docs,store")["indices"]
+    out = {}
+    for name, data in stats.items():
+        docs = data["primaries"]["docs"]["count"]
+        size = data["primaries"]["store"]["size_in_bytes"]
+        out[name] = {"docs": docs, "store_bytes": size,
+                     "bytes_per_doc": round(size / docs, 1) if docs else 0.0}
+    return out
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    from indexer_node import opensearch_client
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("command", choices=["create", "migrate", "stats"])
+    ap.add_argument("--delete-legacy", action="store_true",
+                    help="delete the legacy index once every document was copied")
+    args = ap.parse_args()
+    client = opensearch_client()
+    if args.command == "create":
+        print("created" if ensure_index(client) else "exists")
+    elif args.command == "migrate":
+        migrate(client, args.delete_legacy)
+    for name, data in footprint(client).items():
+        print(f"{name:<20} {data['docs']:>10} docs {data['store_bytes']:>14} bytes "
+              f"{data['bytes_per_doc']:>10} bytes/doc")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,45 +1,202 @@
 import json
 import logging
 import os
-import re
-from collections import defaultdict, Counter
+import threading
+import time
 from config import Config
 from datetime import datetime
 from opensearchpy import OpenSearch, RequestsHttpConnection
 from requests_aws4auth import AWS4Auth
-import nltk
-from nltk.corpus import stopwords
-from nltk.stem import PorterStemmer
 import boto3
+from segments import read_record
+from analyzer import get_analyzer
+from local_index import get_local_index
+import index_schema
+import metrics
 
 s3 = boto3.client("s3", region_name=os.getenv("AWS_REGION", "eu-north-1"))
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-session= boto3.Session()               
-creds= session.get_credentials()
-region= session.region_name or os.getenv("AWS_REGION", "eu-north-1")
-
-awsauth = AWS4Auth(
-    creds.access_key,
-    creds.secret_key,
-    region,
-    "es",
-    session_token=creds.token                
-)
+
+def opensearch_client():
+    """SigV4-signed client for the OpenSearch domain (credentials are only needed for this backend)."""
+    session= boto3.Session()               
+    creds= session.get_credentials()
+    region= session.region_name or os.getenv("AWS_REGION", "eu-north-1")
+
+    awsauth = AWS4Auth(
+        creds.access_key,
+        creds.secret_key,
+        region,
+        "es",
+        session_token=creds.token                
+    )
+    return OpenSearch(
+        hosts=[{"host": os.environ["OPENSEARCH_HOST"], "port": 443}],
+        http_auth=awsauth,
+        use_ssl=True,
+        verify_certs=True,
+        connection_class=RequestsHttpConnection,
+    )  
+
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class BulkBuffer:
+    """
+    Documents waiting for one bulk write: `send([(doc id, json source)])`
+    returns an HTTP-style status per document (one `_bulk` request for
+    OpenSearch, one new segment for the local index). flush() is triggered once
+    Config.INDEX_BULK_DOCS documents or Config.INDEX_BULK_BYTES of JSON are
+    buffered, or by a timer Config.INDEX_BULK_MAX_AGE seconds after the
+    first one. Documents rejected with a retryable status (or lost with the
+    whole request) are retried up to Config.INDEX_BULK_RETRIES times, after
+    Config.INDEX_BULK_RETRY_BACKOFF seconds doubled per attempt: they wait
+    apart from the buffer and the timer sends them once due, so a throttled
+    cluster gets time to recover. After each request `on_done([(tag, ok), ...])` runs once for the
+    documents that were indexed (ok=True) or given up on (ok=False).
+    """
+
+    def __init__(self, send, on_done=None):
+        self.send = send
+        self.on_done = on_done
+        self._lock = threading.Lock()
+        self._reset()
+        self._retries = []   # (due, doc id, json source, attempts, tag)
+        self._stop = threading.Event()
+        self._timer = threading.Thread(target=self._flush_when_old, daemon=True)
+        self._timer.start()
+
+    def _reset(self):
+        self._docs = []   # (doc id, json source, attempts, tag)
+        self._size = 0
+        self._opened = None
+
+    def add(self, doc_id, source, tag=None, attempts=0):
+        with self._lock:
+            if self._opened is None:
+                self._opened = time.monotonic()
+            self._docs.append((doc_id, source, attempts, tag))
+            self._size += len(source)
+            full = (len(self._docs) >= Config.INDEX_BULK_DOCS
+                    or self._size >= Config.INDEX_BULK_BYTES)
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Send the buffered documents in one bulk request. Returns how many were indexed."""
+        with self._lock:
+            docs = self._docs
+            self._reset()
+        if not docs:
+            return 0
+        try:
+            with metrics.timed("index_stage_seconds", stage="index"):
+                statuses = self.send([(doc_id, source) for doc_id, source, _attempts, _tag in docs])
+        except Exception as e:
+            logger.error(f"Bulk request of {len(docs)} documents failed: {e}")
+            statuses = [None] * len(docs)
+        done, retry = [], []
+        for (doc_id, source, attempts, tag), status in zip(docs, statuses):
+            if status is not None and status < 300:
+                done.append((tag, True))
+            elif (status is None or status in RETRYABLE_STATUSES) and attempts < Config.INDEX_BULK_RETRIES:
+                retry.append((doc_id, source, tag, attempts + 1))
+            else:
+                logger.error(f"Giving up on indexing {doc_id} (status {status}, {attempts + 1} attempts)")
+                done.append((tag, False))
+        indexed = sum(ok for _tag, ok in done)
+        metrics.inc("index_docs_total", indexed, status="success")
+        metrics.inc("index_docs_total", len(done) - indexed, status="error")
+        logger.info(f"Bulk indexed {indexed}/{len(docs)} documents, {len(retry)} to retry")
+        if done and self.on_done is not None:
+            try:
+                self.on_done(done)
+            except Exception as e:
+                logger.error(f"Bulk index callback failed: {e}")
+        if retry:
+            now = time.monotonic()
+            with self._lock:
+                self._retries += [(now + Config.INDEX_BULK_RETRY_BACKOFF * 2 ** (attempts - 1),
+                                   doc_id, source, attempts, tag)
+                                  for doc_id, source, tag, attempts in retry]
+        return indexed
+
+    def _requeue(self, due_by=None):
+        """Move retries due by `due_by` (all if None) into the buffer. Returns how many moved."""
+        with self._lock:
+            due = [doc for doc in self._retries if due_by is None or doc[0] <= due_by]
+            if not due:
+                return 0
+            self._retries = [doc for doc in self._retries if due_by is not None and doc[0] > due_by]
+            if self._opened is None:
+                self._opened = time.monotonic()
+            for _due, doc_id, source, attempts, tag in due:
+                self._docs.append((doc_id, source, attempts, tag))
+                self._size += len(source)
+        return len(due)
+
+    def _flush_when_old(self):
+        while not self._stop.wait(0.5):
+            now = time.monotonic()
+            opened = self._opened
+            try:
+                if self._requeue(now) or (opened is not None and now - opened >= Config.INDEX_BULK_MAX_AGE):
+                    self.flush()
+            except Exception as e:
+                logger.error(f"Bulk flush failed: {e}")
+
+    def close(self):
+        self._stop.set()
+        self._requeue()
+        self.flush()
+
+
 class IndexerNode:
-    def __init__(self):
-        # Initialize components for text normalization
-        self.stemmer = PorterStemmer()
-        self.stop_words = set(stopwords.words("english"))
-        self.os_client = OpenSearch(
-            hosts=[{"host": os.environ["OPENSEARCH_HOST"], "port": 443}],
-            http_auth=awsauth,
-            use_ssl=True,
-            verify_certs=True,
-            connection_class=RequestsHttpConnection,
-        )  
+    def __init__(self, on_indexed=None):
+        # Created once per worker process (see tasks.get_indexer): the
+        # OpenSearch client and the analyzer's stem cache are reused by every task.
+        # Config.INDEX_BACKEND = "local" uses the embedded index in
+        # Config.LOCAL_INDEX_DIR instead of OpenSearch.
+        self.pid = os.getpid()
+        self.analyzer = get_analyzer()
+        if Config.INDEX_BACKEND == "local":
+            self.os_client = None
+            self.local_index = get_local_index()
+        else:
+            self.os_client = opensearch_client()
+            self.local_index = None
+            try:
+                index_schema.ensure_index(self.os_client)
+            except Exception as e:
+                logger.error(f"Could not create index {Config.INDEX_NAME}: {e}")
+        self.on_indexed = on_indexed
+        self._bulk = None
+
+    @property
+    def bulk(self):
+        """The bulk buffer, started by the first add_to_index (search-only nodes never need it)."""
+        if self._bulk is None:
+            send = self._send_local if self.local_index is not None else self._send_opensearch
+            self._bulk = BulkBuffer(send, self.on_indexed)
+        return self._bulk
+
+    def _send_opensearch(self, docs):
+        lines = []
+        for doc_id, source in docs:
+            lines.append(json.dumps({"index": {"_index": Config.INDEX_NAME, "_id": doc_id}}))
+            lines.append(source)
+        response = self.os_client.bulk(body="\n".join(lines) + "\n")
+        return [next(iter(item.values())).get("status", 500) for item in response["items"]]
+
+    def _send_local(self, docs):
+        sources = [json.loads(source) for _doc_id, source in docs]
+        self.local_index.add_documents([(doc["url"], doc["terms"].split()) for doc in sources])
+        return [201] * len(docs)
+
     def tokenize_and_normalize(self, text):
         """
         Tokenize text using regular expressions,
@@ -47,54 +204,58 @@ class IndexerNode:
         remove stop-words, and apply stemming.
         Returns the list of normalized tokens.
         """
-        # Use regex to extract words (alphanumeric and underscore)
-        tokens = re.findall(r'\w+', text.lower())
-        normalized_tokens = []
-        for token in tokens:
-            if token not in self.stop_words:
-                stemmed = self.stemmer.stem(token)
-                normalized_tokens.append(stemmed)
-        return normalized_tokens
-        
-    def add_to_index(self, url, s3_key):
+        return self.analyzer.analyze(text)
+
+    def load_text(self, s3_key, offset=None, length=None):
+        """Read page text from its own S3 object or from a crawl segment record."""
+        if offset is not None:
+            return read_record(s3_key, offset, length).decode()
+        obj = s3.get_object(Bucket=os.environ['S3_BUCKET'], Key=s3_key)
+        return obj["Body"].read().decode()
+
+    def add_to_index(self, url, s3_key, offset=None, length=None, tag=None):
         """
         Add or update the index with content from the given URL.
         Tracks term frequencies so that ranking can be applied.
+        The document is buffered for the next bulk request; `tag` is handed
+        to the node's on_indexed callback once that request is done.
         """
-        obj = s3.get_object(Bucket=os.environ['S3_BUCKET'], Key=s3_key)
-        text  = obj["Body"].read().decode()
-        tokens = self.tokenize_and_normalize(text)
-        document = {
-            'url': url,
-            'content': text,
-            'tokens': tokens,
-            'timestamp': datetime.utcnow()
-        }
-        self.os_client.index(
-            index='web-crawl',
-            body=document,
-            id=url
-        )
+        try:
+            with metrics.timed("index_seconds"):
+                with metrics.timed("index_stage_seconds", stage="s3_get"):
+                    text  = self.load_text(s3_key, offset, length)
+                with metrics.timed("index_stage_seconds", stage="tokenize"):
+                    tokens = self.tokenize_and_normalize(text)
+                document = index_schema.document(url, tokens, text, datetime.utcnow().isoformat())
+        except Exception:
+            metrics.inc("index_docs_total", status="error")
+            raise
+        self.bulk.add(url, json.dumps(document), tag)
+
+    def close(self):
+        """Index whatever is still buffered; called when a worker process shuts down."""
+        if self._bulk is not None:
+            self._bulk.close()
         
     def search(self, query):
-        tokens = self.tokenize_and_normalize(query)
-        response = self.os_client.search({
-            "query": {
-                "match": {
-                    "tokens": " ".join(tokens)
-                }
-            }
-        })
-        return [hit['_source']['url'] for hit in response['hits']['hits']]
+        return self.search_terms(self.tokenize_and_normalize(query))
+
+    def search_terms(self, tokens):
+        """URLs of the best matches for already analyzed query terms."""
+        if self.local_index is not None:
+            return [url for url, _score in self.local_index.search(tokens)]
+        response = self.os_client.search(index=index_schema.search_indices(),
+                                         body=index_schema.search_body(tokens),
+                                         ignore_unavailable=True)
+        # While a migration is running a page can be in both indices.
+        return list(dict.fromkeys(hit['_source']['url'] for hit in response['hits']['hits']))
 
     def print_index_stats(self):
         """Print statistics about the index."""
         print("\nIndex Statistics:")
-        print(f"Total unique words in index: {len(self.index)}")
-        all_urls = set()
-        for postings in self.index.values():
-            all_urls.update(postings.keys())
-        print(f"Total URLs indexed: {len(all_urls)}")
-        print("\nSample of indexed content:")
-        for token in list(self.index.keys())[:5]:
-            print(f"Token '{token}' found in: {self.index[token]}")
\ No newline at end of file
+        if self.local_index is not None:
+            for name, value in self.local_index.stats().items():
+                print(f"{name}: {value}")
+        else:
+            for name, data in index_schema.footprint(self.os_client).items():
+                print(f"{name}: {data['docs']} docs, {data['bytes_per_doc']} bytes/doc")
@@ -0,0 +1,259 @@
+# jobs.py
+import json
+import logging
+import re
+import threading
+import time
+import uuid
+from config import Config
+from redis_clinet import r
+from frontier import Frontier, host_of
+
+logger = logging.getLogger(__name__)
+
+# Key layout:
+#   crawl_jobs          HASH  job id -> JSON settings (max_depth, domains, weight, created)
+#   crawl_jobs:completed ZSET job id -> completion time, for jobs with nothing left to crawl
+#   job:<id>:stats      HASH  progress counters (seeded, dispatched, finished, discovered,
+#                             reassigned, status:<status>); reassigned counts crawls
+#                             handed back from crawlers that stopped beating
+# Each job has its own frontier under <FRONTIER_PREFIX>job:<id>: except the
+# default job, which keeps the plain FRONTIER_PREFIX keys.
+
+DEFAULT_JOB = "default"
+
+# KEYS: completed zset, then <frontier stats, job stats> per job; ARGV: now, job ids.
+# A job is complete when nothing is queued or leased and every dispatched URL
+# has a result (or was handed back by a failed crawler). Checking and marking
+# in one script means a concurrent push either lands before the check (the
+# job stays active) or reopens the job after it: every path that queues URLs
+# calls JobRegistry.reopen once it added some.
+_COMPLETE_LUA = """
+local done = {}
+for i = 2, #ARGV do
+    local frontier, stats = KEYS[2 * i - 2], KEYS[2 * i - 1]
+    local queued = tonumber(redis.call('HGET', frontier, 'queued') or '0')
+    local inflight = tonumber(redis.call('HGET', frontier, 'inflight') or '0')
+    local counts = redis.call('HMGET', stats, 'dispatched', 'finished', 'reassigned')
+    local open = tonumber(counts[1] or '0') - tonumber(counts[2] or '0') - tonumber(counts[3] or '0')
+    if queued <= 0 and inflight <= 0 and open <= 0 then
+        redis.call('ZADD', KEYS[1], 'NX', ARGV[1], ARGV[i])
+        done[#done + 1] = ARGV[i]
+    end
+end
+return done
+"""
+
+
+class DomainScope:
+    """
+    Allowed domains precompiled into a set. A host is in scope when it is one
+    of the domains or a subdomain of one; checking costs one set lookup per
+    label of the host. An empty scope allows every host.
+    """
+
+    def __init__(self, domains=None):
+        self.domains = frozenset(self.parse(domains))
+
+    @staticmethod
+    def parse(domains):
+        """Domains from a list or a comma/space separated string ('*.' and dots stripped)."""
+        if not domains:
+            return []
+        if isinstance(domains, str):
+            domains = re.split(r"[\s,]+", domains)
+        out = []
+        for domain in domains:
+            domain = domain.strip().lower()
+            if domain.startswith("*."):
+                domain = domain[2:]
+            domain = domain.strip(".")
+            if domain:
+                out.append(domain)
+        return out
+
+    def __bool__(self):
+        return bool(self.domains)
+
+    def allows(self, url):
+        if not self.domains:
+            return True
+        host = host_of(url).split(":", 1)[0]
+        while host:
+            if host in self.domains:
+                return True
+            host = host.partition(".")[2]
+        return False
+
+
+class CrawlJob:
+    """One crawl: its own frontier, depth limit, domain scope and counters."""
+
+    def __init__(self, job_id, max_depth=1, domains=None, weight=1, created=None):
+        self.id = job_id
+        self.max_depth = max_depth # None means no limit.
+        self.scope = DomainScope(domains)
+        self.weight = max(1, int(weight or 1)) # share of worker capacity relative to other jobs
+        self.created = created or time.time()
+        self.completed = None # time the job ran out of work; None while it is active
+        prefix = Config.FRONTIER_PREFIX if job_id == DEFAULT_JOB else f"{Config.FRONTIER_PREFIX}job:{job_id}:"
+        self.frontier = Frontier(prefix=prefix)
+        self.stats_key = f"job:{job_id}:stats"
+
+    def settings(self):
+        return {
+            "id": self.id,
+            "max_depth": self.max_depth,
+            "domains": sorted(self.scope.domains),
+            "weight": self.weight,
+            "created": self.created,
+        }
+
+    def configure(self, max_depth=None, domains=None, weight=None):
+        """Change the settings of this job only (e.g. /seed on an existing job)."""
+        self.max_depth = max_depth
+        self.scope = DomainScope(domains)
+        if weight is not None:
+            self.weight = max(1, int(weight))
+
+    def count(self, pipe=None, **counters):
+        """Add to this job's progress counters (pass a pipeline to batch it)."""
+        target = pipe if pipe is not None else r.pipeline(transaction=False)
+        for name, n in counters.items():
+            if n:
+                target.hincrby(self.stats_key, name, n)
+        if pipe is None:
+            target.execute()
+
+    def progress(self):
+        stats = {k: int(v) for k, v in r.hgetall(self.stats_key).items()}
+        return {
+            **self.settings(),
+            "completed": self.completed,
+            "queued": self.frontier.size(),
+            "dispatched": stats.pop("dispatched", 0),
+            "finished": stats.pop("finished", 0),
+            "discovered": stats.pop("discovered", 0),
+            "seeded": stats.pop("seeded", 0),
+            "reassigned": stats.pop("reassigned", 0),
+            "statuses": {k.split(":", 1)[1]: v for k, v in stats.items() if k.startswith("status:")},
+        }
+
+
+class JobRegistry:
+    """
+    Crawl jobs shared by every master through Redis. refresh() picks up jobs
+    created, changed, completed or deleted by other masters; frontiers of
+    known jobs are kept. Completed jobs are left out of active() and deleted
+    Config.JOB_RETENTION seconds after they complete (the default job is
+    only ever marked completed). The job dict is shared by the master's
+    threads, so it is only changed and copied under a lock.
+    """
+
+    key = "crawl_jobs"
+    completed_key = "crawl_jobs:completed"
+
+    def __init__(self):
+        self.jobs = {}
+        self._lock = threading.Lock()
+        self._complete = r.register_script(_COMPLETE_LUA)
+        self.refresh()
+        if DEFAULT_JOB not in self.jobs:
+            self.save(CrawlJob(DEFAULT_JOB))
+
+    def refresh(self):
+        pipe = r.pipeline(transaction=False)
+        pipe.hgetall(self.key)
+        pipe.zrange(self.completed_key, 0, -1, withscores=True)
+        settings, completed = pipe.execute()
+        completed = dict(completed)
+        parsed = {}
+        for job_id, raw in settings.items():
+            try:
+                parsed[job_id] = json.loads(raw)
+            except ValueError:
+                logger.error(f"Malformed settings for crawl job {job_id}")
+        with self._lock:
+            for job_id in set(self.jobs) - set(settings) - {DEFAULT_JOB}:
+                del self.jobs[job_id]
+            for job_id, data in parsed.items():
+                job = self.jobs.get(job_id)
+                if job is None:
+                    job = self.jobs[job_id] = CrawlJob(job_id, data.get("max_depth", 1), data.get("domains"),
+                                                       data.get("weight", 1), data.get("created"))
+                else:
+                    job.configure(data.get("max_depth", 1), data.get("domains"), data.get("weight"))
+                job.completed = completed.get(job_id)
+
+    def save(self, job):
+        with self._lock:
+            self.jobs[job.id] = job
+        r.hset(self.key, job.id, json.dumps(job.settings()))
+        return job
+
+    def create(self, max_depth=1, domains=None, weight=1):
+        job = CrawlJob(uuid.uuid4().hex[:12], max_depth, domains, weight)
+        logger.info(f"Created crawl job {job.id}: max depth {job.max_depth}, "
+                    f"domains {sorted(job.scope.domains) or 'all'}")
+        return self.save(job)
+
+    def delete(self, job):
+        """Drop a job with its frontier, seen-set and counters."""
+        keys = job.frontier.redis_keys() + [f"{job.frontier.prefix}journal", job.stats_key]
+        pipe = r.pipeline(transaction=False)
+        pipe.delete(*keys)
+        pipe.hdel(self.key, job.id)
+        pipe.zrem(self.completed_key, job.id)
+        pipe.execute()
+        with self._lock:
+            self.jobs.pop(job.id, None)
+        logger.info(f"Deleted crawl job {job.id}")
+
+    def reopen(self, job):
+        """Make the job active again after URLs were queued for it (another master may have completed it)."""
+        r.zrem(self.completed_key, job.id)
+        job.completed = None
+
+    def check_completed(self):
+        """
+        Mark active jobs that ran out of work as completed (one script call
+        for all of them) and delete jobs completed more than
+        Config.JOB_RETENTION seconds ago. Returns the newly completed jobs.
+        """
+        now = time.time()
+        active = self.active()
+        done = []
+        if active:
+            keys = [self.completed_key]
+            for job in active:
+                keys += [f"{job.frontier.prefix}stats", job.stats_key]
+            by_id = {job.id: job for job in active}
+            for job_id in self._complete(keys=keys, args=[now] + list(by_id)):
+                job = by_id[job_id]
+                job.completed = now
+                done.append(job)
+                logger.info(f"Crawl job {job.id} completed")
+        for job in self:
+            if job.id != DEFAULT_JOB and job.completed and job.completed < now - Config.JOB_RETENTION:
+                self.delete(job)
+        return done
+
+    def active(self):
+        """Jobs that still have work: the only ones dispatch and lease expiry look at."""
+        return [job for job in self if job.completed is None]
+
+    def get(self, job_id):
+        """The job with this id (DEFAULT_JOB for None), or None if unknown."""
+        job_id = job_id or DEFAULT_JOB
+        job = self.jobs.get(job_id)
+        if job is None:
+            self.refresh()
+            job = self.jobs.get(job_id)
+        return job
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self.jobs.values()))
+
+    def __len__(self):
+        return len(self.jobs)
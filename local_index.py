@@ -0,0 +1,406 @@
+# local_index.py
+import fcntl
+import heapq
+import logging
+import math
+import mmap
+import os
+import socket
+import struct
+import threading
+import time
+import uuid
+from array import array
+from collections import Counter, defaultdict
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Embedded inverted index: a directory of immutable segment files, one per
+# bulk flush, merged in the background. Segment layout (little-endian, every
+# section 8-byte aligned, numbers in native arrays so they can be read
+# straight from the memory map):
+#   header        MAGIC, docs, terms, total term count, 8 section offsets
+#   doc_lens      uint32 per doc: number of terms
+#   url_offsets   uint64 per doc + 1, into urls
+#   urls          utf-8 URLs back to back
+#   term_offsets  uint64 per term + 1, into terms
+#   terms         utf-8 terms, sorted, back to back
+#   dfs           uint32 per term: documents containing it
+#   post_offsets  uint64 per term + 1, into postings
+#   postings      per term: varint (doc id delta, term frequency) pairs
+# File names start with a zero-padded generation (publish time in ns), so
+# sorting names orders segments oldest to newest. Writers take the
+# generation and rename the finished file into place under a shared flock on
+# publish.lock; a merger takes it exclusively to see every segment older than
+# a given moment. A URL indexed again lands
+# in a newer segment; older copies are masked at query time and dropped by
+# the next merge that covers them.
+
+MAGIC = b"CRAWLIX1"
+HEADER = struct.Struct("<8sIIQ8Q")
+SUFFIX = ".seg"
+
+
+def encode_varints(values, out):
+    for v in values:
+        while v >= 0x80:
+            out.append((v & 0x7F) | 0x80)
+            v >>= 7
+        out.append(v)
+
+
+def decode_varints(data):
+    values, v, shift = [], 0, 0
+    for byte in data:
+        v |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            values.append(v)
+            v, shift = 0, 0
+    return values
+
+
+def _pad(out):
+    out += b"\0" * (-len(out) % 8)
+
+
+def write_segment(path, urls, doc_lens, postings):
+    """
+    Write a segment atomically (tmp file + rename). `postings` maps each term
+    to its [(doc id, term frequency)] list in increasing doc id order.
+    """
+    out = bytearray(HEADER.size)
+    offsets = []
+
+    def section(data):
+        offsets.append(len(out))
+        out.extend(data)
+        _pad(out)
+
+    url_bytes = [url.encode() for url in urls]
+    terms = sorted(postings)
+    term_bytes = [term.encode() for term in terms]
+    blob = bytearray()
+    post_offsets = array("Q", [0])
+    for term in terms:
+        previous = 0
+        pairs = []
+        for doc, tf in postings[term]:
+            pairs += (doc - previous, tf)
+            previous = doc
+        encode_varints(pairs, blob)
+        post_offsets.append(len(blob))
+
+    section(array("I", doc_lens).tobytes())
+    section(array("Q", _running_offsets(url_bytes)).tobytes())
+    section(b"".join(url_bytes))
+    section(array("Q", _running_offsets(term_bytes)).tobytes())
+    section(b"".join(term_bytes))
+    section(array("I", [len(postings[term]) for term in terms]).tobytes())
+    section(post_offsets.tobytes())
+    section(blob)
+    HEADER.pack_into(out, 0, MAGIC, len(urls), len(terms), sum(doc_lens), *offsets)
+
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(out)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return len(out)
+
+
+def _running_offsets(items):
+    offsets, total = [0], 0
+    for item in items:
+        total += len(item)
+        offsets.append(total)
+    return offsets
+
+
+class Segment:
+    """
+    A memory-mapped, read-only segment file. It is never closed explicitly:
+    a search may still be reading a segment that a refresh dropped, so the
+    map goes away with the last reference.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.n_docs, self.n_terms, self.total_terms, *offsets = HEADER.unpack_from(self._mm)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not an index segment")
+        view = memoryview(self._mm)
+        bounds = offsets + [len(self._mm)]
+        sections = [view[start:end] for start, end in zip(bounds, bounds[1:])]
+        self.doc_lens = sections[0].cast("I")[:self.n_docs]
+        self._url_offsets = sections[1].cast("Q")[:self.n_docs + 1]
+        self._urls = sections[2]
+        self._term_offsets = sections[3].cast("Q")[:self.n_terms + 1]
+        self._terms = sections[4]
+        self.dfs = sections[5].cast("I")[:self.n_terms]
+        self._post_offsets = sections[6].cast("Q")[:self.n_terms + 1]
+        self._postings = sections[7]
+        self._url_list = None
+
+    @property
+    def size(self):
+        return len(self._mm)
+
+    def url(self, doc):
+        return bytes(self._urls[self._url_offsets[doc]:self._url_offsets[doc + 1]]).decode()
+
+    def urls(self):
+        if self._url_list is None:
+            self._url_list = [self.url(doc) for doc in range(self.n_docs)]
+        return self._url_list
+
+    def term(self, i):
+        return bytes(self._terms[self._term_offsets[i]:self._term_offsets[i + 1]]).decode()
+
+    def find(self, term):
+        """Index of `term` in the sorted term table (binary search), or None."""
+        key = term.encode()
+        lo, hi = 0, self.n_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            found = bytes(self._terms[self._term_offsets[mid]:self._term_offsets[mid + 1]])
+            if found < key:
+                lo = mid + 1
+            elif found > key:
+                hi = mid
+            else:
+                return mid
+        return None
+
+    def postings(self, i):
+        """[(doc id, term frequency)] of the i-th term."""
+        values = decode_varints(self._postings[self._post_offsets[i]:self._post_offsets[i + 1]])
+        pairs, doc = [], 0
+        for k in range(0, len(values), 2):
+            doc += values[k]
+            pairs.append((doc, values[k + 1]))
+        return pairs
+
+
+class LocalIndex:
+    """
+    BM25 search over the segments in one directory. Every add_documents()
+    call writes one new segment, so adds are incremental and never rewrite
+    existing files; a background thread merges
+    Config.LOCAL_INDEX_MERGE_FACTOR neighbouring segments once there are
+    more than that (one merger at a time across processes, via flock).
+    Readers pick up new segments on their next query.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.writer = f"{socket.gethostname()}-{os.getpid()}"
+        self._lock = threading.Lock()
+        self._segments = {}     # name -> Segment
+        self._live = []         # [(Segment, masked doc ids)], newest first
+        self._names = None
+        self.docs = 0
+        self.avg_doc_len = 0.0
+        self._merger = None
+        self._seq = 0
+
+    # -- reading -----------------------------------------------------------
+
+    def _list(self):
+        return sorted(name for name in os.listdir(self.directory) if name.endswith(SUFFIX))
+
+    def refresh(self):
+        """Open new segments, drop merged ones and recompute which docs are superseded."""
+        names = self._list()
+        with self._lock:
+            if names == self._names:
+                return
+            segments = {}
+            for name in names:
+                segment = self._segments.get(name)
+                if segment is None:
+                    try:
+                        segment = Segment(os.path.join(self.directory, name))
+                    except FileNotFoundError:
+                        continue  # merged away since the listing; the merged file is listed next time
+                segments[name] = segment
+            live, seen, docs, terms = [], set(), 0, 0
+            for name in reversed(names):
+                segment = segments.get(name)
+                if segment is None:
+                    continue
+                urls = segment.urls()
+                masked = {doc for doc, url in enumerate(urls) if url in seen}
+                seen.update(urls)
+                live.append((segment, masked))
+                docs += segment.n_docs - len(masked)
+                terms += segment.total_terms - sum(segment.doc_lens[doc] for doc in masked)
+            self._segments, self._live, self._names = segments, live, names
+            self.docs = docs
+            self.avg_doc_len = terms / docs if docs else 0.0
+
+    def search(self, terms, size=10):
+        """[(url, BM25 score)] of the best `size` documents for the query terms."""
+        self.refresh()
+        with self._lock:
+            live, n, avg = self._live, self.docs, self.avg_doc_len or 1.0
+        k1, b = Config.BM25_K1, Config.BM25_B
+        hits = [(term, [(segment, masked, segment.find(term)) for segment, masked in live])
+                for term in set(terms)]
+        scores = defaultdict(float)
+        for term, found in hits:
+            # Document frequency includes superseded copies; close enough for ranking.
+            df = sum(segment.dfs[i] for segment, _masked, i in found if i is not None)
+            if not df:
+                continue
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for segment, masked, i in found:
+                if i is None:
+                    continue
+                lens = segment.doc_lens
+                for doc, tf in segment.postings(i):
+                    if doc not in masked:
+                        norm = k1 * (1 - b + b * lens[doc] / avg)
+                        scores[(segment, doc)] += idf * tf * (k1 + 1) / (tf + norm)
+        best = heapq.nlargest(size, scores.items(), key=lambda item: item[1])
+        return [(segment.url(doc), score) for (segment, doc), score in best]
+
+    def stats(self):
+        self.refresh()
+        with self._lock:
+            return {
+                "segments": len(self._live),
+                "docs": self.docs,
+                "bytes": sum(segment.size for segment, _masked in self._live),
+                "avg_doc_len": round(self.avg_doc_len, 1),
+            }
+
+    # -- writing -----------------------------------------------------------
+
+    def _new_name(self, generation, kind):
+        self._seq += 1
+        return f"{generation:020d}-{kind}-{uuid.uuid4().hex[:8]}-{self._seq:05d}{SUFFIX}"
+
+    def _publishing(self, exclusive=False):
+        """Open publish.lock and flock it (shared for writers, exclusive for a merger)."""
+        lock = open(os.path.join(self.directory, "publish.lock"), "w")
+        fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        return lock
+
+    def add_documents(self, docs):
+        """
+        Index [(url, terms)] as one new segment (the last copy of a repeated
+        URL wins) and start background merging in this process.
+        """
+        latest = {}
+        for url, terms in docs:
+            latest[url] = terms
+        if not latest:
+            return None
+        urls, doc_lens = list(latest), []
+        postings = defaultdict(list)
+        for doc, terms in enumerate(latest.values()):
+            doc_lens.append(len(terms))
+            for term, tf in Counter(terms).items():
+                postings[term].append((doc, tf))
+        pending = os.path.join(self.directory, f".{uuid.uuid4().hex}.pending")
+        write_segment(pending, urls, doc_lens, postings)
+        with self._publishing():
+            name = self._new_name(time.time_ns(), self.writer)
+            os.replace(pending, os.path.join(self.directory, name))
+        self._start_merger()
+        return name
+
+    def _start_merger(self):
+        if self._merger is None or not self._merger.is_alive():
+            self._merger = threading.Thread(target=self._merge_loop, daemon=True)
+            self._merger.start()
+
+    def _merge_loop(self):
+        while True:
+            time.sleep(Config.LOCAL_INDEX_MERGE_INTERVAL)
+            try:
+                while self.maybe_merge():
+                    pass
+            except Exception as e:
+                logger.error(f"Index merge failed: {e}")
+
+    def maybe_merge(self):
+        """
+        Merge the run of Config.LOCAL_INDEX_MERGE_FACTOR neighbouring segments
+        with the fewest bytes, if there are more segments than that. Returns
+        the merged segment's name, or None.
+        """
+        factor = Config.LOCAL_INDEX_MERGE_FACTOR
+        with open(os.path.join(self.directory, "merge.lock"), "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None  # another process is merging
+            self.refresh()
+            with self._lock:
+                oldest_first = list(reversed(self._live))
+            if len(oldest_first) <= factor:
+                return None
+            start = min(range(len(oldest_first) - factor + 1),
+                        key=lambda i: sum(segment.size for segment, _m in oldest_first[i:i + factor]))
+            return self._merge(oldest_first[start:start + factor])
+
+    def _merge(self, run):
+        started = time.time()
+        urls, doc_lens = [], []
+        postings = defaultdict(list)
+        for segment, masked in run:
+            remap = {}
+            for doc in range(segment.n_docs):
+                if doc not in masked:
+                    remap[doc] = len(urls)
+                    urls.append(segment.url(doc))
+                    doc_lens.append(segment.doc_lens[doc])
+            for i in range(segment.n_terms):
+                pairs = [(remap[doc], tf) for doc, tf in segment.postings(i) if doc in remap]
+                if pairs:
+                    postings[segment.term(i)].extend(pairs)
+        # The merged segment takes the newest input's place in the order. That is
+        # only right if no other segment sorts inside the run: with publishing
+        # held off, every segment older than now is listed, and any published
+        # later sorts after the run.
+        first, last = (int(segment.name.split("-", 1)[0]) for segment in (run[0][0], run[-1][0]))
+        inputs = {segment.name for segment, _masked in run}
+        with self._publishing(exclusive=True):
+            late = [name for name in self._list()
+                    if name not in inputs and first <= int(name.split("-", 1)[0]) <= last]
+        if late:
+            logger.info(f"Index merge skipped: {len(late)} segments were published inside the run")
+            return None
+        name = self._new_name(last, "merged")
+        size = write_segment(os.path.join(self.directory, name), urls, doc_lens, postings)
+        for segment, _masked in run:
+            try:
+                os.remove(segment.path)
+            except FileNotFoundError:
+                pass
+        logger.info(f"Merged {len(run)} index segments into {name}: {len(urls)} docs, "
+                    f"{size} bytes in {time.time() - started:.2f}s")
+        return name
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_local_index(directory=None):
+    """The LocalIndex of `directory` (default Config.LOCAL_INDEX_DIR) shared within this process."""
+    directory = directory or Config.LOCAL_INDEX_DIR
+    with _indexes_lock:
+        index = _indexes.get(directory)
+        if index is None or index.writer != f"{socket.gethostname()}-{os.getpid()}":
+            index = _indexes[directory] = LocalIndex(directory)
+        return index
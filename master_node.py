@@ -1,11 +1,14 @@
 # master_node.py
-import json
 import logging
 import time
-from collections import defaultdict
+from collections import defaultdict, deque
 from redis_clinet import r
 from config import Config
-from urllib.parse import urlparse
+from url_canon import canonicalize
+from jobs import JobRegistry, DEFAULT_JOB
+from result_stream import ResultConsumer
+from backpressure import DispatchBudget
+from checkpoint import Checkpointer
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -13,167 +16,354 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Cluster-wide counters (dispatched, finished, status:<status>) kept up to
+# date by every master, so /state never has to count anything.
+CRAWL_STATS = "crawl_stats"
+
+# Crawler ids whose URLs were re-queued because their heartbeat went stale. A
+# result from one of them later means it was alive after all, so its job's
+# reassigned counter is taken back.
+REASSIGNED_CRAWLERS = "reassigned_crawlers"
+# Crawlers whose result is already published but whose page was still waiting
+# for its segment upload (see tasks.hold_until_stored): re-crawling their URL
+# is not a lost crawl.
+STORING_CRAWLERS = "storing_crawlers"
+
+def parse_pending(entry):
+    """Split a pending-task entry "url|depth" or "url|depth|job" into (url, depth, job)."""
+    parts = entry.rsplit("|", 2)
+    if len(parts) == 3 and parts[1].isdigit():
+        return parts[0], int(parts[1]), parts[2] or DEFAULT_JOB
+    url, depth = entry.rsplit("|", 1)
+    return url, int(depth), DEFAULT_JOB
+
+
 class MasterNode:
     def __init__(self):
-        self.active_crawlers = set()
-        self.url_queue = {}
-        self.crawled_urls = set()
-        self.active_indexers = set()
-        r.zremrangebyrank("active_crawlers", 0, -1)
-        r.zremrangebyrank("active_indexers", 0, -1)
-        self.max_depth = 1 # Maximum crawl depth; None means no limit.
-        self.allowed_domains = None # List of allowed domains; None means all domains allowed.
+        self.active_crawler_count = 0
+        self.checkpoints = Checkpointer(self) if Config.CHECKPOINT_ENABLED else None
+        # Redis keys come back first (only if Redis lost them), so the jobs load from them.
+        redis_empty = self.checkpoints.restore_before_jobs() if self.checkpoints else False
+        self.jobs = JobRegistry() # Crawl jobs, each with its own Redis frontier, limits and counters.
+        self.frontier = self.jobs.get(DEFAULT_JOB).frontier # Frontier of the default job.
+        self._next_job = 0 # Round-robin start for fair sharing.
+        self.crawled_count = 0 # URLs dispatched by this master; the frontier's seen-set does the dedup.
+        self.recently_crawled = deque(maxlen=Config.RECENT_CRAWLED)
+        self.results = ResultConsumer() # Consumer-group reader of the crawl results stream.
+        self.budget = DispatchBudget() # In-flight cap that follows measured crawl throughput.
+        self.active_indexer_count = 0
+        # Heartbeats survive a master restart: tasks still running keep theirs,
+        # and those that died meanwhile are picked up as stale by monitor_workers.
+        self.canonicalization_saved = 0 # URLs dropped only because their canonical form was already known.
+        if self.checkpoints:
+            self.checkpoints.restore(redis_empty)
         
-    def set_crawl_options(self, max_depth, allowed_domains):
+    def set_crawl_options(self, max_depth, allowed_domains, job_id=None):
         """
-        Set the crawl options.
+        Set the crawl options of one job (the default job if `job_id` is None).
+        Other jobs keep their own limits.
         """
-        self.max_depth = max_depth
-        self.allowed_domains = allowed_domains if allowed_domains and len(allowed_domains) > 0 else None
-        logger.info(f"Crawl options set. Max depth: {self.max_depth}. Allowed domains: {self.allowed_domains}")
+        job = self.jobs.get(job_id)
+        job.configure(max_depth, allowed_domains)
+        self.jobs.save(job)
+        logger.info(f"Crawl options set for job {job.id}. Max depth: {job.max_depth}. "
+                    f"Allowed domains: {sorted(job.scope.domains) or None}")
 
-    def is_allowed_domain(self, url):
+    def create_job(self, urls, max_depth=1, allowed_domains=None, weight=1):
+        """Start a new crawl job with its own scope and seed it. Returns (job, seeds queued)."""
+        job = self.jobs.create(max_depth, allowed_domains, weight)
+        return job, self.add_seed_urls(urls, job.id)
+
+    def is_allowed_domain(self, url, job=None):
         """
-        Check whether the URL's domain is within the allowed domains.
-        If self.allowed_domains is None, all domains are allowed.
+        Check whether the URL's host is within the job's allowed domains
+        (a listed domain or one of its subdomains). No domains = all allowed.
         """
-        if not self.allowed_domains:
-            return True
-        domain = urlparse(url).netloc.lower()
-        return any(allowed.lower() in domain for allowed in self.allowed_domains)
-        
-    def add_seed_urls(self, urls):
+        return (job or self.jobs.get(DEFAULT_JOB)).scope.allows(url)
+
+    def canonical_many(self, urls, frontier=None):
         """
-        Add new seed URLs into the queue with depth 1, subject to the allowed domains.
+        Canonical forms of `urls`. Counts a saved fetch for every URL that only
+        canonicalization reveals to be already queued or crawled.
         """
+        canonical, rewritten, first_raw = [], [], {}
         for url in urls:
-            if url in self.crawled_urls:
-                logger.info(f"url: {url} already cralwed before. Aborting...")
-            if url not in self.crawled_urls and self.is_allowed_domain(url):
-                self.url_queue[url] = 1
-                logger.info(f"Added seed URL: {url} (depth: 1)")
+            c = canonicalize(url)
+            if c in first_raw:
+                if first_raw[c] != url:
+                    self.canonicalization_saved += 1
+            else:
+                first_raw[c] = url
+                if c != url:
+                    rewritten.append(c)
+            canonical.append(c)
+        if rewritten:
+            self.canonicalization_saved += sum((frontier or self.frontier).seen_many(rewritten))
+        return canonical
+
+    def add_seed_urls(self, urls, job_id=None):
+        """
+        Add new seed URLs into a job's queue with depth 1, subject to its allowed domains.
+        """
+        job = self.jobs.get(job_id)
+        frontier = job.frontier
+        urls = [url for url in self.canonical_many(urls, frontier) if job.scope.allows(url)]
+        seed_credit = frontier.scorer.seed_credit
+        added = frontier.push_many(((url, 1) for url in urls),
+                                   credits={url: seed_credit for url in urls} if seed_credit else None)
+        job.count(seeded=added)
+        if added:
+            self.jobs.reopen(job)
+        if added < len(urls):
+            logger.info(f"{len(urls) - added} seed URLs already crawled or queued before. Skipped.")
+        logger.info(f"Added {added} seed URLs to job {job.id} (depth: 1)")
+        return added
                 
-    def add_new_urls(self, new_urls, parent_depth):
+    def add_new_urls(self, new_urls, parent_depth, credits=None, job=None):
         """
-        Add new URLs extracted from a crawl to the URL queue.
+        Add new URLs extracted from a crawl to its job's URL queue.
         Each new URL's depth is parent_depth + 1.
-        Enforce the max_depth limit (if set) and allowed domains.
+        Enforce the job's max_depth limit (if set) and allowed domains.
+        URLs seen before are dropped by the frontier in the same round trip;
+        `credits` (from the frontier's scorer) raise the priority of new and
+        still-queued URLs. Credits used here are removed from the dict.
         """
+        job = job or self.jobs.get(DEFAULT_JOB)
         new_depth = parent_depth + 1
         # If max_depth is set and new_depth exceeds it, do not add URLs.
-        if new_depth > self.max_depth:
+        if job.max_depth is not None and new_depth > job.max_depth:
             return
-        for url in new_urls:
-            if url not in self.crawled_urls and self.is_allowed_domain(url):
-                if url not in self.url_queue:
-                    self.url_queue[url] = new_depth
-                    logger.info(f"Queued new URL: {url} (depth: {new_depth})")
+        canonical = self.canonical_many(new_urls, job.frontier)
+        link_credits = defaultdict(float)
+        if credits:
+            for url, c in zip(new_urls, canonical):
+                if url in credits:
+                    link_credits[c] += credits.pop(url)
+        urls = [url for url in canonical if job.scope.allows(url)]
+        added = job.frontier.push_many(((url, new_depth) for url in urls), credits=link_credits)
+        if added:
+            job.count(discovered=added)
+            self.jobs.reopen(job)
+            logger.info(f"Queued {added} new URLs for job {job.id} (depth: {new_depth})")
                     
     def distribute_tasks(self):
         """
         Distribute crawling tasks to available workers.
-        Each task receives a URL and its current crawl depth.
+        Each task receives a URL, its current crawl depth and its job. With
+        Config.CRAWL_BATCH_SIZE > 1 URLs are grouped into crawl_batch tasks
+        that a worker fetches concurrently with the asyncio engine.
+        URLs are claimed from the frontier and acknowledged once published;
+        if publishing fails they are released back to the frontier.
+        Only as many URLs as the dispatch budget allows are released, so the
+        broker queue holds roughly what the crawlers can take in and the rest
+        waits in the (prioritized) frontiers. The budget is shared fairly:
+        each pass offers every job with queued URLs a slice proportional to
+        its weight, starting from a rotating job, so one huge crawl cannot
+        starve the others.
+        """
+        budget = self.budget.available()
+        jobs = [job for job in self.jobs.active() if job.frontier.size()]
+        if jobs:
+            self._next_job = (self._next_job + 1) % len(jobs)
+            jobs = jobs[self._next_job:] + jobs[:self._next_job]
+        while budget > 0 and jobs:
+            total_weight = sum(job.weight for job in jobs)
+            remaining = []
+            for job in jobs:
+                if budget <= 0:
+                    break
+                share = max(1, min(Config.CRAWL_BATCH_SIZE, budget * job.weight // total_weight))
+                sent = self.dispatch_job(job, share)
+                if sent is None:
+                    return
+                budget -= sent
+                if sent == share:
+                    remaining.append(job)
+            jobs = remaining
+
+    def dispatch_job(self, job, n):
+        """
+        Claim up to `n` URLs of one job and publish them as one task.
+        Returns the number dispatched, or None if publishing failed.
+        """
+        from tasks import crawl_page, crawl_batch
+        batch = job.frontier.claim(n)
+        if not batch:
+            return 0
+        urls = [url for url, _depth in batch]
+        try:
+            if len(batch) == 1:
+                crawl_page.delay(*batch[0], job.id)
+            else:
+                crawl_batch.delay(batch, job.id)
+        except Exception as e:
+            logger.exception("Failed to publish task: %s", e)
+            job.frontier.release(urls)
+            return None
+        self.budget.dispatched(job.id, urls)
+        job.frontier.ack(urls)
+        pipe = r.pipeline(transaction=False)
+        job.count(pipe, dispatched=len(batch))
+        pipe.hincrby(CRAWL_STATS, "dispatched", len(batch))
+        pipe.execute()
+        for url, depth in batch:
+            self.crawled_count += 1
+            self.recently_crawled.append(url)
+            logger.info(f"Assigned URL to crawler: {url} (depth: {depth}, job: {job.id})")
+        return len(batch)
+
+    def monitor_finished_tasks(self, block_ms=None):
+        """
+        Read a batch of finished crawl results from the results stream,
+        queue the new URLs they found and ack the batch.
+        Redis round trips scale with batches, not pages: one read, one
+        reassigned-crawler lookup, one push per distinct (job, depth), one
+        counter pipeline and one ack. Blocks up
+        to `block_ms` for results.
         """
-        from tasks import crawl_page
-        while self.url_queue :
-            url, depth = self.url_queue.popitem()
+        batch = self.results.read(block_ms=block_ms)
+        if not batch:
+            return 0
+        new_by_depth = defaultdict(lambda: defaultdict(list)) # job -> depth -> URLs
+        pages = defaultdict(list) # job -> [(parent URL, links)] for the scorer
+        statuses = defaultdict(lambda: defaultdict(int)) # job -> status -> count
+        revived = defaultdict(int) # job -> results from crawlers already given up on
+        crawler_ids = [crawler_id for _entry_id, crawler_id, _result in batch]
+        reassigned = r.smismember(REASSIGNED_CRAWLERS, crawler_ids) if crawler_ids else []
+        for (entry_id, crawler_id, result), was_reassigned in zip(batch, reassigned):
+            if result is None:
+                continue
             try:
-                result = crawl_page.delay(url, depth)
-                self.crawled_urls.add(url)
-                logger.info(f"Assigned URL to crawler: {url} (depth: {depth})")
+                job_id = result.get("job") or DEFAULT_JOB
+                statuses[job_id][result.get("status")] += 1
+                if was_reassigned:
+                    revived[job_id] += 1
+                # If the result indicates success and contains new_urls:
+                if result.get("status") in ("success", "not_modified", "duplicate") and "new_urls" in result:
+                    # Use the returned parent depth to calculate new depth.
+                    parent_depth = result.get("depth", 1)
+                    new_by_depth[job_id][parent_depth].extend(result.get("new_urls", []))
+                    pages[job_id].append((result.get("url"), result.get("new_urls", [])))
+                    self.canonicalization_saved += result.get("canonical_duplicates", 0)
+                    logger.info(f"Processed finished task {crawler_id}: found {len(result.get('new_urls', []))} new URLs.")
+                else:
+                    pages[job_id].append((result.get("url"), []))
+                    logger.info(f"Finished task {crawler_id} with status: {result.get('status')}")
             except Exception as e:
-                logger.exception("Failed to publish task: %s", e)
-    def monitor_finished_tasks(self):
-        """
-        Poll Redis for finished crawl tasks, fetch their results, 
-        extract new URLs and reassign them.
-        """
-        # Get all keys from finished_crawls.
-        finished = r.hgetall("finished_crawls")
-        for crawler_id, status in finished.items():
-            if isinstance(crawler_id, bytes):
-                crawler_id = crawler_id.decode("utf-8")
-            # Get the result stored in Redis.
-            result_json = r.get(f"crawl_result:{crawler_id}")
-            if result_json:
-                if isinstance(result_json, bytes):
-                    result_json = result_json.decode("utf-8")
-                try:
-                    result = json.loads(result_json)
-                    # If the result indicates success and contains new_urls:
-                    if result.get("status") == "success" and "new_urls" in result:
-                        # Use the returned parent depth to calculate new depth.
-                        parent_depth = result.get("depth", 1)
-                        new_urls = result.get("new_urls", [])
-                        self.add_new_urls(new_urls, parent_depth)
-                        logger.info(f"Processed finished task {crawler_id}: added {len(new_urls)} new URLs.")
-                    else:
-                        logger.info(f"Finished task {crawler_id} with status: {result.get('status')}")
-                except Exception as e:
-                    logger.error(f"Error processing crawl result for {crawler_id}: {e}")
-                # Clean up processed keys.
-                r.hdel("finished_crawls", crawler_id)
-                r.delete(f"crawl_result:{crawler_id}")
+                logger.error(f"Error processing crawl result for {crawler_id}: {e}")
+        pipe = r.pipeline(transaction=False)
+        for job_id, counts in statuses.items():
+            job = self.jobs.get(job_id)
+            if job is None:
+                logger.warning(f"Results for unknown crawl job {job_id} dropped")
+                continue
+            status_counts = {f"status:{status}": n for status, n in counts.items()}
+            job.count(pipe, finished=sum(counts.values()), reassigned=-revived[job_id], **status_counts)
+            for name, n in dict(status_counts, finished=sum(counts.values())).items():
+                pipe.hincrby(CRAWL_STATS, name, n)
+            credits = dict(job.frontier.scorer.link_credits(
+                job.frontier, [(url, links) for url, links in pages[job_id] if url]))
+            for parent_depth, new_urls in new_by_depth[job_id].items():
+                self.add_new_urls(new_urls, parent_depth, credits, job)
+        if any(reassigned):
+            pipe.srem(REASSIGNED_CRAWLERS, *(crawler_id for crawler_id, was_reassigned
+                                             in zip(crawler_ids, reassigned) if was_reassigned))
+        pipe.execute()
+        self.budget.completed((result.get("job") or DEFAULT_JOB, result["url"])
+                              for _entry_id, _crawler_id, result in batch if result and "url" in result)
+        self.results.ack([entry_id for entry_id, _crawler_id, _result in batch])
+        return len(batch)
                 
     def update_workers_from_redis(self):
-        current_time = time.time()
-        cutoff = current_time - Config.HEARTBEAT_INTERVAL
-        active_c = r.zrangebyscore("active_crawlers", cutoff, float('inf'))
-        self.active_crawlers = set(active_c)
-        stale_crawlers = set(r.zrangebyscore("active_crawlers", '-inf', cutoff))
-        active_i = r.zrangebyscore("active_indexers", cutoff, float('inf'))
-        self.active_indexers = set(active_i)
-        stale_indexers = set(r.zrangebyscore("active_indexers", '-inf', cutoff))
+        """
+        One pipelined round trip per check: only heartbeats older than the
+        timeout are read (normally none) and live workers are just counted,
+        so the cost does not grow with the number of running tasks.
+        """
+        cutoff = time.time() - Config.HEARTBEAT_TIMEOUT
+        pipe = r.pipeline(transaction=False)
+        pipe.zrangebyscore("active_crawlers", '-inf', cutoff, start=0, num=Config.FAILOVER_BATCH_SIZE)
+        pipe.zrangebyscore("active_indexers", '-inf', cutoff, start=0, num=Config.FAILOVER_BATCH_SIZE)
+        pipe.zcount("active_crawlers", cutoff, '+inf')
+        pipe.zcount("active_indexers", cutoff, '+inf')
+        stale_crawlers, stale_indexers, self.active_crawler_count, self.active_indexer_count = pipe.execute()
         return stale_crawlers, stale_indexers
 
+    def live_workers(self, redis_key, limit=None):
+        """Ids with a fresh heartbeat in `redis_key` (read on demand, e.g. for /state)."""
+        cutoff = time.time() - Config.HEARTBEAT_TIMEOUT
+        if limit is None:
+            return r.zrangebyscore(redis_key, cutoff, '+inf')
+        return r.zrangebyscore(redis_key, cutoff, '+inf', start=0, num=limit)
+
     def monitor_workers(self):
         """Monitor workers' health via heartbeat updates from Redis."""
+        self.jobs.refresh()
+        self.jobs.check_completed()
+        for job in self.jobs.active():
+            job.frontier.reclaim_expired()
         stale_crawlers, stale_indexers = self.update_workers_from_redis()
-        for crawler_id in stale_crawlers:
-            logger.warning(f"Crawler {crawler_id} appears to be dead")
-            self.handle_crawler_failure(crawler_id)
-        for indexer_id in stale_indexers:
-            logger.warning(f"Indexer {indexer_id} appears to be dead")
-            self.handle_indexer_failure(indexer_id)
-            
-    def handle_crawler_failure(self, crawler_id):
-        r.zrem("active_crawlers", crawler_id)
-        pending_entry = r.hget("pending_urls_to_crawl", crawler_id)
-        if pending_entry:
-            # If coming from Redis, the value might be a bytes object.
-            if isinstance(pending_entry, bytes):
-                pending_entry = pending_entry.decode("utf-8")
-            try:
-                url, depth_str = pending_entry.split("|")
-                depth = int(depth_str)
-            except Exception as e:
-                logger.error(f"Error decoding pending entry for crawler {crawler_id}: {e}")
-                url = pending_entry
-                depth = 1
-            # Reassign the URL with its previously stored depth.
-            self.url_queue[url] = depth
-            logger.info(f"Reassigned {url} with depth {depth} from failed crawler {crawler_id}")
-        r.hdel("pending_urls_to_crawl", crawler_id)
-        
-        
-    def handle_indexer_failure(self, indexer_id):
-        r.zrem("active_indexers", indexer_id)
-        pending_entry = r.hget("pending_urls_to_index", indexer_id)
-        if pending_entry:
+        if stale_crawlers:
+            logger.warning(f"Crawlers appear to be dead: {stale_crawlers}")
+            self.handle_crawler_failure(stale_crawlers)
+        if stale_indexers:
+            logger.warning(f"Indexers appear to be dead: {stale_indexers}")
+            self.handle_indexer_failure(stale_indexers)
+
+    def _reassign(self, active_key, pending_key, worker_ids, kind):
+        """
+        Re-queue the URLs dead workers were handling and drop their
+        bookkeeping: one pipelined read, one frontier push per job and one
+        cleanup pipeline for the whole batch. Only crawls without a result
+        count as reassigned: an indexer's URL, or a crawl whose page was
+        still waiting for its segment upload, is crawled again but already
+        has a result.
+        """
+        worker_ids = list(worker_ids)
+        entries = defaultdict(list) # job -> [(url, depth)]
+        handed_back = [] # crawlers whose crawl is counted as lost
+        lost = defaultdict(int) # job -> crawls without a result
+        pipe = r.pipeline(transaction=False)
+        pipe.hmget(pending_key, worker_ids)
+        pipe.smismember(STORING_CRAWLERS, worker_ids)
+        pending, storing = pipe.execute()
+        for worker_id, pending_entry, was_storing in zip(worker_ids, pending, storing):
+            if not pending_entry:
+                continue
             # If coming from Redis, the value might be a bytes object.
             if isinstance(pending_entry, bytes):
                 pending_entry = pending_entry.decode("utf-8")
             try:
-                url, depth_str = pending_entry.split("|")
-                depth = int(depth_str)
+                url, depth, job_id = parse_pending(pending_entry)
             except Exception as e:
-                logger.error(f"Error decoding pending entry for indexer {indexer_id}: {e}")
-                url = pending_entry
-                depth = 1
-            # Reassign the URL with its previously stored depth.
-            self.url_queue[url] = depth
-            logger.info(f"Reassigned {url} with depth {depth} from failed indexer {indexer_id}")
-        r.hdel("pending_urls_to_index", indexer_id)
+                logger.error(f"Error decoding pending entry for {kind} {worker_id}: {e}")
+                url, depth, job_id = pending_entry, 1, DEFAULT_JOB
+            entries[job_id].append((url, depth))
+            if kind == "crawler" and not was_storing:
+                lost[job_id] += 1
+                handed_back.append(worker_id)
+            logger.info(f"Reassigned {url} with depth {depth} from failed {kind} {worker_id}")
+        # Reassign the URLs with their previously stored depth.
+        for job_id, job_entries in entries.items():
+            job = self.jobs.get(job_id) or self.jobs.get(DEFAULT_JOB)
+            if job.frontier.push_many(job_entries, force=True):
+                self.jobs.reopen(job)
+            job.count(reassigned=lost[job_id])
+        pipe = r.pipeline(transaction=False)
+        if kind == "crawler":
+            pipe.srem(STORING_CRAWLERS, *worker_ids)
+        if handed_back:
+            pipe.sadd(REASSIGNED_CRAWLERS, *handed_back)
+            pipe.expire(REASSIGNED_CRAWLERS, Config.JOB_RETENTION)
+        pipe.zrem(active_key, *worker_ids)
+        pipe.hdel(pending_key, *worker_ids)
+        pipe.execute()
+
+    def handle_crawler_failure(self, crawler_ids):
+        self._reassign("active_crawlers", "pending_urls_to_crawl", crawler_ids, "crawler")
+
+    def handle_indexer_failure(self, indexer_ids):
+        self._reassign("active_indexers", "pending_urls_to_index", indexer_ids, "indexer")
 
 def main():
     master = MasterNode()
@@ -191,7 +381,10 @@ def main():
         while True:
             master.distribute_tasks()
             master.monitor_workers()
-            print(master.active_crawlers)
+            master.monitor_finished_tasks()
+            if master.checkpoints:
+                master.checkpoints.maybe_checkpoint()
+            print(master.active_crawler_count)
             time.sleep(1)
     except KeyboardInterrupt:
         logger.info("Shutting down master node...")
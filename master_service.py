@@ -1,11 +1,18 @@
 
 
 import os
+import json
 import logging
 import threading
 import time
-from flask import Flask, request, jsonify
-from master_node import MasterNode            
+from flask import Flask, Response, request, jsonify, stream_with_context
+from master_node import MasterNode, CRAWL_STATS
+from jobs import DEFAULT_JOB
+from dedup import dedup_stats
+from config import Config
+from redis_clinet import r
+from result_stream import page_results
+import metrics
 
 logging.basicConfig(
     level=logging.INFO,
@@ -22,31 +29,222 @@ app = Flask("master-service")
 @app.route("/seed", methods=["POST"])
 def seed():
     """
+    Starts a new crawl job with its own depth limit and domain scope, or adds
+    seeds to an existing job when "job" is given.
     Body:
       {
         "urls":    ["https://…", "https://…"],
         "depth":    1,
-        "domains":  ""
+        "domains":  ["example.com"]  (or "example.com, outlier.org"),
+        "weight":   1,               (share of workers relative to other jobs)
+        "job":      "<job id>"       (optional)
       }
     """
     data = request.get_json(force=True, silent=False)
     urls    = data.get("urls", [])
     depth   = int(data.get("depth", 1))
     domains = data.get("domains", "")
-    master.add_seed_urls(urls)
-    master.set_crawl_options(depth, domains)
-    return jsonify({"queued": len(urls)}), 202
+    if data.get("job"):
+        job = master.jobs.get(data["job"])
+        if job is None:
+            return jsonify({"error": "unknown job"}), 404
+        queued = master.add_seed_urls(urls, job.id)
+    else:
+        job, queued = master.create_job(urls, depth, domains, int(data.get("weight", 1)))
+    return jsonify({"job": job.id, "queued": queued}), 202
+
+@app.route("/jobs")
+def jobs():
+    """
+    Settings and progress counters of every crawl job: active ones and
+    completed ones not yet past Config.JOB_RETENTION (?active=1 for active only).
+    """
+    listed = master.jobs.active() if request.args.get("active") else master.jobs
+    return jsonify([job.progress() for job in listed])
+
+@app.route("/jobs/<job_id>", methods=["GET", "DELETE"])
+def job(job_id):
+    """A job's progress, or DELETE to drop it with its queue, seen-set and counters."""
+    job = master.jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "unknown job"}), 404
+    if request.method == "DELETE":
+        if job.id == DEFAULT_JOB:
+            return jsonify({"error": "the default job cannot be deleted"}), 400
+        master.jobs.delete(job)
+        return jsonify({"deleted": job.id})
+    return jsonify(job.progress())
+
+def _counters():
+    """
+    Cluster counters for /state: a fixed handful of Redis reads (one
+    pipeline for the frontier counters of all jobs), independent of how
+    many URLs are queued or crawled.
+    """
+    pipe = r.pipeline(transaction=False)
+    pipe.hgetall(CRAWL_STATS)
+    for job in master.jobs.active():
+        pipe.hmget(f"{job.frontier.prefix}stats", "queued", "inflight")
+    stats, *frontiers = pipe.execute()
+    stats = {k: int(v) for k, v in stats.items()}
+    return {
+        "active_crawlers_count": master.active_crawler_count,
+        "active_indexers_count": master.active_indexer_count,
+        "urls_in_queue_count": sum(max(0, int(q or 0)) for q, _inflight in frontiers),
+        "urls_crawled_count": stats.get("dispatched", master.crawled_count),
+        "urls_finished_count": stats.get("finished", 0),
+        "statuses": {k.split(":", 1)[1]: v for k, v in stats.items() if k.startswith("status:")},
+        "seen_set": master.frontier.seen.stats(),
+        "dedup": dedup_stats(),
+        "canonicalization_saved": master.canonicalization_saved,
+        "dispatch": master.budget.stats(),
+        "jobs_count": len(master.jobs),
+        "active_jobs_count": len(master.jobs.active()),
+    }
+
+
+class _StateFeed:
+    """
+    Latest counters, refreshed by one background thread every
+    Config.STATE_REFRESH seconds. /state serves the cached copy and
+    /state/stream clients wait on `changed` for the next version.
+    """
+
+    def __init__(self):
+        self.snapshot = {}
+        self.version = 0
+        self.changed = threading.Condition()
+
+    def refresh(self):
+        snapshot = _counters()
+        with self.changed:
+            if snapshot != self.snapshot:
+                self.snapshot = snapshot
+                self.version += 1
+                self.changed.notify_all()
+
+    def wait(self, version, timeout):
+        """The snapshot once it is newer than `version` (or the current one after `timeout`)."""
+        with self.changed:
+            self.changed.wait_for(lambda: self.version != version, timeout)
+            return self.version, self.snapshot
+
+
+feed = _StateFeed()
+
+
+def _queue_head(limit):
+    """Up to `limit` queued URLs, taken job by job."""
+    urls = []
+    for job in master.jobs.active():
+        if len(urls) >= limit:
+            break
+        urls += job.frontier.queued_urls(limit - len(urls))
+    return urls
+
 
 @app.route("/state")
 def state():
-    """Return the same JSON you previously showed on /monitor."""
+    """
+    Counters plus the first `limit` entries of each list. The full queue
+    and crawl history are paged through /queue and /crawled.
+    """
+    limit = min(request.args.get("limit", 20, type=int), Config.STATE_LIST_LIMIT)
+    counters = feed.snapshot or _counters()
+    return jsonify({
+        **counters,
+        "active_crawlers":  master.live_workers("active_crawlers", limit),
+        "active_indexers":  master.live_workers("active_indexers", limit),
+        "urls_in_queue":    _queue_head(limit),
+        "urls_crawled":     list(master.recently_crawled)[-limit:],
+    })
+
+@app.route("/state/stream")
+def state_stream():
+    """
+    Server-sent events: one "state" event with all counters, then a "delta"
+    event with just the fields that changed, each time they change.
+    """
+    def events():
+        version, sent = feed.wait(-1, 0)
+        yield f"event: state\ndata: {json.dumps(sent)}\n\n"
+        while True:
+            new_version, snapshot = feed.wait(version, Config.STATE_STREAM_KEEPALIVE)
+            if new_version == version:
+                yield ": keep-alive\n\n"
+                continue
+            delta = {k: v for k, v in snapshot.items() if sent.get(k) != v}
+            version, sent = new_version, snapshot
+            yield f"event: delta\ndata: {json.dumps(delta)}\n\n"
+    return Response(stream_with_context(events()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/queue")
+def queue():
+    """
+    One page of a job's queued URLs: ?job=<id>&cursor=<next_cursor>&limit=N.
+    A missing next_cursor means the scan is complete.
+    """
+    job = master.jobs.get(request.args.get("job"))
+    if job is None:
+        return jsonify({"error": "unknown job"}), 404
+    limit = min(request.args.get("limit", 50, type=int), Config.STATE_PAGE_LIMIT)
+    cursor, page = job.frontier.scan_queued(request.args.get("cursor", 0, type=int), limit)
     return jsonify({
-        "active_crawlers":  list(master.active_crawlers),
-        "active_indexers":  list(master.active_indexers),
-        "urls_in_queue":    list(master.url_queue),
-        "urls_crawled":     list(master.crawled_urls),
+        "job": job.id,
+        "urls": [{"url": url, "depth": depth, "score": score} for url, depth, score in page],
+        "next_cursor": str(cursor) if cursor else None,
     })
 
+@app.route("/crawled")
+def crawled():
+    """Finished crawls, newest first: ?cursor=<next_cursor>&limit=N."""
+    limit = min(request.args.get("limit", 50, type=int), Config.STATE_PAGE_LIMIT)
+    cursor, page = page_results(request.args.get("cursor"), limit)
+    return jsonify({"results": page, "next_cursor": cursor})
+
+def _gauges():
+    """Frontier, dispatch and worker gauges read at scrape time (one pipeline for all active jobs)."""
+    jobs = master.jobs.active()
+    pipe = r.pipeline(transaction=False)
+    for job in jobs:
+        pipe.hmget(f"{job.frontier.prefix}stats", "queued", "inflight")
+        pipe.zcard(f"{job.frontier.prefix}hosts")
+    pipe.xlen(Config.RESULT_STREAM)
+    *frontiers, results_pending = pipe.execute()
+    gauges = [
+        metrics.gauge_series("crawl_jobs", len(master.jobs), state="all"),
+        metrics.gauge_series("crawl_jobs", len(jobs), state="active"),
+        metrics.gauge_series("crawl_workers_active", master.active_crawler_count, role="crawler"),
+        metrics.gauge_series("crawl_workers_active", master.active_indexer_count, role="indexer"),
+        metrics.gauge_series("crawl_results_stream_length", results_pending),
+    ]
+    for job, (counts, hosts) in zip(jobs, zip(frontiers[::2], frontiers[1::2])):
+        queued, inflight = (max(0, int(n or 0)) for n in counts)
+        gauges += [
+            metrics.gauge_series("frontier_queued_urls", queued, job=job.id),
+            metrics.gauge_series("frontier_inflight_urls", inflight, job=job.id),
+            metrics.gauge_series("frontier_hosts", hosts, job=job.id),
+            metrics.gauge_series("frontier_seen_urls", job.frontier.seen.stats()["items"], job=job.id),
+        ]
+    dispatch = master.budget.stats()
+    gauges += [
+        metrics.gauge_series("dispatch_in_flight", dispatch["in_flight"]),
+        metrics.gauge_series("dispatch_limit", dispatch["limit"]),
+        metrics.gauge_series("dispatch_throughput_per_second", dispatch["throughput_per_sec"]),
+    ]
+    return dict(gauges)
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """
+    Prometheus text exposition for the whole cluster: per-stage latency
+    histograms and page counters flushed by every crawler and indexer
+    process, plus frontier, dispatch and worker gauges.
+    """
+    metrics.flush(force=True)
+    return Response(metrics.render(_gauges()), mimetype="text/plain; version=0.0.4")
+
 @app.route("/health")
 def health():
     """Simple liveness probe for ALB / Kubernetes, etc."""
@@ -55,23 +253,64 @@ def health():
 def _loop():
     """
     Runs forever in a daemon thread:
-      • distribute tasks from url_queue to Celery (SQS)
+      • distribute tasks from the Redis frontier to Celery (SQS)
       • monitor worker heart-beats
-      • process finished crawl results
     """
     while True:
         try:
-            master.distribute_tasks()
-            master.monitor_workers()
-            master.monitor_finished_tasks()
+            with metrics.timed("master_loop_seconds", loop="distribute"):
+                master.distribute_tasks()
+            with metrics.timed("master_loop_seconds", loop="workers"):
+                master.monitor_workers()
         except Exception:
             log.exception("Error in master loop")
         time.sleep(1)
 
 
+def _state_loop():
+    """Runs forever in a daemon thread: refreshes the counters behind /state."""
+    while True:
+        try:
+            feed.refresh()
+        except Exception:
+            log.exception("Error refreshing state")
+        time.sleep(Config.STATE_REFRESH)
+
+
+def _checkpoint_loop():
+    """
+    Runs forever in a daemon thread: writes a checkpoint of the crawl state
+    every Config.CHECKPOINT_INTERVAL seconds without holding up dispatch.
+    """
+    while True:
+        try:
+            master.checkpoints.maybe_checkpoint()
+        except Exception:
+            log.exception("Error writing checkpoint")
+        time.sleep(1)
+
+
+def _results_loop():
+    """
+    Runs forever in a daemon thread: blocks on the crawl results stream and
+    queues newly found URLs as soon as a batch of results arrives.
+    """
+    while True:
+        try:
+            master.monitor_finished_tasks(block_ms=Config.RESULT_BLOCK_MS)
+            metrics.flush()
+        except Exception:
+            log.exception("Error in results loop")
+            time.sleep(1)
+
+
 if __name__ == "__main__":
     threading.Thread(target=_loop, daemon=True).start()
+    threading.Thread(target=_results_loop, daemon=True).start()
+    threading.Thread(target=_state_loop, daemon=True).start()
+    if master.checkpoints:
+        threading.Thread(target=_checkpoint_loop, daemon=True).start()
 
     host = os.getenv("HOST", "0.0.0.0")
     log.info("Master service listening on %s:6000", host)
-    app.run(host=host, port=6000, debug=False, use_reloader=False)
\ No newline at end of file
+    app.run(host=host, port=6000, debug=False, use_reloader=False, threaded=True)
\ No newline at end of file
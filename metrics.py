@@ -0,0 +1,172 @@
+# metrics.py
+import logging
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from config import Config
+from redis_clinet import r
+
+logger = logging.getLogger(__name__)
+
+# Prometheus-style metrics shared by crawler, indexer and master processes.
+# Every process accumulates counters and histogram buckets in memory (a dict
+# update per observation) and flush() adds the deltas to two Redis hashes
+# whose fields are already Prometheus series names:
+#   metrics:counters    name{labels} -> int
+#   metrics:histograms  name_bucket{labels,le="x"} / name_sum{labels} / name_count{labels}
+# The master's /metrics endpoint renders both plus gauges it reads at scrape
+# time, so one scrape covers the whole cluster.
+
+COUNTERS_KEY = "metrics:counters"
+HISTOGRAMS_KEY = "metrics:histograms"
+HOSTS_KEY = "metrics:hosts"     # SET of hosts with their own label, cluster-wide
+
+# KEYS[1] hosts set; ARGV: host, cap. 1 if the host has (or now gets) its own label.
+_ADMIT_LUA = """
+if redis.call('SISMEMBER', KEYS[1], ARGV[1]) == 1 then return 1 end
+if redis.call('SCARD', KEYS[1]) < tonumber(ARGV[2]) then
+    redis.call('SADD', KEYS[1], ARGV[1])
+    return 1
+end
+return 0
+"""
+
+_lock = threading.Lock()
+_counts = Counter()     # counter and bucket/count series
+_sums = Counter()       # histogram _sum series (float)
+_flushed_at = 0.0
+_hosts = {}             # host -> its label, for hosts this process already asked about
+_admit = r.register_script(_ADMIT_LUA)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _series(name, labels):
+    if not labels:
+        return name
+    parts = ",".join(f'{k}="{_escape(v)}"' for k, v in sorted(labels.items()))
+    return f"{name}{{{parts}}}"
+
+
+def host_label(host):
+    """
+    `host` if it is one of the first METRICS_MAX_HOSTS hosts labelled
+    anywhere in the cluster, else "other". Each process asks Redis once per
+    host and remembers the answer.
+    """
+    label = _hosts.get(host)
+    if label is not None:
+        return label
+    try:
+        label = host if _admit(keys=[HOSTS_KEY], args=[host, Config.METRICS_MAX_HOSTS]) else "other"
+    except Exception as e:
+        logger.error(f"Could not admit metrics host label {host}: {e}")
+        return "other"
+    with _lock:
+        if len(_hosts) >= 10 * Config.METRICS_MAX_HOSTS:
+            _hosts.clear()  # hosts beyond the cap are only "other"; keep the cache bounded
+        _hosts[host] = label
+    return label
+
+
+def inc(name, n=1, **labels):
+    with _lock:
+        _counts[("c", _series(name, labels))] += n
+
+
+def observe(name, seconds, **labels):
+    """Record one observation in histogram `name` (buckets: Config.METRICS_BUCKETS)."""
+    buckets = Config.METRICS_BUCKETS
+    first = bisect_left(buckets, seconds)
+    with _lock:
+        for bound in buckets[first:]:
+            _counts[("h", _series(f"{name}_bucket", dict(labels, le=bound)))] += 1
+        _counts[("h", _series(f"{name}_bucket", dict(labels, le="+Inf")))] += 1
+        _counts[("h", _series(f"{name}_count", labels))] += 1
+        _sums[_series(f"{name}_sum", labels)] += seconds
+
+
+@contextmanager
+def timed(name, **labels):
+    """Time the block into histogram `name` (also when it raises)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def flush(force=False):
+    """Add everything recorded since the last flush to Redis (at most every METRICS_FLUSH_INTERVAL)."""
+    global _counts, _sums, _flushed_at
+    now = time.monotonic()
+    if not force and now - _flushed_at < Config.METRICS_FLUSH_INTERVAL:
+        return
+    with _lock:
+        counts, sums = _counts, _sums
+        _counts, _sums = Counter(), Counter()
+        _flushed_at = now
+    if not counts and not sums:
+        return
+    try:
+        pipe = r.pipeline(transaction=False)
+        for (kind, series), n in counts.items():
+            pipe.hincrby(COUNTERS_KEY if kind == "c" else HISTOGRAMS_KEY, series, n)
+        for series, total in sums.items():
+            pipe.hincrbyfloat(HISTOGRAMS_KEY, series, total)
+        pipe.execute()
+    except Exception as e:
+        logger.error(f"Could not publish metrics: {e}")
+        with _lock:
+            _counts.update(counts)
+            _sums.update(sums)
+
+
+def _base_name(series):
+    name = series.split("{", 1)[0]
+    for suffix in ("_bucket", "_count", "_sum"):
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+_LE_RE = re.compile(r'(?<=[{,])le="([^"]*)",?')
+
+
+def _order(item):
+    """Sort key keeping each histogram's buckets together and in numeric `le` order."""
+    series = item[0]
+    match = _LE_RE.search(series)
+    if match is None:
+        return series, 0.0
+    return _LE_RE.sub("", series, count=1), float(match.group(1))
+
+
+def render(gauges=None):
+    """
+    Prometheus text exposition of the cluster counters and histograms plus
+    `gauges` ({series: value}, e.g. from gauge_series()).
+    """
+    pipe = r.pipeline(transaction=False)
+    pipe.hgetall(COUNTERS_KEY)
+    pipe.hgetall(HISTOGRAMS_KEY)
+    counters, histograms = pipe.execute()
+    lines = []
+    for kind, values in (("counter", counters), ("histogram", histograms), ("gauge", gauges or {})):
+        by_name = {}
+        for series, value in values.items():
+            name = series.split("{", 1)[0] if kind != "histogram" else _base_name(series)
+            by_name.setdefault(name, []).append((series, value))
+        for name in sorted(by_name):
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(f"{series} {value}" for series, value in sorted(by_name[name], key=_order))
+    return "\n".join(lines) + "\n"
+
+
+def gauge_series(name, value, **labels):
+    return _series(name, labels), value
@@ -0,0 +1,60 @@
+# politeness.py
+import logging
+from urllib.parse import urlparse
+from config import Config
+from redis_clinet import r
+
+logger = logging.getLogger(__name__)
+
+# Atomically claim the next fetch slot for a host.
+# Returns 0 when the caller may fetch now (and books the following slot),
+# otherwise the number of milliseconds until the host is free again.
+# The Redis server clock is used so every worker agrees on "now".
+_RESERVE_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local next_allowed = tonumber(redis.call('GET', KEYS[1]) or '0')
+if next_allowed > now then
+    return next_allowed - now
+end
+local delay = tonumber(ARGV[1])
+redis.call('SET', KEYS[1], now + delay, 'PX', delay + 1000)
+return 0
+"""
+
+
+class PolitenessScheduler:
+    """
+    Cluster-wide per-host fetch scheduler backed by Redis.
+    Every host has a "next allowed fetch time" key; a worker may only fetch
+    from a host once that time has passed, and doing so pushes it forward by
+    the host's crawl delay. Callers that are told to wait should work on
+    URLs for other hosts instead of sleeping.
+    """
+
+    def __init__(self):
+        self._reserve = r.register_script(_RESERVE_LUA)
+
+    def delay_for(self, netloc, robots_delay=None):
+        """Crawl delay (seconds) for a host: override or default, raised to robots.txt Crawl-delay."""
+        delay = Config.HOST_CRAWL_DELAYS.get(netloc.lower(), Config.CRAWL_DELAY)
+        if robots_delay:
+            delay = max(delay, float(robots_delay))
+        return min(delay, Config.MAX_CRAWL_DELAY)
+
+    def reserve(self, url, robots_delay=None):
+        """
+        Try to claim a fetch slot for the URL's host.
+        Returns 0 if the fetch may go ahead now, otherwise the seconds to wait.
+        """
+        netloc = urlparse(url).netloc.lower()
+        delay_ms = int(self.delay_for(netloc, robots_delay) * 1000)
+        if delay_ms <= 0:
+            return 0
+        try:
+            wait_ms = self._reserve(keys=[f"politeness:{netloc}"], args=[delay_ms])
+        except Exception as e:
+            # Never stall the crawl because Redis is unavailable.
+            logger.error(f"Politeness check failed for {netloc}: {e}")
+            return 0
+        return int(wait_ms) / 1000.0
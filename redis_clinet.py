@@ -1,4 +1,6 @@
 import redis,ssl
 from config import Config 
 
-r = redis.StrictRedis(host=Config.REDIS_HOST,port=Config.REDIS_PORT,ssl=True,ssl_cert_reqs=ssl.CERT_NONE,ssl_check_hostname=False,decode_responses=True)
\ No newline at end of file
+r = redis.StrictRedis(host=Config.REDIS_HOST,port=Config.REDIS_PORT,ssl=True,ssl_cert_reqs=ssl.CERT_NONE,ssl_check_hostname=False,decode_responses=True)
+# Same server without response decoding, for binary payloads (DUMP/RESTORE, bitmaps).
+r_bin = redis.StrictRedis(host=Config.REDIS_HOST,port=Config.REDIS_PORT,ssl=True,ssl_cert_reqs=ssl.CERT_NONE,ssl_check_hostname=False,decode_responses=False)
\ No newline at end of file
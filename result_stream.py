@@ -0,0 +1,104 @@
+# result_stream.py
+import json
+import logging
+import os
+import socket
+import time
+from redis.exceptions import ResponseError
+from config import Config
+from redis_clinet import r
+
+logger = logging.getLogger(__name__)
+
+
+def publish_result(crawler_id, result, pipe=None):
+    """
+    Append a finished crawl to the results stream. Pass a pipeline to bundle
+    the XADD with the task's other bookkeeping in one round trip.
+    """
+    target = pipe if pipe is not None else r
+    target.xadd(Config.RESULT_STREAM,
+                {"crawler_id": crawler_id, "result": json.dumps(result)},
+                maxlen=Config.RESULT_STREAM_MAXLEN, approximate=True)
+
+
+class ResultConsumer:
+    """
+    Reads crawl results from the Redis Stream through a consumer group, so
+    every result is handled by exactly one master. Entries stay pending until
+    acked; entries left pending by a crashed master are taken over with
+    XAUTOCLAIM after Config.RESULT_CLAIM_IDLE seconds.
+    """
+
+    def __init__(self, group=None, consumer=None):
+        self.stream = Config.RESULT_STREAM
+        self.group = group or Config.RESULT_GROUP
+        self.consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+        self._last_reclaim = 0.0
+        try:
+            r.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    @staticmethod
+    def _decode(entries):
+        out = []
+        for entry_id, fields in entries:
+            try:
+                out.append((entry_id, fields["crawler_id"], json.loads(fields["result"])))
+            except Exception as e:
+                logger.error(f"Malformed crawl result {entry_id}: {e}")
+                out.append((entry_id, fields.get("crawler_id"), None))
+        return out
+
+    def read(self, count=None, block_ms=None):
+        """
+        Up to `count` new results as (entry_id, crawler_id, result), blocking
+        for at most `block_ms` (None/0 = don't block). Orphaned entries are
+        reclaimed first when due.
+        """
+        count = count or Config.RESULT_BATCH_SIZE
+        reclaimed = self.reclaim(count)
+        if reclaimed:
+            return reclaimed
+        response = r.xreadgroup(self.group, self.consumer, {self.stream: ">"},
+                                count=count, block=block_ms or None)
+        return self._decode(response[0][1]) if response else []
+
+    def reclaim(self, count):
+        """Take over results pending on other consumers for too long."""
+        now = time.monotonic()
+        if now - self._last_reclaim < Config.RESULT_CLAIM_IDLE:
+            return []
+        self._last_reclaim = now
+        _next, entries, *_deleted = r.xautoclaim(
+            self.stream, self.group, self.consumer,
+            min_idle_time=int(Config.RESULT_CLAIM_IDLE * 1000), count=count)
+        entries = [(entry_id, fields) for entry_id, fields in entries if fields]
+        if entries:
+            logger.warning(f"Reclaimed {len(entries)} crawl results from stalled masters")
+        return self._decode(entries)
+
+    def ack(self, entry_ids):
+        if entry_ids:
+            r.xack(self.stream, self.group, *entry_ids)
+
+
+def page_results(cursor=None, count=50):
+    """
+    Newest-first page of finished crawls from the results stream as
+    (next_cursor, [result, ...]); pass next_cursor back for the following
+    page (None = no more). Only entries still within RESULT_STREAM_MAXLEN
+    are reachable.
+    """
+    # The cursor entry itself was the last one of the previous page.
+    entries = r.xrevrange(Config.RESULT_STREAM, max=cursor or "+", min="-",
+                          count=count + (2 if cursor else 1))
+    if cursor and entries and entries[0][0] == cursor:
+        entries = entries[1:]
+    more = len(entries) > count
+    entries = entries[:count]
+    page = [dict(result, crawler_id=crawler_id) for _id, crawler_id, result in ResultConsumer._decode(entries)
+            if result is not None]
+    return (entries[-1][0] if more and entries else None), page
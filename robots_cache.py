@@ -0,0 +1,161 @@
+# robots_cache.py
+import json
+import logging
+import threading
+import time
+import urllib.robotparser
+import uuid
+from collections import OrderedDict
+from urllib.parse import urlparse
+from config import Config
+from redis_clinet import r
+
+logger = logging.getLogger(__name__)
+
+# KEYS[1] lock key; ARGV[1] owner token. Deletes the lock only if we still hold it.
+_UNLOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class RobotsCache:
+    """
+    Cluster-wide robots.txt cache.
+
+    Entries live in Redis under `robots:<scheme>://<netloc>` for
+    Config.ROBOTS_CACHE_EXPIRE seconds and hold the fetch outcome plus the
+    robots.txt body, so any worker can rebuild the rules without downloading
+    the file again. A per-process LRU of parsed RobotFileParser objects sits
+    in front of Redis. On a miss only one fetch per host runs: threads in the
+    same process wait on a local lock, other processes on a short Redis lock.
+    Fetch failures are stored too (for Config.ROBOTS_ERROR_CACHE_EXPIRE) so a
+    broken host is not asked again for every page.
+    """
+
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize or Config.ROBOTS_LRU_SIZE
+        self._lru = OrderedDict()        # key -> (expires_at, parser)
+        self._lock = threading.Lock()
+        self._fetch_locks = {}           # key -> threading.Lock
+        self._unlock = r.register_script(_UNLOCK_LUA)
+
+    @staticmethod
+    def key_for(url):
+        parsed = urlparse(url)
+        return f"{parsed.scheme}://{parsed.netloc.lower()}"
+
+    def get(self, url, session):
+        """Return the RobotFileParser for the URL's scheme+host."""
+        key = self.key_for(url)
+        rp = self._get_local(key)
+        if rp is not None:
+            return rp
+
+        with self._lock:
+            fetch_lock = self._fetch_locks.setdefault(key, threading.Lock())
+        with fetch_lock:
+            # Another thread may have filled the entry while we waited.
+            rp = self._get_local(key)
+            if rp is None:
+                entry, ttl = self._load_shared(key, session)
+                rp = self._build_parser(key, entry)
+                self._put_local(key, rp, ttl)
+        with self._lock:
+            self._fetch_locks.pop(key, None)
+        return rp
+
+    def _get_local(self, key):
+        with self._lock:
+            item = self._lru.get(key)
+            if item is None:
+                return None
+            expires_at, rp = item
+            if expires_at < time.monotonic():
+                del self._lru[key]
+                return None
+            self._lru.move_to_end(key)
+            return rp
+
+    def _put_local(self, key, rp, ttl):
+        with self._lock:
+            self._lru[key] = (time.monotonic() + ttl, rp)
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.maxsize:
+                self._lru.popitem(last=False)
+
+    def _load_shared(self, key, session):
+        """Read the entry from Redis, fetching robots.txt if no worker has it yet."""
+        redis_key = f"robots:{key}"
+        lock_key = f"robots_lock:{key}"
+        token = uuid.uuid4().hex
+        got_lock = False
+        deadline = time.monotonic() + Config.FETCH_TIMEOUT * 2
+        while True:
+            try:
+                cached = r.get(redis_key)
+                if cached:
+                    ttl = r.ttl(redis_key)
+                    return json.loads(cached), ttl if ttl and ttl > 0 else Config.ROBOTS_CACHE_EXPIRE
+                got_lock = r.set(lock_key, token, nx=True, px=Config.FETCH_TIMEOUT * 2000)
+            except Exception as e:
+                logger.error(f"Robots cache unavailable for {key}: {e}")
+                entry = self._fetch(key, session)
+                return entry, self._ttl_for(entry)
+            if got_lock or time.monotonic() > deadline:
+                break
+            # Someone else is fetching this host's robots.txt right now.
+            time.sleep(0.1)
+
+        entry = self._fetch(key, session)
+        ttl = self._ttl_for(entry)
+        try:
+            r.set(redis_key, json.dumps(entry), ex=ttl)
+            if got_lock:
+                # Our lock may have expired and been taken by another worker.
+                self._unlock(keys=[lock_key], args=[token])
+        except Exception as e:
+            logger.error(f"Could not store robots.txt for {key}: {e}")
+        return entry, ttl
+
+    @staticmethod
+    def _ttl_for(entry):
+        if entry["status"] in ("error", "unavailable"):
+            return Config.ROBOTS_ERROR_CACHE_EXPIRE
+        return Config.ROBOTS_CACHE_EXPIRE
+
+    @staticmethod
+    def _fetch(key, session):
+        """Download robots.txt, mirroring RobotFileParser.read()'s status handling."""
+        robots_url = f"{key}/robots.txt"
+        try:
+            response = session.get(robots_url, timeout=Config.FETCH_TIMEOUT)
+        except Exception as e:
+            logger.error(f"Error reading robots.txt: {e}")
+            return {"status": "error", "body": ""}
+        if response.status_code in (401, 403):
+            return {"status": "disallow_all", "body": ""}
+        if 400 <= response.status_code < 500:
+            return {"status": "allow_all", "body": ""}
+        if response.status_code >= 500:
+            return {"status": "unavailable", "body": ""}
+        return {"status": "ok", "body": response.text}
+
+    @staticmethod
+    def _build_parser(key, entry):
+        rp = urllib.robotparser.RobotFileParser(f"{key}/robots.txt")
+        status = entry["status"]
+        if status == "ok":
+            rp.parse(entry["body"].splitlines())
+        elif status == "disallow_all":
+            rp.disallow_all = True
+        elif status in ("allow_all", "error"):
+            # Unreachable robots.txt: crawl as if there were none.
+            rp.allow_all = True
+        # "unavailable" (5xx) leaves the parser unread, which disallows everything.
+        return rp
+
+
+robots_cache = RobotsCache()
@@ -0,0 +1,102 @@
+# scoring.py
+import logging
+from collections import Counter
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# A scorer decides where a URL sits in its host queue (lower is crawled
+# first). Scores are linear in a per-URL "credit" that grows while the URL
+# waits in the frontier, so raising a queued URL's priority is one ZADD of
+# its score lowered by credit * credit_weight (frontier.py's credit script):
+#   score(depth, credit) -> float
+#   seed_credit          credit a seed URL starts with
+#   link_credits(frontier, pages) -> {link: credit} for [(parent_url, links), ...]
+#                        with every finished URL, links or not
+# Across hosts the frontier always serves round-robin, which keeps any one
+# site from monopolising the crawl whatever the scorer.
+
+
+class DepthScorer:
+    """Breadth-first: shallower pages first, discovery order within a depth."""
+
+    name = "bfs"
+    credit_weight = 0.0
+    seed_credit = 0.0
+    keeps_cash = False
+
+    def score(self, depth, credit=0.0):
+        return depth
+
+    def link_credits(self, frontier, pages):
+        return {}
+
+
+class BacklinkScorer(DepthScorer):
+    """
+    Breadth-first, but every extra in-link seen while a URL is queued moves it
+    up by Config.BACKLINK_WEIGHT levels, so widely linked pages come first
+    within their host (hosts themselves are still served round-robin).
+    """
+
+    name = "backlinks"
+
+    def __init__(self, weight=None):
+        self.credit_weight = weight if weight is not None else Config.BACKLINK_WEIGHT
+
+    def score(self, depth, credit=0.0):
+        return depth - self.credit_weight * credit
+
+    def link_credits(self, frontier, pages):
+        counts = Counter()
+        for _parent, links in pages:
+            counts.update(set(links))
+        return counts
+
+
+class OPICScorer(DepthScorer):
+    """
+    On-line Page Importance Computation: each crawled page splits its cash
+    evenly among its out-links and queued pages are ordered by the cash they
+    have collected. A page's cash is parked in the frontier when it is
+    dispatched and paid out when its crawl result arrives; the cash of a
+    result without links (errors, disallowed, skipped pages, dead ends) is
+    dropped, as if paid to OPIC's virtual page. Depth only breaks near-ties
+    (Config.OPIC_DEPTH_WEIGHT). Priority only orders URLs within a host:
+    the frontier serves hosts round-robin by last-served time.
+    """
+
+    name = "opic"
+    credit_weight = 1.0
+    seed_credit = 1.0
+    keeps_cash = True
+
+    def score(self, depth, credit=0.0):
+        return depth * Config.OPIC_DEPTH_WEIGHT - credit
+
+    def link_credits(self, frontier, pages):
+        if not pages:
+            return {}
+        # Drain the cash of every finished URL, so `cash` only holds in-flight pages.
+        cash = frontier.take_cash([parent for parent, _links in pages])
+        credits = Counter()
+        for (_parent, links), amount in zip(pages, cash):
+            links = set(links)
+            if not links:
+                continue
+            share = amount / len(links)
+            for link in links:
+                credits[link] += share
+        return credits
+
+
+SCORERS = {cls.name: cls for cls in (DepthScorer, BacklinkScorer, OPICScorer)}
+
+
+def make_scorer(name=None):
+    """Scorer selected by Config.FRONTIER_SCORER."""
+    name = name or Config.FRONTIER_SCORER
+    if name not in SCORERS:
+        logger.warning(f"Unknown frontier scorer '{name}', using bfs")
+        name = "bfs"
+    return SCORERS[name]()
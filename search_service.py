@@ -0,0 +1,147 @@
+# search_service.py
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from config import Config
+from redis_clinet import r
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Indexers bump this after bulk writes; search caches drop results computed
+# for an older generation. Bumps are coalesced to at most one per
+# Config.SEARCH_GENERATION_INTERVAL seconds (BUMPED_KEY is set NX EX for that
+# long): a write inside the window only sets DIRTY_KEY, and the first bump or
+# read after the window folds it in, so the last writes of a crawl still count.
+GENERATION_KEY = "index:generation"
+BUMPED_KEY = "index:generation:bumped"
+DIRTY_KEY = "index:generation:dirty"
+
+# KEYS: generation, bumped, dirty; ARGV: interval, '1' for a write. Returns the generation.
+_GENERATION_LUA = """
+local write = ARGV[2] == '1'
+if write or redis.call('EXISTS', KEYS[3]) == 1 then
+    if redis.call('SET', KEYS[2], '1', 'NX', 'EX', ARGV[1]) then
+        redis.call('INCR', KEYS[1])
+        redis.call('DEL', KEYS[3])
+    elseif write then
+        redis.call('SET', KEYS[3], '1')
+    end
+end
+return redis.call('GET', KEYS[1])
+"""
+_generation = r.register_script(_GENERATION_LUA)
+
+
+def _run_generation(write, client=None):
+    return _generation(keys=[GENERATION_KEY, BUMPED_KEY, DIRTY_KEY],
+                       args=[Config.SEARCH_GENERATION_INTERVAL, "1" if write else "0"], client=client)
+
+
+def bump_generation(pipe=None):
+    """Mark the index as changed (pass a pipeline to batch it with other writes)."""
+    _run_generation(True, pipe)
+
+
+class SearchService:
+    """
+    Process-wide search for the web tier: one IndexerNode (index client
+    and analyzer) for every request, plus an LRU cache of result lists
+    keyed on the analyzed query. Two queries that differ only in case,
+    word forms, stop words or word order share an entry. Entries expire
+    after Config.SEARCH_CACHE_TTL seconds or once the index generation
+    moves on, which happens at most every Config.SEARCH_GENERATION_INTERVAL
+    seconds. The generation is polled at most every
+    Config.SEARCH_GENERATION_POLL seconds.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()     # key -> (expires, generation, results)
+        self._node = None
+        self._generation = None
+        self._checked = 0.0
+        self.hits = 0
+        self.misses = 0
+        self._latencies = deque(maxlen=Config.SEARCH_LATENCY_WINDOW)
+
+    @property
+    def node(self):
+        with self._lock:
+            if self._node is None:
+                from indexer_node import IndexerNode
+                self._node = IndexerNode()
+            return self._node
+
+    def generation(self):
+        now = time.monotonic()
+        if now - self._checked >= Config.SEARCH_GENERATION_POLL:
+            self._checked = now
+            try:
+                generation = _run_generation(False)
+            except Exception as e:
+                logger.error(f"Could not read index generation: {e}")
+                return self._generation
+            if generation != self._generation:
+                with self._lock:
+                    self._cache.clear()
+                    self._generation = generation
+        return self._generation
+
+    def search(self, query):
+        """URLs matching `query`, from the cache when possible."""
+        started = time.perf_counter()
+        node = self.node
+        terms = node.tokenize_and_normalize(query)
+        if not terms:
+            return []
+        key = " ".join(sorted(terms))
+        generation = self.generation()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and entry[0] > now and entry[1] == generation:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                results = entry[2]
+            else:
+                results = None
+                self.misses += 1
+        outcome = "hit" if results is not None else "miss"
+        if results is None:
+            results = node.search_terms(terms)
+            with self._lock:
+                self._cache[key] = (now + Config.SEARCH_CACHE_TTL, generation, results)
+                self._cache.move_to_end(key)
+                while len(self._cache) > Config.SEARCH_CACHE_SIZE:
+                    self._cache.popitem(last=False)
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._latencies.append(elapsed)
+        metrics.observe("search_seconds", elapsed, cache=outcome)
+        metrics.flush()
+        return results
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            hits, misses, entries = self.hits, self.misses, len(self._cache)
+
+        def percentile(p):
+            if not latencies:
+                return 0.0
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 1)
+
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / (hits + misses), 3) if hits + misses else 0.0,
+            "entries": entries,
+            "generation": self._generation,
+            "p50_ms": percentile(0.50),
+            "p99_ms": percentile(0.99),
+        }
+
+
+search_service = SearchService()
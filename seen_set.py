@@ -0,0 +1,370 @@
+# seen_set.py
+import hashlib
+import json
+import math
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+from config import Config
+from redis_clinet import r
+
+# All backends share one interface:
+#   add_many(urls)      -> [True if the URL was new, ...]  (test-and-add, batched)
+#   contains_many(urls) -> [bool, ...]
+#   stats()             -> dict with items, bytes, bytes_per_url, ...
+#   redis_keys()        -> Redis keys holding the set (checkpointed with DUMP)
+#   snapshot()          -> {part: bytes} of in-process state, restore(parts) loads it
+# Redis backends are shared by every master; local ones live in one process.
+
+
+def _hash128(url):
+    digest = hashlib.blake2b(url.encode(), digest_size=16).digest()
+    return int.from_bytes(digest[:8], 'big'), int.from_bytes(digest[8:], 'big')
+
+
+def _fingerprint(url):
+    return int.from_bytes(hashlib.blake2b(url.encode(), digest_size=8).digest(), 'big')
+
+
+def bloom_size(capacity, fp_rate):
+    """Bits and hash count of a Bloom filter holding `capacity` items at `fp_rate`."""
+    bits = max(64, math.ceil(-capacity * math.log(fp_rate) / (math.log(2) ** 2)))
+    hashes = max(1, round(bits / capacity * math.log(2)))
+    return bits, hashes
+
+
+def _stats(backend, items, nbytes, **extra):
+    return {
+        "backend": backend,
+        "items": items,
+        "bytes": nbytes,
+        "bytes_per_url": round(nbytes / items, 2) if items else 0.0,
+        **extra,
+    }
+
+
+class RedisSeenSet:
+    """Exact set of full URL strings in Redis (SADD/SMISMEMBER)."""
+
+    def __init__(self, key):
+        self.key = key
+
+    def add_many(self, urls):
+        urls = list(urls)
+        if not urls:
+            return []
+        pipe = r.pipeline(transaction=False)
+        for url in urls:
+            pipe.sadd(self.key, url)
+        return [bool(added) for added in pipe.execute()]
+
+    def contains_many(self, urls):
+        urls = list(urls)
+        return [bool(x) for x in r.smismember(self.key, urls)] if urls else []
+
+    def stats(self):
+        items = r.scard(self.key)
+        try:
+            nbytes = r.memory_usage(self.key, samples=100) or 0
+        except Exception:
+            nbytes = 0
+        return _stats("redis-set", items, nbytes, false_positive_rate=0.0)
+
+    def redis_keys(self):
+        return [self.key]
+
+    def snapshot(self):
+        return {}
+
+    def restore(self, parts):
+        pass
+
+
+# Scalable Bloom filter stored as Redis bitmaps <prefix>:<n>. Every filter
+# is checked on lookup; new items go into the newest one, and once it holds
+# its capacity a filter twice as large with half the error rate is started,
+# so the compound false-positive rate stays below Config.SEEN_SET_FP_RATE.
+# Positions use double hashing (h1 + i*h2) mod bits with 32-bit h1/h2 so the
+# arithmetic stays exact in Lua numbers.
+_BLOOM_LUA = """
+local meta = KEYS[1]
+local prefix = KEYS[2]
+local add = ARGV[1] == '1'
+local capacity0, fp0 = tonumber(ARGV[2]), tonumber(ARGV[3])
+local ln2 = math.log(2)
+
+local function size(cap, fp)
+    local bits = math.max(64, math.ceil(-cap * math.log(fp) / (ln2 * ln2)))
+    return bits, math.max(1, math.floor(bits / cap * ln2 + 0.5))
+end
+
+local n = tonumber(redis.call('HGET', meta, 'filters') or '0')
+if n == 0 and add then
+    local bits, k = size(capacity0, fp0)
+    redis.call('HSET', meta, 'filters', 1, 'bits:0', bits, 'k:0', k,
+               'cap:0', capacity0, 'fp:0', fp0, 'count:0', 0)
+    n = 1
+end
+local filters = {}
+for f = 0, n - 1 do
+    local v = redis.call('HMGET', meta, 'bits:' .. f, 'k:' .. f)
+    filters[f] = {tonumber(v[1]), tonumber(v[2])}
+end
+
+local function has(key, bits, k, h1, h2)
+    for i = 0, k - 1 do
+        if redis.call('GETBIT', key, (h1 + i * h2) % bits) == 0 then return false end
+    end
+    return true
+end
+
+local out = {}
+for j = 4, #ARGV, 2 do
+    local h1, h2 = tonumber(ARGV[j]), tonumber(ARGV[j + 1])
+    local found = false
+    for f = n - 1, 0, -1 do
+        if has(prefix .. f, filters[f][1], filters[f][2], h1, h2) then found = true break end
+    end
+    if found or not add then
+        table.insert(out, found and 1 or 0)
+    else
+        local cur = n - 1
+        local bits, k = filters[cur][1], filters[cur][2]
+        for i = 0, k - 1 do
+            redis.call('SETBIT', prefix .. cur, (h1 + i * h2) % bits, 1)
+        end
+        local count = redis.call('HINCRBY', meta, 'count:' .. cur, 1)
+        if count >= tonumber(redis.call('HGET', meta, 'cap:' .. cur)) then
+            local cap = tonumber(redis.call('HGET', meta, 'cap:' .. cur)) * 2
+            local fp = tonumber(redis.call('HGET', meta, 'fp:' .. cur)) / 2
+            local nbits, nk = size(cap, fp)
+            redis.call('HSET', meta, 'filters', n + 1, 'bits:' .. n, nbits, 'k:' .. n, nk,
+                       'cap:' .. n, cap, 'fp:' .. n, fp, 'count:' .. n, 0)
+            filters[n] = {nbits, nk}
+            n = n + 1
+        end
+        table.insert(out, 0)
+    end
+end
+return out
+"""
+
+
+class RedisBloomSeenSet:
+    """Scalable Bloom filter kept as Redis bitmaps, shared by all masters."""
+
+    def __init__(self, prefix, capacity=None, fp_rate=None):
+        self.prefix = prefix
+        self.meta = f"{prefix}:meta"
+        self.capacity = capacity or Config.SEEN_SET_CAPACITY
+        # Filter i gets fp_rate / 2**(i+1); the series sums to below fp_rate.
+        self.fp_rate = fp_rate or Config.SEEN_SET_FP_RATE
+        self._script = r.register_script(_BLOOM_LUA)
+
+    def _run(self, urls, add):
+        args = ['1' if add else '0', self.capacity, self.fp_rate / 2]
+        for url in urls:
+            h1, h2 = _hash128(url)
+            args += [h1 & 0xFFFFFFFF, (h2 & 0xFFFFFFFF) | 1]
+        return self._script(keys=[self.meta, f"{self.prefix}:"], args=args)
+
+    def add_many(self, urls):
+        urls = list(urls)
+        return [found == 0 for found in self._run(urls, True)] if urls else []
+
+    def contains_many(self, urls):
+        urls = list(urls)
+        return [found == 1 for found in self._run(urls, False)] if urls else []
+
+    def stats(self):
+        meta = r.hgetall(self.meta)
+        n = int(meta.get("filters", 0))
+        items = sum(int(meta.get(f"count:{f}", 0)) for f in range(n))
+        nbytes = sum(int(meta.get(f"bits:{f}", 0)) for f in range(n)) // 8
+        return _stats("redis-bloom", items, nbytes, filters=n,
+                      false_positive_rate=self.fp_rate)
+
+    def redis_keys(self):
+        n = int(r.hget(self.meta, "filters") or 0)
+        return [self.meta] + [f"{self.prefix}:{f}" for f in range(n)]
+
+    def snapshot(self):
+        return {}
+
+    def restore(self, parts):
+        pass
+
+
+class _Bloom:
+    def __init__(self, capacity, fp_rate):
+        self.capacity, self.fp_rate = capacity, fp_rate
+        self.bits, self.k = bloom_size(capacity, fp_rate)
+        self.array = bytearray((self.bits + 7) // 8)
+        self.count = 0
+
+    def positions(self, h1, h2):
+        return [(h1 + i * h2) % self.bits for i in range(self.k)]
+
+    def has(self, h1, h2):
+        a = self.array
+        return all(a[p >> 3] & (1 << (p & 7)) for p in self.positions(h1, h2))
+
+    def add(self, h1, h2):
+        a = self.array
+        for p in self.positions(h1, h2):
+            a[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+
+class LocalBloomSeenSet:
+    """Scalable Bloom filter in this process's memory (not shared between masters)."""
+
+    def __init__(self, capacity=None, fp_rate=None):
+        self.fp_rate = fp_rate or Config.SEEN_SET_FP_RATE
+        self.filters = [_Bloom(capacity or Config.SEEN_SET_CAPACITY, self.fp_rate / 2)]
+        self._lock = threading.Lock()
+
+    def _has(self, h1, h2):
+        return any(f.has(h1, h2) for f in reversed(self.filters))
+
+    def add_many(self, urls):
+        out = []
+        with self._lock:
+            for url in urls:
+                h1, h2 = _hash128(url)
+                if self._has(h1, h2):
+                    out.append(False)
+                    continue
+                current = self.filters[-1]
+                current.add(h1, h2)
+                if current.count >= current.capacity:
+                    self.filters.append(_Bloom(current.capacity * 2, current.fp_rate / 2))
+                out.append(True)
+        return out
+
+    def contains_many(self, urls):
+        with self._lock:
+            return [self._has(*_hash128(url)) for url in urls]
+
+    def stats(self):
+        items = sum(f.count for f in self.filters)
+        nbytes = sum(len(f.array) for f in self.filters)
+        return _stats("bloom", items, nbytes, filters=len(self.filters),
+                      false_positive_rate=self.fp_rate)
+
+    def redis_keys(self):
+        return []
+
+    def snapshot(self):
+        with self._lock:
+            parts = {"filters": json.dumps([[f.capacity, f.fp_rate, f.count] for f in self.filters]).encode()}
+            for i, f in enumerate(self.filters):
+                parts[f"filter:{i}"] = bytes(f.array)
+        return parts
+
+    def restore(self, parts):
+        filters = []
+        for i, (capacity, fp_rate, count) in enumerate(json.loads(parts["filters"])):
+            f = _Bloom(capacity, fp_rate)
+            f.array[:] = parts[f"filter:{i}"]
+            f.count = count
+            filters.append(f)
+        with self._lock:
+            self.filters = filters
+
+
+class FingerprintSeenSet:
+    """
+    Exact-in-practice set of 64-bit URL fingerprints in this process: a sorted
+    array('Q') (8 bytes per URL) plus a small set of recent additions that is
+    merged in once it reaches Config.SEEN_SET_MERGE_SIZE.
+    """
+
+    def __init__(self):
+        self.sorted = array('Q')
+        self.recent = set()
+        self._lock = threading.Lock()
+
+    def _has(self, fp):
+        if fp in self.recent:
+            return True
+        i = bisect_left(self.sorted, fp)
+        return i < len(self.sorted) and self.sorted[i] == fp
+
+    def _merge(self):
+        """
+        Two-way merge of the sorted recent fingerprints into a preallocated
+        array: each gap of old fingerprints is found by bisection and copied
+        as one memoryview slice, so no Python int is made per old entry.
+        """
+        old = self.sorted
+        merged = array('Q', bytes(old.itemsize * (len(old) + len(self.recent))))
+        src, dst = memoryview(old), memoryview(merged)
+        lo = out = 0
+        for fp in sorted(self.recent):
+            i = bisect_left(old, fp, lo)
+            dst[out:out + i - lo] = src[lo:i]
+            out += i - lo
+            merged[out] = fp
+            out += 1
+            lo = i
+        dst[out:] = src[lo:]
+        src.release()
+        dst.release()
+        self.sorted, self.recent = merged, set()
+
+    def add_many(self, urls):
+        out = []
+        with self._lock:
+            for url in urls:
+                fp = _fingerprint(url)
+                new = not self._has(fp)
+                if new:
+                    self.recent.add(fp)
+                out.append(new)
+            if len(self.recent) >= Config.SEEN_SET_MERGE_SIZE:
+                self._merge()
+        return out
+
+    def contains_many(self, urls):
+        with self._lock:
+            return [self._has(_fingerprint(url)) for url in urls]
+
+    def stats(self):
+        items = len(self.sorted) + len(self.recent)
+        # set entries cost roughly 8 bytes of int payload plus ~40 of overhead
+        nbytes = self.sorted.itemsize * len(self.sorted) + 48 * len(self.recent)
+        return _stats("fingerprint", items, nbytes, false_positive_rate=items / 2 ** 64)
+
+    def redis_keys(self):
+        return []
+
+    def snapshot(self):
+        with self._lock:
+            self._merge()
+            fps = array('Q', self.sorted)
+        if sys.byteorder == 'little':
+            fps.byteswap()  # stored big-endian
+        return {"fingerprints": fps.tobytes()}
+
+    def restore(self, parts):
+        fps = array('Q')
+        fps.frombytes(parts["fingerprints"])
+        if sys.byteorder == 'little':
+            fps.byteswap()
+        with self._lock:
+            self.sorted, self.recent = fps, set()
+
+
+def make_seen_set(prefix=None):
+    """Seen-set backend selected by Config.SEEN_SET_BACKEND."""
+    prefix = prefix or Config.FRONTIER_PREFIX
+    backend = Config.SEEN_SET_BACKEND
+    if backend == "redis-bloom":
+        return RedisBloomSeenSet(f"{prefix}seen-bloom")
+    if backend == "bloom":
+        return LocalBloomSeenSet()
+    if backend == "fingerprint":
+        return FingerprintSeenSet()
+    return RedisSeenSet(f"{prefix}seen")
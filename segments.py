@@ -0,0 +1,186 @@
+# segments.py
+import gzip
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime
+import boto3
+from config import Config
+import metrics
+
+s3 = boto3.client("s3", region_name=os.getenv("AWS_REGION", "eu-north-1"))
+logger = logging.getLogger(__name__)
+
+
+def warc_record(record_type, url, body, content_type, extra_headers=None):
+    """One gzip member holding a WARC/1.0-style record."""
+    headers = [
+        ("WARC-Type", record_type),
+        ("WARC-Record-ID", f"<urn:uuid:{uuid.uuid4()}>"),
+        ("WARC-Date", datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")),
+        ("WARC-Target-URI", url),
+        ("Content-Type", content_type),
+        ("Content-Length", str(len(body))),
+    ] + list((extra_headers or {}).items())
+    head = "WARC/1.0\r\n" + "".join(f"{k}: {v}\r\n" for k, v in headers) + "\r\n"
+    return gzip.compress(head.encode() + body + b"\r\n\r\n", compresslevel=6)
+
+
+def read_record(segment_key, offset, length):
+    """Fetch a single record with a ranged GET and return its body bytes."""
+    obj = s3.get_object(
+        Bucket=os.environ['S3_BUCKET'],
+        Key=segment_key,
+        Range=f"bytes={offset}-{offset + length - 1}",
+    )
+    record = gzip.decompress(obj["Body"].read())
+    head, _, rest = record.partition(b"\r\n\r\n")
+    for line in head.split(b"\r\n"):
+        if line.lower().startswith(b"content-length:"):
+            return rest[:int(line.split(b":", 1)[1])]
+    return rest[:-4]
+
+
+class SegmentWriter:
+    """
+    Appends crawled pages to a rolling, gzip-per-record WARC-like segment
+    in memory and uploads it as one S3 object once it reaches
+    Config.SEGMENT_MAX_BYTES or Config.SEGMENT_MAX_AGE seconds. Each segment
+    is written with a small `.idx` JSON sidecar of url -> (offset, length)
+    for the html and text records, so one page can be read back with a
+    ranged GET. Callbacks passed to append() run after the segment holding
+    the page has been uploaded. A failed upload keeps its records and the
+    timer retries it; while that leaves more than Config.SEGMENT_MAX_BUFFER
+    bytes buffered, append() refuses new pages.
+    """
+
+    def __init__(self):
+        self.worker = f"{socket.gethostname()}-{os.getpid()}"
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._reset()
+        self._stop = threading.Event()
+        self._timer = threading.Thread(target=self._flush_when_old, daemon=True)
+        self._timer.start()
+
+    def _reset(self):
+        self._chunks = []
+        self._size = 0
+        self._index = {}
+        self._callbacks = []
+        self._opened = None
+
+    def append(self, url, html, text, on_stored=None):
+        """
+        Queue the page's html and text records for the current segment.
+        `on_stored(segment_key, text_offset, text_length)` is called once the
+        segment has been uploaded. Raises RuntimeError if uploads are failing
+        and the buffer is full.
+        """
+        if self._size >= Config.SEGMENT_MAX_BUFFER:
+            raise RuntimeError(f"Segment buffer full ({self._size} bytes waiting for upload)")
+        html_rec = warc_record("resource", url, html.encode(), "text/html")
+        text_rec = warc_record("conversion", url, text.encode(), "text/plain",
+                               {"WARC-Refers-To-Target-URI": url})
+        with self._lock:
+            if self._opened is None:
+                self._opened = time.monotonic()
+            html_at = self._size
+            text_at = html_at + len(html_rec)
+            self._chunks += [html_rec, text_rec]
+            self._size = text_at + len(text_rec)
+            self._index[url] = {"html": [html_at, len(html_rec)],
+                                "text": [text_at, len(text_rec)]}
+            if on_stored is not None:
+                self._callbacks.append((on_stored, text_at, len(text_rec)))
+            full = self._size >= Config.SEGMENT_MAX_BYTES
+        if full:
+            try:
+                self.flush()
+            except Exception as e:
+                # The page stays buffered; the timer retries the upload.
+                logger.error(f"Segment flush failed: {e}")
+
+    def flush(self):
+        """
+        Upload the current segment (if any) and run its callbacks. If the
+        upload fails the records go back in front of the buffer, so they
+        are retried with the next flush and their callbacks still run.
+        """
+        with self._lock:
+            if not self._chunks:
+                return None
+            chunks, index, callbacks = self._chunks, self._index, self._callbacks
+            size, opened = self._size, self._opened
+            self._seq += 1
+            key = (f"segments/{self.worker}/"
+                   f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}-{self._seq:05d}.warc.gz")
+            self._reset()
+
+        bucket = os.environ['S3_BUCKET']
+        try:
+            with metrics.timed("crawl_stage_seconds", stage="s3_put"):
+                s3.put_object(Bucket=bucket, Key=key, Body=b"".join(chunks),
+                              ContentType="application/warc")
+                s3.put_object(Bucket=bucket, Key=f"{key}.idx",
+                              Body=json.dumps(index).encode(), ContentType="application/json")
+        except Exception:
+            self._restore(chunks, index, callbacks, size, opened)
+            raise
+        logger.info(f"Flushed segment {key}: {len(index)} pages")
+        for on_stored, offset, length in callbacks:
+            try:
+                on_stored(key, offset, length)
+            except Exception as e:
+                logger.error(f"Segment callback failed for {key}: {e}")
+        return key
+
+    def _restore(self, chunks, index, callbacks, size, opened):
+        """Put a segment that failed to upload back before whatever was appended since."""
+        with self._lock:
+            for offsets in self._index.values():
+                offsets["html"][0] += size
+                offsets["text"][0] += size
+            self._callbacks = callbacks + [(on_stored, offset + size, length)
+                                           for on_stored, offset, length in self._callbacks]
+            self._chunks = chunks + self._chunks
+            self._index = {**index, **self._index}
+            self._size += size
+            self._opened = opened
+
+    def _flush_when_old(self):
+        while not self._stop.wait(1):
+            opened = self._opened
+            if opened is not None and time.monotonic() - opened >= Config.SEGMENT_MAX_AGE:
+                try:
+                    self.flush()
+                except Exception as e:
+                    logger.error(f"Segment flush failed: {e}")
+
+    def close(self):
+        self._stop.set()
+        self.flush()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_segment_writer():
+    """The segment writer of the current (possibly forked) worker process."""
+    global _writer
+    with _writer_lock:
+        if _writer is None or _writer.pid != os.getpid():
+            _writer = SegmentWriter()
+        return _writer
+
+
+def close_segment_writer():
+    """Flush whatever is buffered; called when a worker process shuts down."""
+    if _writer is not None and _writer.pid == os.getpid():
+        _writer.close()
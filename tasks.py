@@ -1,11 +1,17 @@
-import json
+import logging
+import math
 import time
 import threading
 import os
 from kombu.utils.url import safequote
 from celery import Celery
+from celery.signals import worker_process_init, worker_process_shutdown
 from redis_clinet import r
 from config import Config
+from result_stream import publish_result
+import metrics
+
+logger = logging.getLogger(__name__)
 
 app = Celery('crawler')
 print("broker_url           :", app.conf.broker_url)
@@ -34,93 +40,289 @@ app.conf.result_backend = None
 app.conf.task_ignore_result = True     
 
 
-def _hb_loop(redis_key: str, member: str, stop_event: threading.Event,
-             interval: int = 2) -> None:
+# Crawler resources (HTTP pools, event loop, DNS cache) live for the whole
+# worker process instead of being rebuilt for every task.
+_crawler = None
+
+
+def get_crawler():
+    """This worker process's CrawlerNode, created on first use."""
+    global _crawler
+    if _crawler is None:
+        from crawler_node import CrawlerNode
+        _crawler = CrawlerNode()
+    return _crawler
+
+
+_indexer = None
+
+
+def get_indexer():
+    """This worker process's IndexerNode (and bulk buffer), created on first use."""
+    global _indexer
+    if _indexer is None or _indexer.pid != os.getpid():
+        from indexer_node import IndexerNode
+        _indexer = IndexerNode(on_indexed=_indexed)
+    return _indexer
+
+
+def _indexed(results) -> None:
+    """Bulk request done: the index tasks whose documents it carried are finished."""
+    from search_service import bump_generation
+    pipe = r.pipeline(transaction=False)
+    if any(ok for _indexer_id, ok in results):
+        bump_generation(pipe)  # cached search results are stale now
+    end_tasks("active_indexers", "pending_urls_to_index",
+              [indexer_id for indexer_id, _ok in results], pipe)
+    metrics.flush()
+
+
+@worker_process_init.connect
+def init_worker_process(**kwargs):
+    from http_resources import install_dns_cache
+    install_dns_cache()
+    # The CrawlerNode / IndexerNode are created on first use (get_crawler(),
+    # get_indexer()), so an indexer-only worker never builds a crawler.
+
+
+class _Heartbeat:
     """
-    Internal loop that updates the score of `member` in ZSET `redis_key`
-    every `interval` seconds until `stop_event` is set.
+    One daemon thread per worker process that refreshes the heartbeat of
+    every task currently running in it: a single pipelined ZADD per ZSET
+    every `interval` seconds, however many tasks (or batch URLs) are live.
     """
-    while not stop_event.wait(interval):
-        r.zadd(redis_key, {member: time.time()})
 
-def start_heartbeat(redis_key: str, member: str,
-                    interval: int = 2) -> tuple[threading.Event, threading.Thread]:
+    def __init__(self, interval: int):
+        self.interval = interval
+        self.members: dict[str, set[str]] = {}
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+
+    def add(self, redis_key: str, members) -> None:
+        with self.lock:
+            self.members.setdefault(redis_key, set()).update(members)
+            # Started lazily (and again after a fork) in the process that runs tasks.
+            if self.thread is None or self.pid != os.getpid() or not self.thread.is_alive():
+                self.pid = os.getpid()
+                self.thread = threading.Thread(target=self._loop, daemon=True)
+                self.thread.start()
+
+    def discard(self, redis_key: str, members) -> None:
+        with self.lock:
+            self.members.get(redis_key, set()).difference_update(members)
+
+    def _loop(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                snapshot = {key: list(m) for key, m in self.members.items() if m}
+            if not snapshot:
+                continue
+            now = time.time()
+            try:
+                pipe = r.pipeline(transaction=False)
+                for key, members in snapshot.items():
+                    pipe.zadd(key, {m: now for m in members})
+                pipe.execute()
+            except Exception as e:
+                logger.error(f"Heartbeat failed: {e}")
+
+
+_heartbeat = _Heartbeat(Config.HEARTBEAT_INTERVAL)
+
+
+def pending_entry(url: str, depth: int, job_id: str | None = None) -> str:
+    """Fail-over record of a running task: "url|depth", plus "|job" for job crawls."""
+    return f"{url}|{depth}|{job_id}" if job_id else f"{url}|{depth}"
+
+
+def begin_tasks(active_key: str, pending_key: str, entries: dict[str, str]) -> None:
+    """
+    Register running tasks {task_id: "url|depth"} in one round trip: the
+    pending entry (for fail-over) and the first heartbeat, so the master can
+    see the task even if it dies before the next beat.
+    """
+    pipe = r.pipeline(transaction=False)
+    pipe.hset(pending_key, mapping=entries)
+    pipe.zadd(active_key, {task_id: time.time() for task_id in entries})
+    pipe.execute()
+    _heartbeat.add(active_key, entries)
+
+
+def end_tasks(active_key: str, pending_key: str, task_ids, pipe=None) -> None:
     """
-    Helper called **inside the Celery task**.  It:
-      1. Immediately writes the first heartbeat, so the master can see the
-         task even if it dies within < interval seconds.
-      2. Spawns a daemon thread that keeps the heartbeat fresh.
-    Returns (stop_event, thread) so the caller can shut it down in 'finally'.
+    Drop finished tasks from the heartbeat and from Redis. Pass a pipeline to
+    send the cleanup together with other writes (e.g. the published result).
     """
-    # ❶ INITIAL BEAT
-    r.zadd(redis_key, {member: time.time()})
+    task_ids = list(task_ids)
+    _heartbeat.discard(active_key, task_ids)
+    pipe = pipe if pipe is not None else r.pipeline(transaction=False)
+    pipe.zrem(active_key, *task_ids)
+    pipe.hdel(pending_key, *task_ids)
+    pipe.execute()
 
-    # ❷ Threaded updates
-    stop_event = threading.Event()
-    t = threading.Thread(
-        target=_hb_loop,
-        args=(redis_key, member, stop_event, interval),
-        daemon=True                 # make the thread daemonic
-    )
-    t.start()
-    return stop_event, t
+
+# A page that went into the segment buffer has its result published at once
+# (the master needs its links), but the crawl's fail-over entry and heartbeat
+# stay until the segment is uploaded: if the worker dies first, the master
+# crawls the page again. STORING_CRAWLERS tells the master those crawls
+# already have a result, so the re-crawl is not counted as a lost one.
+STORING_CRAWLERS = "storing_crawlers"
+_storing = {}           # url -> crawler ids waiting for the upload, oldest first
+_stored_early = set()   # urls uploaded before their task got to hold them
+_storing_lock = threading.Lock()
+
+
+def hold_until_stored(crawler_id: str, result: dict, pipe) -> bool:
+    """
+    Keep a crawl task registered while its page waits in the segment buffer
+    (result "stored" is False). Executes `pipe`. Returns True if the task is
+    held; segment_stored() ends it.
+    """
+    if result.get("stored") is not False:
+        return False
+    pipe.sadd(STORING_CRAWLERS, crawler_id)
+    pipe.execute()
+    with _storing_lock:
+        if result["url"] not in _stored_early:
+            _storing.setdefault(result["url"], []).append(crawler_id)
+            return True
+        _stored_early.discard(result["url"])
+    pipe.srem(STORING_CRAWLERS, crawler_id)
+    return False
+
+
+def segment_stored(url: str) -> None:
+    """The segment holding `url`'s page was uploaded: end the crawl task held for it."""
+    with _storing_lock:
+        waiting = _storing.get(url)
+        if not waiting:
+            _stored_early.add(url)
+            return
+        crawler_id = waiting.pop(0)
+        if not waiting:
+            del _storing[url]
+    pipe = r.pipeline(transaction=False)
+    pipe.srem(STORING_CRAWLERS, crawler_id)
+    end_tasks("active_crawlers", "pending_urls_to_crawl", [crawler_id], pipe)
 
 
 @app.task(name='crawl_page', queue='crawler')
-def crawl_page(url: str, depth: int):
+def crawl_page(url: str, depth: int, job_id: str | None = None):
     """
-    Celery task that wraps CrawlerNode.crawl.
+    Celery task that wraps CrawlerNode.crawl for one URL of crawl job `job_id`.
     Adds proper heartbeat handling and cleanup.
     """
-    from crawler_node import CrawlerNode
+    from http_resources import flush_stats
 
-    crawler = CrawlerNode()
+    crawler = get_crawler()
     crawler_id = f"crawler_{crawl_page.request.id}"
 
-    # Remember what this task is working on (for fail-over)
-    r.hset("pending_urls_to_crawl", crawler_id, f"{url}|{depth}")
-
-    # Start heartbeat
-    stop_evt, hb_thread = start_heartbeat("active_crawlers", crawler_id,
-                                          interval=Config.HEARTBEAT_INTERVAL)
+    # Remember what this task is working on (for fail-over) and start beating
+    begin_tasks("active_crawlers", "pending_urls_to_crawl",
+                {crawler_id: pending_entry(url, depth, job_id)})
 
+    # Finished result + cleanup go out in one pipeline in 'finally'
+    pipe = r.pipeline(transaction=False)
+    held = False
     try:
         result = crawler.crawl(url, depth)
-        r.hset("finished_crawls", crawler_id, "done")
-        r.set(f"crawl_result:{crawler_id}", json.dumps(result))
+        if result["status"] == "deferred":
+            # Host is inside its politeness window: hand the URL back to the
+            # queue with a delay so this worker can take pages for other hosts.
+            crawl_page.apply_async((url, depth, job_id),
+                                   countdown=math.ceil(result["retry_after"]))
+            return result
+        publish_result(crawler_id, dict(result, job=job_id), pipe)
+        held = hold_until_stored(crawler_id, result, pipe)
         return result
 
     except Exception as exc:
-        r.hset("finished_crawls", crawler_id, "error")
-        r.set(f"crawl_result:{crawler_id}",
-              json.dumps({"error": str(exc), "depth": depth}))
+        publish_result(crawler_id, {"url": url, "status": "error", "error": str(exc),
+                                    "depth": depth, "job": job_id}, pipe)
         raise
 
     finally:
-        # Stop heartbeat and clean Redis bookkeeping
-        stop_evt.set()
-        hb_thread.join()                    # wait for thread to finish
-        r.zrem("active_crawlers", crawler_id)
-        r.hdel("pending_urls_to_crawl", crawler_id)
+        if not held:
+            end_tasks("active_crawlers", "pending_urls_to_crawl", [crawler_id], pipe)
+        flush_stats()
+        metrics.flush()
 
 
-@app.task(name='index_content', queue='indexer')
-def index_content(url: str, depth: int, s3_key: str):
-    from indexer_node import IndexerNode
+@app.task(name='crawl_batch', queue='crawler')
+def crawl_batch(items: list, job_id: str | None = None):
+    """
+    Celery task that crawls a list of [url, depth] pairs of crawl job
+    `job_id` with the asyncio engine (CrawlerNode.crawl_many). Every URL gets its own crawler_id so
+    the master's fail-over and finished-task handling work per URL; each
+    result is published as soon as that URL is done.
+    """
+    from http_resources import flush_stats
 
-    indexer = IndexerNode()
-    indexer_id = f"indexer_{index_content.request.id}"
+    crawler = get_crawler()
+    ids = {url: f"crawler_{crawl_batch.request.id}_{i}"
+           for i, (url, _depth) in enumerate(items)}
 
-    r.hset("pending_urls_to_index", indexer_id, f"{url}|{depth}")
+    begin_tasks("active_crawlers", "pending_urls_to_crawl",
+                {ids[url]: pending_entry(url, depth, job_id) for url, depth in items})
+    done = set()
 
-    stop_evt, hb_thread = start_heartbeat("active_indexers", indexer_id,
-                                          interval=Config.HEARTBEAT_INTERVAL)
+    def publish(result):
+        crawler_id = ids[result["url"]]
+        pipe = r.pipeline(transaction=False)
+        publish_result(crawler_id, dict(result, job=job_id), pipe)
+        if not hold_until_stored(crawler_id, result, pipe):
+            end_tasks("active_crawlers", "pending_urls_to_crawl", [crawler_id], pipe)
+        done.add(crawler_id)
 
     try:
-        return indexer.add_to_index(url, s3_key)
+        return crawler.crawl_many([(url, depth) for url, depth in items],
+                                  on_result=publish)
 
     finally:
-        stop_evt.set()
-        hb_thread.join()
-        r.zrem("active_indexers", indexer_id)
-        r.hdel("pending_urls_to_index", indexer_id) 
+        left = [crawler_id for crawler_id in ids.values() if crawler_id not in done]
+        if left:
+            end_tasks("active_crawlers", "pending_urls_to_crawl", left)
+        flush_stats()
+        metrics.flush()
+
+
+@worker_process_shutdown.connect
+def shutdown_worker_process(**kwargs):
+    """Upload any pages still buffered in this process's crawl segment, index buffered documents and close pools."""
+    global _crawler
+    from segments import close_segment_writer
+    from http_resources import flush_stats
+    close_segment_writer()
+    if _indexer is not None and _indexer.pid == os.getpid():
+        _indexer.close()
+    flush_stats()
+    metrics.flush(force=True)
+    if _crawler is not None:
+        _crawler.close()
+        _crawler = None
+
+
+@app.task(name='index_content', queue='indexer')
+def index_content(url: str, depth: int, s3_key: str,
+                  offset: int | None = None, length: int | None = None):
+    """
+    Index one page. The text is either its own S3 object (`s3_key`) or, for
+    pages stored by the segment writer, the record at (`offset`, `length`)
+    inside segment `s3_key`. The document joins this process's next bulk
+    request; the task stays registered (and heart-beating) until that
+    request is done, so a worker dying with buffered documents is failed over.
+    """
+    indexer = get_indexer()
+    indexer_id = f"indexer_{index_content.request.id}"
+
+    begin_tasks("active_indexers", "pending_urls_to_index", {indexer_id: f"{url}|{depth}"})
+
+    try:
+        indexer.add_to_index(url, s3_key, offset, length, tag=indexer_id)
+    except Exception:
+        end_tasks("active_indexers", "pending_urls_to_index", [indexer_id])
+        raise
+    finally:
+        metrics.flush()
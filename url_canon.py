@@ -0,0 +1,128 @@
+# url_canon.py
+import posixpath
+import re
+from functools import lru_cache
+from urllib.parse import urlsplit, urlunsplit, unquote_plus
+from config import Config
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+TRACKING_PARAMS = frozenset([
+    'gclid', 'dclid', 'fbclid', 'msclkid', 'yclid', 'mc_cid', 'mc_eid',
+    '_ga', '_gl', 'igshid', 'ref_src',
+])
+TRACKING_PREFIXES = ('utm_',)
+PERCENT_RE = re.compile(r'%[0-9a-fA-F]{2}')
+
+DEFAULT_RULE = {
+    'drop_params': (),             # extra query params to strip for this domain
+    'keep_params': None,           # if set, only these query params survive
+    'sort_query': True,
+    'strip_trailing_slash': False, # opt in per domain where /a and /a/ are the same page
+    'lowercase_path': False,
+}
+
+
+def rule_for(host):
+    """Canonicalization rule for `host`: the longest matching domain suffix in Config.URL_CANON_RULES."""
+    labels = host.split('.')
+    for i in range(len(labels)):
+        rule = Config.URL_CANON_RULES.get('.'.join(labels[i:]))
+        if rule is not None:
+            return {**DEFAULT_RULE, **rule}
+    return DEFAULT_RULE
+
+
+def _upper_escapes(text):
+    return PERCENT_RE.sub(lambda m: m.group(0).upper(), text)
+
+
+def _normalize_path(path, rule):
+    if not path:
+        return '/'
+    path = _upper_escapes(path)
+    trailing = path.endswith('/')
+    path = posixpath.normpath(path)
+    if path.startswith('//'):
+        path = '/' + path.lstrip('/')
+    if path == '.':
+        path = '/'
+    if trailing and path != '/' and not rule['strip_trailing_slash']:
+        path += '/'
+    if rule['lowercase_path']:
+        path = path.lower()
+    return path
+
+
+def _normalize_query(query, rule):
+    """
+    Drop and sort params by their decoded name but keep each param's text
+    as it was (only %xx escapes upper-cased), so "?flag" stays distinct from
+    "?flag=" and "%20" from "+".
+    """
+    if not query:
+        return ''
+    drop = TRACKING_PARAMS.union(rule['drop_params'])
+    keep = rule['keep_params']
+    params = []
+    for param in query.split('&'):
+        if not param:
+            continue
+        k = unquote_plus(param.split('=', 1)[0])
+        if (k.lower() not in drop and not k.lower().startswith(TRACKING_PREFIXES)
+                and (keep is None or k in keep)):
+            params.append((k, _upper_escapes(param)))
+    if rule['sort_query']:
+        params.sort(key=lambda kv: kv[0])
+    return '&'.join(param for _k, param in params)
+
+
+@lru_cache(maxsize=65536)
+def canonicalize(url):
+    """
+    Canonical form of an absolute http(s) URL, used wherever a URL enters the
+    frontier or the crawled set:
+    lower-case scheme and host, no default port, no fragment, dot segments
+    resolved, tracking params (utm_*, gclid, ...) removed and the remaining
+    query params sorted. Per-domain rules in Config.URL_CANON_RULES can
+    change the path/query handling, e.g. strip trailing slashes.
+    Non-http(s) or unparsable URLs are returned stripped but otherwise as-is.
+    """
+    url = url.strip()
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return url
+    scheme = parts.scheme.lower()
+    if scheme not in DEFAULT_PORTS or not parts.hostname:
+        return url
+    host = parts.hostname.rstrip('.')
+    rule = rule_for(host)
+    netloc = f"[{host}]" if ':' in host else host
+    if port and port != DEFAULT_PORTS[scheme]:
+        netloc = f"{netloc}:{port}"
+    if parts.username:
+        userinfo = parts.username + (f":{parts.password}" if parts.password else '')
+        netloc = f"{userinfo}@{netloc}"
+    return urlunsplit((scheme, netloc, _normalize_path(parts.path, rule),
+                       _normalize_query(parts.query, rule), ''))
+
+
+def canonical_links(links):
+    """
+    Canonicalize and de-duplicate `links`, keeping first-seen order.
+    Returns (links, collapsed) where `collapsed` counts links that were only
+    duplicates of an earlier one after canonicalization.
+    """
+    seen_raw, seen, out, collapsed = set(), set(), [], 0
+    for link in links:
+        if link in seen_raw:
+            continue
+        seen_raw.add(link)
+        canonical = canonicalize(link)
+        if canonical in seen:
+            collapsed += 1
+            continue
+        seen.add(canonical)
+        out.append(canonical)
+    return out, collapsed
@@ -1,8 +1,8 @@
 #!/usr/bin/env python3
 import os, logging, requests
-from flask import Flask, request, render_template_string, redirect, url_for, jsonify
+from flask import Flask, Response, request, render_template_string, redirect, url_for, jsonify, stream_with_context
 from master_node import MasterNode
-from indexer_node import IndexerNode
+from search_service import search_service
 from datetime import datetime
 
 logging.basicConfig(
@@ -111,14 +111,16 @@ def crawl():
         depth = int(request.form.get("depth", "1"))
         domains = request.form.get("domains", "")
         url_list = [u.strip() for u in urls.split(",") if u.strip()]
+        domain_list = [d.strip() for d in domains.split(",") if d.strip()]
         try:
             resp = requests.post(
                 f"{MASTER_URL}/seed",
-                json={"urls": url_list, "depth": depth, "domains": domains},
+                json={"urls": url_list, "depth": depth, "domains": domain_list},
                 timeout=5,
             )
             resp.raise_for_status()
-            logger.info("Sent %s URLs to master (%s)", len(url_list), resp.status_code)
+            logger.info("Sent %s URLs to master as job %s (%s)", len(url_list),
+                        resp.json().get("job"), resp.status_code)
         except Exception as exc:
             logger.error("Error contacting master: %s", exc)
         return redirect(url_for("home"))
@@ -154,11 +156,10 @@ def crawl():
 
 @app.route("/search", methods=["GET", "POST"])
 def search():
-    indexer = IndexerNode()
     results, query = [], ""
     if request.method == "POST":
         query = request.form.get("query", "").strip()
-        results = indexer.search(query)
+        results = search_service.search(query)
 
     search_html = """
       <div class="row justify-content-center">
@@ -193,14 +194,24 @@ def search():
     return render_page("Search", search_html, results=results, query=query)
 
 
+@app.route("/search/stats")
+def search_stats():
+    """Search cache hits/misses and latency of this web process."""
+    return jsonify(search_service.stats())
+
+
 @app.route("/monitor")
 def monitor():
     try:
-        data = requests.get(f"{MASTER_URL}/state", timeout=5).json()
+        data = requests.get(f"{MASTER_URL}/state", params={"limit": 20}, timeout=5).json()
         active_crawlers = data.get("active_crawlers", [])
         active_indexers = data.get("active_indexers", [])
         urls_in_queue   = data.get("urls_in_queue",   [])
         urls_crawled    = data.get("urls_crawled",    [])
+        queue_count     = data.get("urls_in_queue_count", len(urls_in_queue))
+        crawled_count   = data.get("urls_crawled_count",  len(urls_crawled))
+        crawler_count   = data.get("active_crawlers_count", len(active_crawlers))
+        indexer_count   = data.get("active_indexers_count", len(active_indexers))
     except Exception as exc:
         # Show a friendly error message if the master is unreachable
         error_html = f"""
@@ -219,7 +230,7 @@ def monitor():
           <div class="card shadow-sm border-success h-100">
             <div class="card-body">
               <h6 class="card-subtitle text-muted">Active Crawlers</h6>
-              <h2 class="display-6 text-success">{{ ac|length }}</h2>
+              <h2 class="display-6 text-success" id="acn">{{ acn }}</h2>
             </div>
           </div>
         </div>
@@ -227,7 +238,7 @@ def monitor():
           <div class="card shadow-sm border-info h-100">
             <div class="card-body">
               <h6 class="card-subtitle text-muted">Active Indexers</h6>
-              <h2 class="display-6 text-info">{{ ai|length }}</h2>
+              <h2 class="display-6 text-info" id="ain">{{ ain }}</h2>
             </div>
           </div>
         </div>
@@ -235,7 +246,7 @@ def monitor():
           <div class="card shadow-sm border-warning h-100">
             <div class="card-body">
               <h6 class="card-subtitle text-muted">URLs in Queue</h6>
-              <h2 class="display-6 text-warning">{{ q|length }}</h2>
+              <h2 class="display-6 text-warning" id="qn">{{ qn }}</h2>
             </div>
           </div>
         </div>
@@ -243,12 +254,27 @@ def monitor():
           <div class="card shadow-sm border-secondary h-100">
             <div class="card-body">
               <h6 class="card-subtitle text-muted">URLs Crawled</h6>
-              <h2 class="display-6 text-secondary">{{ c|length }}</h2>
+              <h2 class="display-6 text-secondary" id="cn">{{ cn }}</h2>
             </div>
           </div>
         </div>
       </div>
 
+      <h4 class="mb-3">Search</h4>
+      <div class="row text-center mb-4">
+        {% for label, key in [("Cache Hits", "hits"), ("Cache Misses", "misses"), ("Hit Rate", "hit_rate"),
+                              ("p50 Latency (ms)", "p50_ms"), ("p99 Latency (ms)", "p99_ms")] %}
+        <div class="col mb-3">
+          <div class="card shadow-sm h-100">
+            <div class="card-body">
+              <h6 class="card-subtitle text-muted">{{ label }}</h6>
+              <h2 class="display-6" id="search-{{ key }}">{{ search[key] }}</h2>
+            </div>
+          </div>
+        </div>
+        {% endfor %}
+      </div>
+
       <!-- Detailed lists ------------------------------------------------- -->
       <div class="row">
         <div class="col-md-6">
@@ -277,17 +303,55 @@ def monitor():
           {% endif %}
         </div>
       </div>
+
+      <script>
+        // Live counters: the master pushes only the fields that changed.
+        const fields = {active_crawlers_count: "acn", active_indexers_count: "ain",
+                        urls_in_queue_count: "qn", urls_crawled_count: "cn"};
+        const apply = (e) => {
+          const d = JSON.parse(e.data);
+          for (const [k, id] of Object.entries(fields)) {
+            if (k in d) document.getElementById(id).textContent = d[k];
+          }
+        };
+        const es = new EventSource("/monitor/stream");
+        es.addEventListener("state", apply);
+        es.addEventListener("delta", apply);
+
+        // Search stats live in this web process, not on the master.
+        setInterval(async () => {
+          const d = await (await fetch("/search/stats")).json();
+          for (const k of ["hits", "misses", "hit_rate", "p50_ms", "p99_ms"]) {
+            document.getElementById("search-" + k).textContent = d[k];
+          }
+        }, 5000);
+      </script>
     """
     return render_page(
         "Monitor",
         monitor_html,
         ac=active_crawlers,
         ai=active_indexers,
+        acn=crawler_count,
+        ain=indexer_count,
         q=urls_in_queue,
         c=urls_crawled,
+        qn=queue_count,
+        cn=crawled_count,
+        search=search_service.stats(),
     )
 
 
+@app.route("/monitor/stream")
+def monitor_stream():
+    """Relay the master's /state/stream (server-sent events) to the browser."""
+    def relay():
+        with requests.get(f"{MASTER_URL}/state/stream", stream=True, timeout=(5, None)) as resp:
+            for chunk in resp.iter_content(chunk_size=None):
+                yield chunk
+    return Response(stream_with_context(relay()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
+    app.run(host="0.0.0.0", port=5000, debug=True, threaded=True)
\ No newline at end of file